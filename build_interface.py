@@ -77,6 +77,14 @@ if python3:
     # python3 version
     SO_FILE_PATTERN = 'ecmwfbufr.cpython*.so'
 
+# the library routines that decode an encoded BUFR message, which is
+# only read by them, so their kbuff argument gets intent(in)
+DECODING_ROUTINES = ['bufrex', 'bus012', 'bus0123']
+
+# the scalar outputs of busel2, which get intent(out) so they are
+# returned by the interface (a scalar can not be updated in place)
+BUSEL2_OUTPUT_SCALARS = ['ktdlen', 'ktdexl', 'kerr']
+
 #  #]
 
 #  #[ some helper functions
@@ -576,14 +584,18 @@ def adapt_f2py_signature_file(signature_file, integer_sizes, set_jelem):
     inside_subroutine = False
     inside_retrieve_settings = False
     inside_pbbufr_sign = False
+    current_subroutine = None
     for line in lines:
 
         mod_line = line
 
         if 'end subroutine' in mod_line:
             inside_subroutine = False
+            current_subroutine = None
         elif 'subroutine' in mod_line:
             inside_subroutine = True
+            current_subroutine = \
+                  mod_line.split('subroutine')[1].split('(')[0].strip()
 
         if 'end subroutine retrieve_settings' in mod_line:
             inside_retrieve_settings = False
@@ -612,6 +624,18 @@ def adapt_f2py_signature_file(signature_file, integer_sizes, set_jelem):
                         # explicitely add intent(out)
                         # this seems needed for the python3 case!
                         mod_line = part1+',intent(out) ::'+part2
+                    elif ( (current_subroutine in DECODING_ROUTINES) and
+                           (part2.strip() == 'kbuff') ):
+                        # the decoding routines only read the encoded
+                        # message. With intent(inplace) f2py copies any
+                        # read-only array (like the views on the file data
+                        # returned by RawBUFRFile) and swaps the copy into
+                        # the array object of the caller, while intent(in)
+                        # passes an aligned array without copying it.
+                        mod_line = part1+',intent(in) ::'+part2
+                    elif ( (current_subroutine == 'busel2') and
+                           (part2.strip() in BUSEL2_OUTPUT_SCALARS) ):
+                        mod_line = part1+',intent(out) ::'+part2
                     else:
                         mod_line = part1+',intent(inplace) ::'+part2
 
@@ -21,7 +21,6 @@ import sys # operating system functions
 
 # import the python file defining the RawBUFRFile class
 from pybufr_ecmwf.raw_bufr_file import RawBUFRFile
-from pybufr_ecmwf.bufr_interface_ecmwf import BUFRInterfaceECMWF
 
 #  #]
 
@@ -39,14 +38,11 @@ def print_bufr_data_category(input_bufr_file):
     # an array of pointers to the start and end of each BUFR message
     rbf.open(input_bufr_file, 'rb')
 
-    # extract the number of BUFR messages from the file
-    num_msgs = rbf.get_num_bufr_msgs()
+    # extract the headers of all BUFR messages in python
+    # (this does not need the ECMWF library)
+    catalogue = rbf.get_header_catalogue()
 
-    for msg_nr in range(1, num_msgs+1):
-        raw_msg = rbf.get_raw_bufr_msg(msg_nr)[0]
-        bufr_obj = BUFRInterfaceECMWF(encoded_message=raw_msg)
-        bufr_obj.decode_sections_012()
-        data_category = bufr_obj.ksec1[11-1]
+    for (msg_nr, data_category) in enumerate(catalogue['data_category'], 1):
         print('BUFR msg %i has data category %i' % (msg_nr, data_category))
 
     # close the file
@@ -37,7 +37,8 @@ from __future__ import (absolute_import, division,
 import sys # os
 import numpy   # array functionality
 from .raw_bufr_file import RawBUFRFile
-from .bufr_interface_ecmwf import BUFRInterfaceECMWF
+from .header_catalogue import make_header_filter
+from .bufr_interface_ecmwf import BUFRInterfaceECMWF, DecodeBuffers
 from .helpers import python3
 from .custom_exceptions import \
      (NoMsgLoadedError, CannotExpandFlagsError,
@@ -77,7 +78,9 @@ class BUFRMessage_R:
                  table_b_to_use, table_c_to_use,
                  table_d_to_use, tables_dir,
                  expand_strings, nr_of_descriptors_startval,
-                 nr_of_descriptors_maxval, nr_of_descriptors_multiplier):
+                 nr_of_descriptors_maxval, nr_of_descriptors_multiplier,
+                 table_setup_cache=None, decode_buffers=None,
+                 copy_on_yield=False):
         #  #[ initialise and decode
         ''' delegate the actual work to BUFRInterfaceECMWF '''
         self._bufr_obj = BUFRInterfaceECMWF(raw_msg,
@@ -86,15 +89,39 @@ class BUFRMessage_R:
                                             expand_flags=expand_flags,
                                             verbose=verbose)
 
+        # the optional decode_buffers provide reusable arrays for decoding,
+        # in which case the data of this message is only valid until
+        # the next message is decoded, unless copy_on_yield is set
+        # (see detach_values)
+        self._bufr_obj.decode_buffers = decode_buffers
+        self.copy_on_yield = copy_on_yield
+
         self._bufr_obj.nr_of_descriptors_startval = nr_of_descriptors_startval
         self._bufr_obj.nr_of_descriptors_maxval = nr_of_descriptors_maxval
         self._bufr_obj.nr_of_descriptors_multiplier = nr_of_descriptors_multiplier
 
-        self._bufr_obj.decode_sections_012()
-        self._bufr_obj.setup_tables(table_b_to_use, table_c_to_use,
-                                    table_d_to_use, tables_dir)
+        # extract the header items needed to setup the tables
+        # in python, so bufrex is the only library call needed to decode
+        self._bufr_obj.extract_sections_012()
+
+        # the optional table_setup_cache dict remembers the table setup
+        # of the previous message, which can be reused as long as the
+        # header items that determine the tables do not change
+        key = (self._bufr_obj.get_table_setup_key(),
+               table_b_to_use, table_c_to_use, table_d_to_use, tables_dir)
+        if ( (table_setup_cache is not None) and
+             (table_setup_cache.get('key') == key) ):
+            if verbose:
+                print('reusing the BUFR tables setup of the previous message')
+            self._bufr_obj.reuse_table_setup(table_setup_cache['setup'])
+        else:
+            self._bufr_obj.setup_tables(table_b_to_use, table_c_to_use,
+                                        table_d_to_use, tables_dir)
+            if table_setup_cache is not None:
+                table_setup_cache['key'] = key
+                table_setup_cache['setup'] = self._bufr_obj.get_table_setup()
+
         self._bufr_obj.decode_data()
-        self._bufr_obj.decode_sections_0123()
         self._bufr_obj.fill_descriptor_list_subset(subset=1)
         self.msg_index = msg_index
         self.expand_flags = expand_flags
@@ -146,7 +173,7 @@ class BUFRMessage_R:
         vals = self._bufr_obj.get_values(descr_nr,
                                          autoget_cval=self.expand_strings)
 
-        return vals
+        return self.detach_values(vals)
         #  #]
     def get_subset_values(self, subset_nr):
          #  #[
@@ -163,7 +190,7 @@ class BUFRMessage_R:
         vals = self._bufr_obj.get_subset_values(subset_nr,
                                             autoget_cval=self.expand_strings)
 
-        return vals
+        return self.detach_values(vals)
         #  #]
     def get_values_as_2d_array(self):
         #  #[
@@ -205,6 +232,9 @@ class BUFRMessage_R:
         result = self._bufr_obj.values.reshape(
             (factor, self._bufr_obj.actual_kelem))[:num_subsets, :num_elements]
 
+        # the values array may be a view on reusable decode buffers
+        result = self.detach_values(result)
+
         # autoget_cval option not functional yet
         # for data retrieval in a 2D numpy array
         # this is delegated to self.get_subset_values()
@@ -212,6 +242,51 @@ class BUFRMessage_R:
         
         return result
         #  #]
+    def get_ragged_values(self):
+        #  #[
+        """
+        a convenience method to retrieve all data in a bufr message,
+        also if the template uses delayed replication, as a tuple
+        (values, offsets, codes). The values of subset i (counting
+        from 0) are values[offsets[i]:offsets[i+1]] and codes holds the
+        expanded descriptor for each value.
+        """
+        if (self.msg_index == -1):
+            txt = 'Sorry, no BUFR messages available'
+            raise NoMsgLoadedError(txt)
+
+        (values, offsets, codes) = self._bufr_obj.get_ragged_values()
+        return (self.detach_values(values), offsets, codes)
+        #  #]
+    def get_categorical_values(self, descr_nr):
+        #  #[
+        """
+        for a code or flag table element, request the codes of the given
+        descriptor number for all subsets, together with the labels
+        (see BUFRInterfaceECMWF.get_categorical_values)
+        """
+        if (self.msg_index == -1):
+            raise NoMsgLoadedError
+
+        self._bufr_obj.delayed_repl_check_for_incorrect_use()
+        result = self._bufr_obj.get_categorical_values(descr_nr)
+        if result is None:
+            return None
+        (codes, labels) = result
+        return (self.detach_values(codes), labels)
+        #  #]
+    def detach_values(self, values):
+        #  #[
+        """
+        if copy_on_yield is set, return a copy of the given array if it
+        shares memory with the (possibly reused) decoding arrays, so it
+        remains valid after the next message has been decoded
+        """
+        if ( self.copy_on_yield and isinstance(values, numpy.ndarray) and
+             numpy.may_share_memory(values, self._bufr_obj.values) ):
+            return values.copy()
+        return values
+        #  #]
     def get_names_and_units(self, subset=1):
         #  #[ request name and unit of each descriptor for the given subset
         '''
@@ -314,10 +389,21 @@ class BUFRMessage_R:
             # no 2D representation possible. Return 1D arrays instead. If
             # there are multiple subsets yield them one after the other.
             nsubsets = self.get_num_subsets()
+
+            # without delayed replication, all subsets can be
+            # expanded at once, one column at a time
+            values_2d = None
+            if not self._bufr_obj.delayed_repl_present:
+                values_2d = self._bufr_obj.get_values_as_2d_object_array(
+                    autoget_cval=self.expand_strings)
+
             for subs in range(1, nsubsets+1):
                 self.current_subset = subs
                 names, units = self.get_names_and_units(subs)
-                values = self.get_subset_values(subs)
+                if values_2d is not None:
+                    values = self.detach_values(values_2d[subs-1, :])
+                else:
+                    values = self.get_subset_values(subs)
                 self.data = values
                 self.names = names
                 self.units = units
@@ -711,7 +797,8 @@ class BUFRReaderBUFRDC:
     """
     def __init__(self, input_bufr_file, warn_about_bufr_size=True,
                  expand_flags=False, expand_strings=False,
-                 verbose=False):
+                 verbose=False, use_mmap=False, copy_on_yield=False,
+                 use_index=False, where=None, reuse_buffers=False):
         #  #[
         # get an instance of the RawBUFRFile class
         self._rbf = RawBUFRFile(warn_about_bufr_size=warn_about_bufr_size)
@@ -721,10 +808,22 @@ class BUFRReaderBUFRDC:
         # open the file for reading, count nr of BUFR messages in it
         # and store its content in memory, together with
         # an array of pointers to the start and end of each BUFR message
-        self._rbf.open(input_bufr_file, 'rb')
+        # (or in case of use_mmap, just map the file and locate
+        #  the BUFR messages one by one while iterating over them)
+        # If use_index is set, the locations are stored in (or taken from)
+        # a sidecar index file (see RawBUFRFile.open)
+        # In stead of a filename, the BUFR data itself (bytes, bytearray,
+        # memoryview or numpy array) or a binary file object may be
+        # given (see RawBUFRFile.open_data)
+        self._rbf.open(input_bufr_file, 'rb', use_mmap=use_mmap,
+                       use_index=use_index)
     
         # extract the number of BUFR messages from the file
-        self.num_msgs = self._rbf.get_num_bufr_msgs()
+        # (this would require a full scan in the use_mmap case,
+        #  so then it remains None, unless an index was available)
+        self.num_msgs = None
+        if (not use_mmap) or self._rbf.index_complete:
+            self.num_msgs = self._rbf.get_num_bufr_msgs()
 
         # keep track of which bufr message has been loaded and
         # decoded from this file
@@ -737,6 +836,26 @@ class BUFRReaderBUFRDC:
         self.table_d_to_use = None
         self.tables_dir = None
 
+        # remember the table setup of the previous message, to prevent
+        # repeating the table lookup and linking for each message
+        self._table_setup_cache = {}
+
+        # if reuse_buffers is set, the arrays used for decoding are reused
+        # for all messages, so the data of a message is overwritten when
+        # the next message is decoded. Use copy_on_yield=True in that case
+        # to get copies of the data arrays if they need to be kept after
+        # stepping to the next message.
+        self._decode_buffers = None
+        if reuse_buffers:
+            self._decode_buffers = DecodeBuffers()
+        self.copy_on_yield = copy_on_yield
+
+        # an optional filter on the message headers, that allows
+        # skipping the decoding of messages that are not needed
+        self._header_filter = None
+        if where is not None:
+            self.filter(where)
+
         # expand flags to text
         self.expand_flags = expand_flags
 
@@ -761,6 +880,7 @@ class BUFRReaderBUFRDC:
         self.table_c_to_use = table_c_to_use
         self.table_d_to_use = table_d_to_use
         self.tables_dir = tables_dir
+        self._table_setup_cache = {}
         #  #]
     def tune_decoding_parameters(self,
                                  nr_of_descriptors_startval=None,
@@ -782,14 +902,45 @@ class BUFRReaderBUFRDC:
         if nr_of_descriptors_multiplier:
             self.nr_of_descriptors_multiplier = nr_of_descriptors_multiplier
         #  #]
+    def filter(self, where):
+        #  #[ define a header filter
+        """
+        only decode the messages with headers that match the given filter
+        (see header_catalogue.make_header_filter for the possibilities).
+        The headers are extracted in python, so messages that don't match
+        are skipped without calling the ECMWF library.
+        Use where=None to remove the filter.
+        Returns the reader itself, to allow: for msg in reader.filter(...)
+        """
+        if where is None:
+            self._header_filter = None
+        else:
+            self._header_filter = make_header_filter(where)
+        return self
+        #  #]
     def get_next_msg(self):
         #  #[ step to next msg
         """
         step to the next BUFR message in the open file
+        (that matches the header filter, if one was defined)
+        """
+        while True:
+            (raw_msg, section_sizes, section_start_locations) = \
+                     self._rbf.get_next_raw_bufr_msg()
+            msg_index = self._rbf.last_used_msg
+            if ( (self._header_filter is None) or
+                 self._header_filter(self._rbf.get_msg_header(msg_index)) ):
+                break
+        self.decode_msg(raw_msg, section_sizes, section_start_locations,
+                        msg_index)
+        #  #]
+    def decode_msg(self, raw_msg, section_sizes, section_start_locations,
+                   msg_index):
+        #  #[ decode a raw msg
+        """
+        decode the given raw BUFR message using the settings
+        of this reader, and make it the current message
         """
-        (raw_msg, section_sizes, section_start_locations) = \
-                 self._rbf.get_next_raw_bufr_msg()
-        msg_index = self._rbf.last_used_msg
         self.msg = BUFRMessage_R(
             raw_msg,
             section_sizes, section_start_locations,
@@ -799,7 +950,10 @@ class BUFRReaderBUFRDC:
             self.expand_strings,
             nr_of_descriptors_startval=self.nr_of_descriptors_startval,
             nr_of_descriptors_maxval=self.nr_of_descriptors_maxval,
-            nr_of_descriptors_multiplier=self.nr_of_descriptors_multiplier)
+            nr_of_descriptors_multiplier=self.nr_of_descriptors_multiplier,
+            table_setup_cache=self._table_setup_cache,
+            decode_buffers=self._decode_buffers,
+            copy_on_yield=self.copy_on_yield)
 
         #if msg_index>2995:
         #    print('writing debug file.')
@@ -826,15 +980,22 @@ class BUFRReaderBUFRDC:
             in which case it will be a 1D array.
         """
         allow_skip_invalid_messages = False
-        for i in numpy.arange(self.num_msgs) + 1:
+        # note: stop on EOFError in stead of counting to self.num_msgs
+        # so this also works when the messages are located lazily
+        while True:
             if allow_skip_invalid_messages:
                 try:
                     self.get_next_msg()
                     yield self.msg
                 except EcmwfBufrLibError:
                     pass
+                except EOFError:
+                    return
             else:
-                self.get_next_msg()
+                try:
+                    self.get_next_msg()
+                except EOFError:
+                    return
                 yield self.msg
         #  #]
     def __iter__(self):
@@ -873,13 +1034,15 @@ class BUFRWriterBUFRDC:
                                  verbose=self.verbose)
         return self.msg
         #  #]
-    def open(self, filename):
+    def open(self, filename, flush_size=0):
         #  #[ open a new bufr file for writing
         # get an instance of the RawBUFRFile class
         self.raw_bf = RawBUFRFile()
 
         # open the file for writing
-        self.raw_bf.open(filename, 'wb')
+        # (if flush_size>0 the encoded messages are collected in memory
+        #  and written in chunks of at least flush_size bytes)
+        self.raw_bf.open(filename, 'wb', flush_size=flush_size)
         self.is_open = True
         #  #]
     def close(self):
@@ -39,9 +39,11 @@ import os          # operating system functions
 import sys         # system functions
 import time        # handling of date and time
 import numpy as np # import numerical capabilities
-import struct      # allow converting c datatypes and structs
-import tempfile    # handling temporary files
-import uuid        # get unique id strings
+import atexit      # allow cleaning up at exit
+import shutil      # removing directory trees
+import tempfile    # creating temporary directories
+import multiprocessing.util # cleaning up in multiprocessing children
+from collections import OrderedDict # least recently used caches
 
 # import the raw wrapper interface to the ECMWF BUFR library
 try:
@@ -66,6 +68,109 @@ from .custom_exceptions import (EcmwfBufrLibError, EcmwfBufrTableError,
 
 MISSING_INDICATOR = 1.7e38
 
+# this module sets BUFR_TABLES to point to its private tables directory,
+# so keep the original setting provided by the user in this environment
+# variable (which is inherited by child processes as well)
+USER_BUFR_TABLES_ENV_NAME = 'PYBUFR_ECMWF_USER_BUFR_TABLES'
+
+def get_user_bufr_tables_env_setting():
+    #  #[
+    """
+    return the BUFR_TABLES environment setting provided by the user,
+    or None if it was not set
+    """
+    if USER_BUFR_TABLES_ENV_NAME in os.environ:
+        # BUFR_TABLES has already been changed by this module,
+        # possibly by a parent process
+        user_setting = os.environ[USER_BUFR_TABLES_ENV_NAME]
+    else:
+        user_setting = os.environ.get('BUFR_TABLES', '')
+    if user_setting == '':
+        return None
+    return user_setting
+    #  #]
+
+def remove_session_temp_dir():
+    #  #[
+    """
+    remove the directory for temporary files and links to the BUFR tables
+    of this process (registered to run at exit by
+    BUFRInterfaceECMWF.get_session_temp_dir)
+    """
+    if BUFRInterfaceECMWF.session_temp_dir_pid != os.getpid():
+        return
+    shutil.rmtree(BUFRInterfaceECMWF.session_temp_dir, ignore_errors=True)
+    BUFRInterfaceECMWF.session_temp_dir_pid = None
+    #  #]
+
+def remove_fortran_stdout_file():
+    #  #[
+    """
+    close and remove the file used to capture the fortran stdout
+    (registered to run at exit by BUFRInterfaceECMWF.store_fortran_stdout)
+    """
+    if BUFRInterfaceECMWF.fortran_stdout_pid != os.getpid():
+        return
+    ecmwfbufr.close_fortran_stdout()
+    if os.path.exists(BUFRInterfaceECMWF.fortran_stdout_file):
+        os.remove(BUFRInterfaceECMWF.fortran_stdout_file)
+    BUFRInterfaceECMWF.fortran_stdout_pid = None
+    #  #]
+
+class DecodeBuffers:
+    #  #[
+    """
+    a class that owns the output arrays of the bufrex routine, so they
+    can be reused for decoding many messages in stead of allocating them
+    again for each message. Each message gets views on these arrays with
+    the size it needs, and the arrays grow geometrically if a message
+    needs more space. Note that this means the views handed out for a
+    message are overwritten when the next message is decoded.
+    """
+    growth_factor = 1.5
+    def __init__(self):
+        #  #[
+        self.arrays = {'values':np.zeros(0, dtype=np.float64),
+                       'cvals':np.zeros((0, 80), dtype='|S1'),
+                       'cnames':np.zeros((0, 64), dtype='|S1'),
+                       'cunits':np.zeros((0, 24), dtype='|S1')}
+        #  #]
+    def get_view(self, name, length):
+        #  #[
+        """
+        return a zero filled view with the given length on the array
+        with the given name, after growing this array if needed
+        """
+        array = self.arrays[name]
+        if len(array) < length:
+            new_length = max(length, int(len(array)*self.growth_factor))
+            array = np.zeros((new_length,)+array.shape[1:],
+                             dtype=array.dtype)
+            self.arrays[name] = array
+            return array[:length]
+        view = array[:length]
+        view[...] = 0
+        return view
+        #  #]
+    def get_views(self, kvals, kelem):
+        #  #[
+        """
+        return views for the values, cvals, cnames and cunits arrays
+        """
+        return (self.get_view('values', kvals),
+                self.get_view('cvals', kvals),
+                self.get_view('cnames', kelem),
+                self.get_view('cunits', kelem))
+        #  #]
+    def get_nbytes(self):
+        #  #[
+        """
+        return the total size of the arrays in bytes
+        """
+        return sum(array.nbytes for array in self.arrays.values())
+        #  #]
+    #  #]
+
 class BUFRInterfaceECMWF:
     #  #[
     """
@@ -83,7 +188,40 @@ class BUFRInterfaceECMWF:
     size_ksec3 = ecmwfbufr_parameters.JSEC3
     size_ksec4 = ecmwfbufr_parameters.JSEC4
 
-    bufr_tables_env_setting_set_by_script = False
+    # the file used to capture the fortran stdout, which is opened only
+    # once per process (see store_fortran_stdout)
+    fortran_stdout_pid = None
+    fortran_stdout_file = None
+
+    # the number of expanded descriptors that was sufficient to decode
+    # previous messages, per template (only used for templates with
+    # delayed replication, see decode_data)
+    nr_of_descriptors_cache = {}
+
+    # the decode plans (expanded descriptor list, names, units, string
+    # positions and flag tables) per table set and template, which are
+    # shared by all messages using the same template
+    # (see expand_raw_descriptor_list), least recently used first
+    decode_plan_cache = OrderedDict()
+    decode_plan_cache_size = 100
+
+    # the names and units per table set and expanded descriptor list,
+    # so subsets and messages with the same expanded descriptor list
+    # (for example in case of delayed replication) share them
+    # (see get_names_and_units), least recently used first
+    names_and_units_cache = OrderedDict()
+    names_and_units_cache_size = 1000
+
+    # the default directory for temporary files and links to the
+    # BUFR tables, which is created once for each process, so different
+    # processes never touch each others links (see get_session_temp_dir)
+    session_temp_dir = None
+    session_temp_dir_pid = None
+
+    # a directory to use in stead of the default location for temporary
+    # files and links to the BUFR tables, for example to give each
+    # worker process of ParallelBUFRReader its own private location
+    private_temp_dir = None
     
     #  #]
     def __init__(self, encoded_message=None, section_sizes=None,
@@ -193,15 +331,20 @@ class BUFRInterfaceECMWF:
         # has been retrieved (so just before entering the bufrex routine)
         self.values = None
         self.cvals  = None
-        
-        # location for storing temporary files, include the uid
-        # in the name to make sure the path is unique for each user
-        self.temp_dir = ('/tmp/pybufr_ecmwf_temporary_files_'+
-                         str(os.getuid()))
 
-        # ensure the directory needed to store temporary files is present
-        if not os.path.exists(self.temp_dir):
-            os.mkdir(self.temp_dir)
+        # an optional DecodeBuffers instance, that provides reusable
+        # arrays for decoding (see try_decode_data)
+        self.decode_buffers = None
+        
+        # location for storing temporary files, which is unique for
+        # each process (unless a private location has been defined)
+        if self.__class__.private_temp_dir is not None:
+            self.temp_dir = self.__class__.private_temp_dir
+            # ensure the directory needed to store temporary files is present
+            if not os.path.exists(self.temp_dir):
+                os.mkdir(self.temp_dir)
+        else:
+            self.temp_dir = self.get_session_temp_dir()
 
         # path in which symlinks will be created to the BUFR tables we need
         # (note that it must be an absolute path! this is required by the
@@ -218,19 +361,10 @@ class BUFRInterfaceECMWF:
 
         # store the user supplied environment setting for BUFR_TABLES
         # to allow later use by the setup_tables method
-        self.bufr_tables_env_setting = None
-        if not self.__class__.bufr_tables_env_setting_set_by_script:
-            if 'BUFR_TABLES' in os.environ:
-                self.bufr_tables_env_setting = os.environ['BUFR_TABLES']
+        self.bufr_tables_env_setting = get_user_bufr_tables_env_setting()
 
         # make sure the BUFR tables can be found
-        # also, force a slash at the end, otherwise the library fails
-        # to find the tables (at least this has been the case for many
-        # library versions I worked with)
-        os.environ["BUFR_TABLES"] = (self.private_bufr_tables_dir +
-                                     os.path.sep)
-        # the above works just fine for me, no need for this one:
-        #os.putenv("BUFR_TABLES",self.private_bufr_tables_dir+os.path.sep)
+        self.set_bufr_tables_env()
 
         self.tables_have_been_setup = False
         self.table_b_file_to_use = None
@@ -243,6 +377,9 @@ class BUFRInterfaceECMWF:
         self.py_expanded_descr_list = None
         self.delayed_repl_present = False
         self.delayed_repl_problem_reported = False
+
+        # the decode plan for the template used by this message
+        self.decode_plan = None
         
         self.outp_file = None
 
@@ -251,7 +388,51 @@ class BUFRInterfaceECMWF:
 
         # to store the loaded BUFR template information
         self.BufrTemplate = None
-        #  #]        
+        #  #]
+    def get_session_temp_dir(self):
+        #  #[
+        """
+        return the directory for temporary files and links to the
+        BUFR tables of the current process. It is created at the first
+        call in each process, and removed again when the process exits.
+        """
+        pid = os.getpid()
+        cls = BUFRInterfaceECMWF
+        if cls.session_temp_dir_pid != pid:
+            if cls.session_temp_dir_pid is None:
+                # a forked child process inherits this registration
+                # from its parent, so only register it once
+                atexit.register(remove_session_temp_dir)
+            cls.session_temp_dir = \
+                 tempfile.mkdtemp(prefix='pybufr_ecmwf_'+str(pid)+'_')
+            cls.session_temp_dir_pid = pid
+            # processes started by multiprocessing do not run the
+            # atexit functions, but they do run these finalizers
+            multiprocessing.util.Finalize(None, remove_session_temp_dir,
+                                          exitpriority=0)
+        return cls.session_temp_dir
+        #  #]
+    def set_bufr_tables_env(self):
+        #  #[
+        """
+        point the BUFR_TABLES environment setting to the private
+        tables directory, which is read by the ECMWF library
+        """
+        # remember the original user setting, also for child processes
+        if USER_BUFR_TABLES_ENV_NAME not in os.environ:
+            os.environ[USER_BUFR_TABLES_ENV_NAME] = \
+                        os.environ.get('BUFR_TABLES', '')
+
+        # force a slash at the end, otherwise the library fails
+        # to find the tables (at least this has been the case for many
+        # library versions I worked with)
+        bufr_tables = self.private_bufr_tables_dir + os.path.sep
+
+        # only change the environment if needed, since this is not
+        # thread safe and this setting is the same for all messages
+        if os.environ.get('BUFR_TABLES') != bufr_tables:
+            os.environ['BUFR_TABLES'] = bufr_tables
+        #  #]
     def get_expected_ecmwf_bufr_table_names(self,
                                             center, subcenter,
                                             LocalVersion, MasterTableVersion,
@@ -437,7 +618,16 @@ class BUFRInterfaceECMWF:
         output get written to 2 different output buffers, and will
         be mixed in inpredictable ways (which makes it impossible
         to interpret the output or to define unit test cases ...)
-        """
+        The file is opened only once for each process, and is
+        shared by all instances of this class.
+        """
+        pid = os.getpid()
+        cls = BUFRInterfaceECMWF
+        if cls.fortran_stdout_pid == pid:
+            # already redirected, nothing to do
+            self.outp_file = cls.fortran_stdout_file
+            return
+
         if 'STD_OUT' in os.environ:
             outp_fileunit = os.environ['STD_OUT']
         else:
@@ -448,53 +638,47 @@ class BUFRInterfaceECMWF:
         # is not yet redirected to the above defined fileunit
         os.environ['PRINT_TABLE_NAMES'] = 'FALSE'
 
-        # Determine filename to use to redirect the fortran stdout stream
-        # Note that we cannot directly use the file object returned
-        # by tempfile.NamedTemporaryFile() because the actual file
-        # will be used inside the underlying fortran library.
-        # Therefore just extract the filename and close the file again.
-
-        try:
-            # add a random uuid as prefix
-            # and the PID as suffix to really make sure there
-            # will be no name clashes.
-            temp = tempfile.NamedTemporaryFile(suffix='_'+str(os.getpid()), 
-                                               prefix=str(uuid.uuid4())+'_', 
-                                               dir=self.temp_dir)
-
-            self.fortran_stdout_tmp_file = os.path.split(temp.name)[1]
-            temp.close()
-        except:
-            self.fortran_stdout_tmp_file = 'tmp_fortran_stdout.txt'
-        
-        # print('fortran_stdout_tmp_file = ', self.fortran_stdout_tmp_file)
+        # note: in a forked child process the fortran unit is still
+        # connected to the file of the parent. Opening the unit again
+        # connects it to a file of its own, without closing and
+        # removing the file of the parent in this process
+        if cls.fortran_stdout_pid is None:
+            atexit.register(remove_fortran_stdout_file)
 
+        # add the PID to the filename to make sure there will be
+        # no name clashes between processes
         # self.outp_file = 'fort.'+str(outp_fileunit)
         self.outp_file = os.path.join(self.temp_dir,
-                                      self.fortran_stdout_tmp_file)
+                                      'tmp_fortran_stdout_'+str(pid)+'.txt')
         ecmwfbufr.open_fortran_stdout(self.outp_file)
+
+        cls.fortran_stdout_pid = pid
+        cls.fortran_stdout_file = self.outp_file
         #  #]
     def get_fortran_stdout(self):
         #  #[
         """
-        retrieve the fortran output that was stored in the temporary
-        file by the store_fortran_stdout method
+        retrieve the fortran output that was written to the temporary
+        file since the previous call to this method, and empty the file
         """
 
-        # close the fortran stdout() channel. This should flush all
-        # output may still be buffered at this point
-        ecmwfbufr.close_fortran_stdout()
-        
-        # now read the temporary file and display the output
-        if os.path.exists(self.outp_file):
-            with open(self.outp_file) as ffd:
-                lines = ffd.readlines()
-        else:
-            lines = []
-        
-        # finally remove the temporary file
-        if os.path.exists(self.outp_file):
-            os.remove(self.outp_file)
+        # flush all output that may still be buffered at this point
+        ecmwfbufr.flush_fortran_stdout()
+
+        # only read the file if something was written to it
+        cls = BUFRInterfaceECMWF
+        try:
+            size = os.path.getsize(cls.fortran_stdout_file)
+        except OSError:
+            return []
+        if size == 0:
+            return []
+
+        with open(cls.fortran_stdout_file, 'rb') as ffd:
+            lines = ffd.read().decode('ascii', 'replace').splitlines(True)
+
+        # the fortran code continues writing at the start of the file
+        ecmwfbufr.truncate_fortran_stdout()
 
         return lines
         #  #]        
@@ -532,6 +716,79 @@ class BUFRInterfaceECMWF:
         if (kerr != 0):
             raise EcmwfBufrLibError(self.explain_error(kerr, 'bus012'))
 
+        self.sections012_decoded = True
+        #  #]
+    def extract_sections_012(self):
+        #  #[ python implementation of the header decoding
+        """
+        fill ksec0, ksec1 and the number of subsets in ksup from the
+        binary BUFR message, using the same layout as bus012 does.
+        This is sufficient to setup the BUFR tables and decode the
+        data with bufrex, without calling the library for the headers
+        (note that ksec2 is not filled, and that bufrex fills all
+        these arrays again, in the way the library does it).
+        """
+        raw_data_bytes = self.get_encoded_message_bytes()
+
+        def get_int(start, nbytes):
+            """ extract a big endian integer """
+            value = 0
+            for byte in raw_data_bytes[start:start+nbytes].tolist():
+                value = 256*value + byte
+            return value
+
+        # note: for editions 0 and 1 section 0 only holds 'BUFR', and the
+        # edition number is stored in byte 4 of section 1, so the edition
+        # can be taken from byte 8 of the message for all editions
+        edition = int(raw_data_bytes[8-1])
+        start_section1 = self.section_start_locations[1]
+        sec1 = raw_data_bytes[start_section1:start_section1+22].tolist()
+        # pad to allow unpacking short (non standard) sections
+        sec1.extend([0]*(22-len(sec1)))
+
+        self.ksec0[:] = 0
+        self.ksec1[:] = 0
+
+        if edition < 2:
+            # section 0 has no total message length for editions 0 and 1
+            self.ksec0[:3] = (4, 0, edition)
+        else:
+            self.ksec0[:3] = (8, get_int(4, 3), edition)
+
+        self.ksec1[1-1] = get_int(start_section1, 3)
+        self.ksec1[2-1] = edition
+        self.ksec1[14-1] = sec1[4-1] # master table
+        if edition < 4:
+            if edition == 3:
+                self.ksec1[16-1] = sec1[5-1] # subcenter
+                self.ksec1[3-1] = sec1[6-1] # center
+            else:
+                self.ksec1[3-1] = 256*sec1[5-1] + sec1[6-1] # center
+            self.ksec1[4-1] = sec1[7-1] # update sequence number
+            self.ksec1[5-1] = sec1[8-1] # flag
+            self.ksec1[6-1] = sec1[9-1] # data category
+            self.ksec1[7-1] = sec1[10-1] # subcategory
+            self.ksec1[15-1] = sec1[11-1] # master table version
+            self.ksec1[8-1] = sec1[12-1] # local table version
+            self.ksec1[9-1:13] = sec1[13-1:17] # year of century upto minute
+        else:
+            self.ksec1[3-1] = 256*sec1[5-1] + sec1[6-1] # center
+            self.ksec1[16-1] = 256*sec1[7-1] + sec1[8-1] # subcenter
+            self.ksec1[4-1] = sec1[9-1] # update sequence number
+            self.ksec1[5-1] = sec1[10-1] # flag
+            self.ksec1[6-1] = sec1[11-1] # data category
+            self.ksec1[17-1] = sec1[12-1] # international subcategory
+            self.ksec1[7-1] = sec1[13-1] # local subcategory
+            self.ksec1[15-1] = sec1[14-1] # master table version
+            self.ksec1[8-1] = sec1[15-1] # local table version
+            self.ksec1[9-1] = 256*sec1[16-1] + sec1[17-1] # year
+            self.ksec1[10-1:13] = sec1[18-1:21] # month upto minute
+            self.ksec1[18-1] = sec1[22-1] # second
+
+        # the number of subsets is stored in bytes 5 and 6 of section 3
+        start_section3 = self.section_start_locations[3]
+        self.ksup[6-1] = get_int(start_section3+5-1, 2)
+
         self.sections012_decoded = True
         #  #]
     def decode_sections_0123(self):
@@ -903,13 +1160,8 @@ class BUFRInterfaceECMWF:
         os.symlink(os.path.abspath(source_d), destination_d)
             
         # make sure the BUFR tables can be found
-        # also, force a slash at the end, otherwise the library fails
-        # to find the tables (at least this has been the case for many
-        # library versions I worked with)
-        os.environ["BUFR_TABLES"] = (self.private_bufr_tables_dir +
-                                     os.path.sep)
-        self.__class__.bufr_tables_env_setting_set_by_script = True
-        
+        self.set_bufr_tables_env()
+
         self.tables_have_been_setup = True
         self.table_b_file_to_use = destination_b
         self.table_c_file_to_use = None
@@ -931,6 +1183,53 @@ class BUFRInterfaceECMWF:
             self.bt.load(self.table_c_file_to_use)
         self.bt.load(self.table_d_file_to_use)
 
+        #  #]
+    def get_table_setup_key(self):
+        #  #[ header items that determine the BUFR tables to use
+        """
+        return a tuple holding the items from sections 0 and 1
+        that determine which BUFR tables are needed by this message
+        """
+        if (not self.sections012_decoded):
+            errtxt = ("Sorry, retrieving the table setup key is only "+
+                      "possible after sections 0,1,2 of a BUFR message "+
+                      "have been decoded with a call to decode_sections_012")
+            raise EcmwfBufrLibError(errtxt)
+
+        return (int(self.ksec1[3-1]),  # center
+                int(self.ksec1[16-1]), # subcenter
+                int(self.ksec1[8-1]),  # LocalVersion
+                int(self.ksec1[15-1]), # MasterTableVersion
+                int(self.ksec0[3-1]),  # EditionNumber
+                int(self.ksec1[14-1])) # MasterTableNumber
+        #  #]
+    def get_table_setup(self):
+        #  #[ retrieve the result of setup_tables
+        """
+        return the table settings made by setup_tables, to allow
+        reusing them for a next message with the same table setup key
+        """
+        if not self.tables_have_been_setup:
+            errtxt = ("Sorry, retrieving the table setup is only possible "+
+                      "after calling setup_tables")
+            raise EcmwfBufrLibError(errtxt)
+
+        return (self.ecmwf_bufr_tables_dir, self.user_tables_dir,
+                self.table_b_file_to_use, self.table_c_file_to_use,
+                self.table_d_file_to_use, self.bt)
+        #  #]
+    def reuse_table_setup(self, table_setup):
+        #  #[ use the result of a previous setup_tables call
+        """
+        use the table settings of a previous message (as returned by
+        get_table_setup) in stead of calling setup_tables. This skips
+        all filesystem access needed to locate and link the tables,
+        so only use it for messages with the same table setup key
+        """
+        (self.ecmwf_bufr_tables_dir, self.user_tables_dir,
+         self.table_b_file_to_use, self.table_c_file_to_use,
+         self.table_d_file_to_use, self.bt) = table_setup
+        self.tables_have_been_setup = True
         #  #]
     def print_sections_012(self):
         #  #[ wrapper for buprs0, buprs1, buprs2
@@ -1057,19 +1356,36 @@ class BUFRInterfaceECMWF:
         # final expanded descriptor list. This final list may be
         # smaller in some cases (for example for ERS2 data) than
         # the maximum intermediate size needed....
+        # In case of delayed replication the needed size is not known
+        # in advance. Then start with the size that was sufficient
+        # for the previous message using the same template, and limit
+        # the growth to the maximum size allowed by section 4.
+        cls = BUFRInterfaceECMWF
+        template_key = None
+        max_nr_of_descriptors = None
         if self.py_expanded_descr_list:
             nr_of_descriptors = len(self.py_expanded_descr_list)
         else:
-            nr_of_descriptors = self.nr_of_descriptors_startval
+            template_key = (self.table_b_file_to_use,
+                            tuple(self.py_unexp_descr_list))
+            nr_of_descriptors = cls.nr_of_descriptors_cache.get(
+                template_key, self.nr_of_descriptors_startval)
+            max_nr_of_descriptors = self.get_max_nr_of_descriptors()
 
+        failed_nr_of_descriptors = None
         increment_arraysize = True
         while increment_arraysize:
             try:
                 self.try_decode_data(nr_of_descriptors, nr_of_subsets)
                 increment_arraysize = False
             except EcmwfBufrLibError as e:
+                failed_nr_of_descriptors = nr_of_descriptors
                 nr_of_descriptors = int(nr_of_descriptors *
                                         self.nr_of_descriptors_multiplier)
+                if ( (max_nr_of_descriptors is not None) and
+                     (failed_nr_of_descriptors < max_nr_of_descriptors <
+                      nr_of_descriptors) ):
+                    nr_of_descriptors = max_nr_of_descriptors
                 if nr_of_descriptors>self.nr_of_descriptors_maxval:
                     lines = self.get_fortran_stdout()
                     self.display_fortran_stdout(lines)
@@ -1080,6 +1396,26 @@ class BUFRInterfaceECMWF:
                               nr_of_descriptors)
         # done
         self.actual_nr_of_expanded_descriptors = self.ksup[4]
+
+        if template_key is not None:
+            # remember a size close to the actual number of expanded
+            # descriptors (with some margin, since the size needed
+            # during decoding may be larger) but larger than any size
+            # that failed, so the remembered size can only grow
+            if failed_nr_of_descriptors is not None:
+                nr_to_remember = max(min(nr_of_descriptors,
+                                         2*int(self.ksup[4])),
+                                     self.nr_of_descriptors_startval,
+                                     failed_nr_of_descriptors+1)
+            elif template_key in cls.nr_of_descriptors_cache:
+                nr_to_remember = nr_of_descriptors
+            else:
+                nr_to_remember = max(min(nr_of_descriptors,
+                                         2*int(self.ksup[4])),
+                                     self.nr_of_descriptors_startval)
+            if len(cls.nr_of_descriptors_cache) >= 1000:
+                cls.nr_of_descriptors_cache.clear()
+            cls.nr_of_descriptors_cache[template_key] = nr_to_remember
         
         # if self.py_expanded_descr_list:
         #     self.actual_nr_of_expanded_descriptors = \
@@ -1097,6 +1433,30 @@ class BUFRInterfaceECMWF:
         # print('self.ksup[4] = ', self.ksup[4] # real num of exp. elements)
         # print('self.ksup[6] = ', self.ksup[6] # real num of elements in cvals)
 
+        #  #]
+    def get_max_nr_of_descriptors(self):
+        #  #[ upper limit for the number of expanded descriptors
+        """
+        derive an upper limit for the number of expanded descriptors
+        per subset from the size of section 4, assuming each data element
+        occupies at least 1 bit (or 6 bits for compressed messages, to
+        store the increment width). Returns None if the section sizes
+        are not available.
+        """
+        if ( (self.section_sizes is None) or
+             (self.section_start_locations is None) ):
+            return None
+
+        # the data compression flag is bit 2 of byte 7 of section 3
+        raw_data_bytes = self.get_encoded_message_bytes()
+        flags = int(raw_data_bytes[self.section_start_locations[3]+7-1])
+        if flags & 64:
+            min_bits_per_element = 6
+        else:
+            min_bits_per_element = 1
+
+        nr_of_data_bits = 8*(self.section_sizes[4]-4)
+        return max(1, nr_of_data_bits//min_bits_per_element)
         #  #]
     def try_decode_data(self, nr_of_descriptors, nr_of_subsets):
         #  #[ try decoding for a given array length
@@ -1118,11 +1478,7 @@ class BUFRInterfaceECMWF:
         #sys.exit(1)
 
         # allocate space for decoding
-        # note: float64 is the default, but it doesn't hurt to make it explicit
-        self.values = np.zeros(      self.kvals, dtype = np.float64)
-        self.cvals  = np.zeros((self.kvals, 80), dtype = np.character)
-        self.cnames = np.zeros((nr_of_descriptors, 64), dtype = '|S1')
-        self.cunits = np.zeros((nr_of_descriptors, 24), dtype = '|S1')
+        self.allocate_decoding_arrays(nr_of_descriptors)
 
         # print('DEBUG: len(self.ksec0)=',len(self.ksec0))
         # print('DEBUG: len(self.ksec1)=',len(self.ksec1))
@@ -1140,19 +1496,8 @@ class BUFRInterfaceECMWF:
         # reset global variables to enter the decoding process
         # (this does not happen in the bufrdc library, which is a bug)
         ecmwfbufr.reset_global_vars()
-        
-        ecmwfbufr.bufrex(self.encoded_message, # input
-                         self.ksup,   # output
-                         self.ksec0,  # output
-                         self.ksec1,  # output
-                         self.ksec2,  # output
-                         self.ksec3,  # output
-                         self.ksec4,  # output
-                         self.cnames, # output
-                         self.cunits, # output
-                         self.values, # output
-                         self.cvals,  # output
-                         kerr)        # output
+
+        self.call_bufrex(kerr)
         lines = self.get_fortran_stdout()
         # self.display_fortran_stdout(lines)
 
@@ -1181,10 +1526,54 @@ class BUFRInterfaceECMWF:
         if self.ksec4[0] == 0:
             errtxt = self.analyse_errors_in_fortran_stdout(lines,'bufrex')
             raise EcmwfBufrLibError(errtxt)
-        
+
+        # bufrex also fills ksec0 upto ksec3, so there is no need
+        # to call bus0123 after decoding
+        self.sections012_decoded  = True
+        self.sections0123_decoded = True
         self.data_decoded = True
         # self.BufrTemplate = ...
         #  #]
+    def call_bufrex(self, kerr):
+        #  #[ wrapper for bufrex
+        """
+        decode the current message into the arrays allocated
+        by allocate_decoding_arrays
+        """
+        ecmwfbufr.bufrex(self.encoded_message, # input
+                         self.ksup,   # output
+                         self.ksec0,  # output
+                         self.ksec1,  # output
+                         self.ksec2,  # output
+                         self.ksec3,  # output
+                         self.ksec4,  # output
+                         self.cnames, # output
+                         self.cunits, # output
+                         self.values, # output
+                         self.cvals,  # output
+                         kerr)        # output
+        #  #]
+    def allocate_decoding_arrays(self, nr_of_descriptors):
+        #  #[ allocate the output arrays for bufrex
+        """
+        allocate the values, cvals, cnames and cunits arrays,
+        or take views on the arrays of self.decode_buffers if available
+        """
+        # note: the library writes the strings of a message at the
+        # cvals indices it computes itself, and trusts cvals to be
+        # kvals long, so cvals must have the same length as values
+        # (which is checked by the f2py interface)
+        if self.decode_buffers is not None:
+            (self.values, self.cvals, self.cnames, self.cunits) = \
+                self.decode_buffers.get_views(self.kvals, nr_of_descriptors)
+            return
+
+        # note: float64 is the default, but it doesn't hurt to make it explicit
+        self.values = np.zeros(      self.kvals, dtype = np.float64)
+        self.cvals  = np.zeros((self.kvals, 80), dtype = '|S1')
+        self.cnames = np.zeros((nr_of_descriptors, 64), dtype = '|S1')
+        self.cunits = np.zeros((nr_of_descriptors, 24), dtype = '|S1')
+        #  #]
     def print_sections_012_metadata(self):
         #  #[
         """
@@ -1281,29 +1670,47 @@ class BUFRInterfaceECMWF:
             # each subset may have a different list of descriptors
             # after expansion, so reload the list of names for this subset
             self.expand_descriptors_for_decoding(subset)
-
-        list_of_names = []
-        list_of_units = []
-        for i in range(self.ktdexl):
-            # get the names/units as numpy arrays of characters
-            cname = self.cnames[i,:]
-            cunit = self.cunits[i,:]
-            # glue the ndarray of characters together to form strings
-            cname_str = b''.join(cname).strip()
-            cunit_str = b''.join(cunit).strip()
-            # append the string to the list and quote them
-            if python3:
-                txtn = cname_str.decode()
-                txtu = cunit_str.decode()
-            else:
-                txtn = cname_str
-                txtu = cunit_str
-
-            #if (txtn.strip() != ''):
-            list_of_names.append(txtn)
-            list_of_units.append(txtu)
-
-        return (list_of_names, list_of_units)
+        elif (self.decode_plan is not None) and ('names' in self.decode_plan):
+            return (list(self.decode_plan['names']),
+                    list(self.decode_plan['units']))
+
+        cls = BUFRInterfaceECMWF
+        key = (self.bt.table_set_key,
+               tuple(self.ktdexp[:self.ktdexl].tolist()))
+        if key in cls.names_and_units_cache:
+            (list_of_names, list_of_units) = \
+                     cls.names_and_units_cache.pop(key)
+        else:
+            list_of_names = self.decode_strings(self.cnames[:self.ktdexl])
+            list_of_units = self.decode_strings(self.cunits[:self.ktdexl])
+            if ( len(cls.names_and_units_cache) >=
+                 cls.names_and_units_cache_size ):
+                # remove the least recently used names and units
+                cls.names_and_units_cache.popitem(last=False)
+        # (re)insert them as the most recently used ones
+        cls.names_and_units_cache[key] = (list_of_names, list_of_units)
+
+        if (not self.delayed_repl_present) and (self.decode_plan is not None):
+            self.decode_plan['names'] = list_of_names
+            self.decode_plan['units'] = list_of_units
+
+        return (list(list_of_names), list(list_of_units))
+        #  #]
+    def decode_strings(self, char_array):
+        #  #[ convert rows of characters to a list of strings
+        """
+        convert a 2D array of single characters (like cnames and cunits)
+        to a list of stripped strings, viewing each row as a single string
+        """
+        (num_rows, num_chars) = char_array.shape
+        if num_rows == 0:
+            return []
+        strings = np.char.strip(
+            np.ascontiguousarray(char_array).view('S'+str(num_chars)).
+            reshape(num_rows))
+        if python3:
+            strings = np.char.decode(strings, 'ascii', 'replace')
+        return strings.tolist()
         #  #]
     def explain_error(self, kerr, subroutine_name):
         #  #[ explain error codes returned by the bufrlib routines
@@ -1395,26 +1802,75 @@ class BUFRInterfaceECMWF:
 
         return self.ksup[4]
         #  #]
-    def convert_flag_values_to_text(self, values, i):
-        #  #[ convert flags to text if needed
-        flag_text_values = []
+    def get_flag_table(self, i):
+        #  #[ get the C table entry for the i th descriptor
+        """
+        return the C table entry for the i th element of the
+        expanded descriptor list, or None if this is not a
+        code or flag table element
+        """
+        plan = self.decode_plan
+        if (self.delayed_repl_present) or (plan is None):
+            return self.lookup_flag_table(i)
+
+        if 'flag_tables' not in plan:
+            plan['flag_tables'] = [self.lookup_flag_table(j)
+                                   for j in range(self.ktdexl)]
+        return plan['flag_tables'][i]
+        #  #]
+    def lookup_flag_table(self, i):
+        #  #[ search the C table entry for the i th descriptor
         ref = int(self.ktdexp[i])
-        unit = ''.join(c.decode() for c in self.cunits[i])
+        unit = self.decode_strings(self.cunits[i:i+1])[0]
         if 'TABLE' in unit:
             if ref in self.bt.table_c:
-                for v in values:
-                    try:
-                        flag_text = self.bt.table_c[ref].flag_dict[int(v)]
-                    except:
-                        flag_text = '<UNDEFINED VALUE>'
-                    flag_text_values.append(flag_text)
-
-                return flag_text_values
+                return self.bt.table_c[ref]
+        return None
+        #  #]
+    def convert_flag_values_to_text(self, values, i):
+        #  #[ convert flags to text if needed
+        flag_table = self.get_flag_table(i)
+        if flag_table is not None:
+            labels = flag_table.get_lookup()[1]
+            return labels[flag_table.get_codes(values)].tolist()
 
         # default fallback in case flag seems not defined
         # or C-table is missing or descriptor is numeric after all
         return values
         #  #]
+    def get_categorical_values(self, i):
+        #  #[ get the i th value from each subset as codes and labels
+        """
+        for a code or flag table element, return the i th value from each
+        subset as an array of integer codes, together with an array of
+        labels, so that labels[codes] gives the text for each value.
+        The last label is used for values not defined in the table.
+        Returns None if the element has no code or flag table.
+        """
+        flag_table = self.get_flag_table(i)
+        if flag_table is None:
+            return None
+        values = self.get_raw_values(i)
+        return (flag_table.get_codes(values), flag_table.get_lookup()[1])
+        #  #]
+    def get_flag_bits(self, i):
+        #  #[ split the i th value from each subset in bits
+        """
+        for a flag table element, return the i th value from each subset
+        split in boolean bit columns (numbered from 1 for the most
+        significant bit), together with an array of labels for the bits.
+        Returns None if the element has no flag table.
+        """
+        flag_table = self.get_flag_table(i)
+        if flag_table is None:
+            return None
+        descr = int(self.ktdexp[i])
+        unit = self.decode_strings(self.cunits[i:i+1])[0]
+        if 'FLAG' not in unit:
+            return None
+        data_width = self.bt.table_b[descr].data_width
+        return flag_table.get_bits(self.get_raw_values(i), data_width)
+        #  #]
     def get_value(self, i, j, autoget_cval=False):
         #  #[ get the i th value from subset j
         """
@@ -1448,17 +1904,8 @@ class BUFRInterfaceECMWF:
         value = self.values[selection]
 
         if autoget_cval:
-            descr = self.ktdexp[i]
-            try:
-                unit = self.bt.table_b[descr].unit
-                if unit == 'CCITTIA5':
-                    cvals_index = int(value/1000)-1
-                    text = ''.join(c for c in self.cvals[cvals_index,:])
-                    return text.strip()
-            except:
-                # this may happen for ModificationCommand descriptors
-                # like 224000, since these have no unit attribute
-                pass
+            if i in self.get_ccittia5_indices():
+                return str(self.get_cvals_strings([value,])[0])
 
         if self.expand_flags:
             values = self.convert_flag_values_to_text([value,], i)
@@ -1472,6 +1919,25 @@ class BUFRInterfaceECMWF:
         a helper function to request the i th value from each subset
         for the current BUFR message as an array.
         """
+        values = self.get_raw_values(i)
+
+        if autoget_cval:
+            if i in self.get_ccittia5_indices():
+                return self.get_cvals_strings(values)
+
+        if self.expand_flags:
+            values = self.convert_flag_values_to_text(values, i)
+            
+        # print('i, self.values[selection] = '+str(i)+' '+str(values))
+        return values
+        #  #]
+    def get_raw_values(self, i):
+        #  #[ get the i th numerical value from each subset as an array
+        """
+        request the i th value from each subset for the current
+        BUFR message as a numerical array, without conversion
+        of strings or flags
+        """
         if (not self.data_decoded):
             errtxt = ("Sorry, retrieving values is only possible after "+
                       "a BUFR message has been decoded with a call to "+
@@ -1499,26 +1965,7 @@ class BUFRInterfaceECMWF:
             self.delayed_repl_problem_reported = True
             
         selection = self.actual_kelem*np.array(range(nsubsets))+i
-        values = self.values[selection]
-
-        if autoget_cval:
-            cvalues = []
-            exp_descr_list_length = self.ktdexl
-            template_offset = selection % exp_descr_list_length
-            descr = self.ktdexp[template_offset]
-            unit = self.bt.table_b[descr[0]].unit
-            if unit == 'CCITT IA5':
-                for subset in range(nsubsets):
-                    cvals_index = int(values[subset]/1000)-1
-                    text = ''.join(c for c in self.cvals[cvals_index,:])
-                    cvalues.append(text.strip())
-                return cvalues
-
-        if self.expand_flags:
-            values = self.convert_flag_values_to_text(values, i)
-            
-        # print('i, self.values[selection] = '+str(i)+' '+str(values))
-        return values
+        return self.values[selection]
         #  #]
     def get_subset_values(self, subset_nr, autoget_cval=False):
         #  #[ get the values for a given subset as an array
@@ -1554,35 +2001,173 @@ class BUFRInterfaceECMWF:
             return
 
         if autoget_cval:
-            # convert numpy values array to standard list to make it mutable
-            values = list(values)
-            for i, descr in enumerate(self.ktdexp):
-                try:
-                    unit = self.bt.table_b[descr].unit
-                    if unit == 'CCITTIA5':
-                        selection = self.actual_kelem*(subset_nr-1) + i
-                        cvals_index = int(values[selection]/1000)-1
-                        text = ''.join(c.decode() for c in
-                                       self.cvals[cvals_index,:])
-                        cvalue = text.strip()
-                        values[i] = cvalue
-                except AttributeError:
-                    # this may happen for ModificationCommand descriptors
-                    # like 224000, since these have no unit attribute
-                    pass
-
-        if self.expand_flags:
-            values = [self.convert_flag_values_to_text([value,], i)[0]
-                      for i, value in enumerate(values)]
+            # convert numpy values array to an object array to allow
+            # storing the strings in it
+            ccittia5_indices = self.get_ccittia5_indices()
+            if ccittia5_indices:
+                values = values.astype(object)
+                values[ccittia5_indices] = self.get_cvals_strings(
+                    values[ccittia5_indices].astype(np.float64)).tolist()
 
         if self.expand_flags or autoget_cval:
             # finally convert to a numpy array of type object
             # for user convenience
-            values = np.array(values, dtype='object')
+            values = values.astype(object)
+
+        if self.expand_flags:
+            for i in self.get_flag_table_indices():
+                values[i] = self.convert_flag_values_to_text([values[i],],
+                                                             i)[0]
 
         # print('i, self.values[selection] = '+str(i)+' '+str(values))
         return values
         #  #]
+    def get_values_as_2d_object_array(self, autoget_cval=False):
+        #  #[ get all values with strings and flags expanded
+        """
+        return the values of all subsets as a 2D array of type object,
+        with strings and flags expanded in the same way as done by
+        get_subset_values, but converting a whole column at once.
+        This is only possible for messages without delayed replication.
+        """
+        self.delayed_repl_check_for_incorrect_use()
+
+        nsubsets = self.get_num_subsets()
+        factor = int(len(self.values) / self.actual_kelem)
+        raw_values = self.values.reshape(
+            (factor, self.actual_kelem))[:nsubsets, :self.ktdexl]
+        values = raw_values.astype(object)
+
+        if autoget_cval:
+            for i in self.get_ccittia5_indices():
+                values[:, i] = self.get_cvals_strings(
+                    raw_values[:, i]).tolist()
+
+        if self.expand_flags:
+            for i in self.get_flag_table_indices():
+                values[:, i] = self.convert_flag_values_to_text(
+                    raw_values[:, i], i)
+
+        return values
+        #  #]
+    def get_ragged_values(self):
+        #  #[ get all values of a message in a ragged layout
+        """
+        return the values of all subsets of the current BUFR message
+        as a tuple (values, offsets, codes), also for templates that use
+        delayed replication. values is a 1D array holding the values of
+        all subsets after each other, and the values of subset i
+        (counting from 0) are values[offsets[i]:offsets[i+1]].
+        codes has the same length as values and holds the expanded
+        descriptor belonging to each value.
+        """
+        if (not self.data_decoded):
+            errtxt = ("Sorry, retrieving values is only possible after "+
+                      "a BUFR message has been decoded with a call to "+
+                      "decode_data")
+            raise EcmwfBufrLibError(errtxt)
+
+        nsubsets = self.get_num_subsets()
+        kelem = self.actual_kelem
+        factor = int(len(self.values) / kelem)
+        values_2d = self.values.reshape((factor, kelem))[:nsubsets]
+
+        # compressed messages require all subsets to have the same
+        # replication counts, so one expanded descriptor list suffices
+        compressed = bool(self.ksec3[3] & 64)
+        if (not self.delayed_repl_present) or compressed:
+            self.fill_descriptor_list_subset(1)
+            ktdexl = self.ktdexl
+            values = values_2d[:, :ktdexl].ravel()
+            offsets = np.arange(nsubsets+1, dtype=np.int64)*ktdexl
+            codes = np.tile(self.ktdexp[:ktdexl], nsubsets)
+            return (values, offsets, codes)
+
+        # the expanded descriptor list differs per subset, so busel2
+        # must be called for each subset, but the same output arrays
+        # are used for all calls, and the values are selected in one go
+        ktdlst = np.zeros(len(self.py_unexp_descr_list), dtype=int)
+        ktdexp = np.zeros(kelem, dtype=int)
+        cnames = np.zeros((kelem, 64), dtype='|S1')
+        cunits = np.zeros((kelem, 24), dtype='|S1')
+        codes_2d = np.zeros((nsubsets, kelem), dtype=np.int64)
+        lengths = np.zeros(nsubsets, dtype=np.int64)
+        for subset in range(nsubsets):
+            (ktdlen, ktdexl) = self.call_busel2(subset+1, kelem, ktdlst,
+                                                ktdexp, cnames, cunits)
+            lengths[subset] = ktdexl
+            codes_2d[subset, :ktdexl] = ktdexp[:ktdexl]
+
+        mask = np.arange(kelem) < lengths[:, np.newaxis]
+        offsets = np.zeros(nsubsets+1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return (values_2d[mask], offsets, codes_2d[mask])
+        #  #]
+    def get_flag_table_indices(self):
+        #  #[ get the positions of the code and flag table elements
+        """
+        return a list of indices in the expanded descriptor list
+        that point to elements that have a code or flag table
+        """
+        plan = self.decode_plan
+        if (not self.delayed_repl_present) and (plan is not None):
+            if 'flag_table_indices' not in plan:
+                plan['flag_table_indices'] = \
+                    [i for i in range(self.ktdexl)
+                     if self.get_flag_table(i) is not None]
+            return plan['flag_table_indices']
+
+        return [i for i in range(self.ktdexl)
+                if self.lookup_flag_table(i) is not None]
+        #  #]
+    def get_ccittia5_indices(self):
+        #  #[ get the positions of the string elements
+        """
+        return a list of indices in the expanded descriptor list
+        that point to CCITTIA5 (string) elements
+        """
+        plan = self.decode_plan
+        if ( (not self.delayed_repl_present) and (plan is not None) and
+             ('ccittia5_indices' in plan) ):
+            return plan['ccittia5_indices']
+
+        ccittia5_indices = []
+        for i, descr in enumerate(self.ktdexp):
+            try:
+                unit = self.bt.table_b[descr].unit
+                if unit == 'CCITTIA5':
+                    ccittia5_indices.append(i)
+            except AttributeError:
+                # this may happen for ModificationCommand descriptors
+                # like 224000, since these have no unit attribute
+                pass
+
+        if (not self.delayed_repl_present) and (plan is not None):
+            plan['ccittia5_indices'] = ccittia5_indices
+        return ccittia5_indices
+        #  #]
+    def get_cvals_strings(self, values):
+        #  #[ get the strings pointed to by CCITTIA5 values
+        """
+        return a numpy array holding the strings from the cvals array
+        that are referenced by the given values of CCITTIA5 elements
+        (the value for a string is 1000 times its index in cvals plus
+        its length). Invalid references give an empty string.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        num_strings = self.cvals.shape[0]
+        cvals_indices = np.zeros(values.shape, dtype=np.int64)
+        valid = (values >= 1000.) & (values < (num_strings+1)*1000.)
+        cvals_indices[valid] = (values[valid]/1000).astype(np.int64)-1
+
+        # view each row of 80 characters in cvals as a single string
+        cvals_strings = self.cvals.view('S80').reshape(num_strings)
+        strings = np.char.strip(cvals_strings[cvals_indices])
+        strings[~valid] = b''
+        if python3:
+            strings = np.char.decode(strings, 'ascii', 'replace')
+        return strings
+        #  #]
     def get_element_name_and_unit(self, i):
         #  #[ routine to get name and unit of a given element
         """
@@ -1604,14 +2189,9 @@ class BUFRInterfaceECMWF:
                       "(remember the arrays are counted starting with 0)")
             raise EcmwfBufrLibError(errtxt)
 
-        if python3:
-            txtn = ''.join(c.decode() for c in self.cnames[i])
-            txtu = ''.join(c.decode() for c in self.cunits[i])
-        else:
-            txtn = ''.join(c for c in self.cnames[i])
-            txtu = ''.join(c for c in self.cunits[i])
-            
-        return (txtn.strip(), txtu.strip())
+        txtn = self.decode_strings(self.cnames[i:i+1])[0]
+        txtu = self.decode_strings(self.cunits[i:i+1])[0]
+        return (txtn, txtu)
         #  #]
     def delayed_repl_check_for_incorrect_use(self):
         #  #[ check routine for delayed replication usage
@@ -1633,6 +2213,18 @@ class BUFRInterfaceECMWF:
                        'messages.')
             raise IncorrectUsageError(errtxt)
         #  #]
+    def get_encoded_message_bytes(self):
+        #  #[ byte view of the encoded message
+        """
+        return the encoded message as an array of bytes, without
+        copying if it already is an array of little endian 4 byte words
+        (as returned by RawBUFRFile.get_raw_bufr_msg)
+        """
+        words = np.asarray(self.encoded_message)
+        if words.dtype != np.dtype('<i4'):
+            words = words.astype('<i4')
+        return words.view(np.uint8)
+        #  #]
     def extract_raw_descriptor_list(self):
         #  #[ extract the raw descriptor list from the binary bufr msg
         """
@@ -1647,56 +2239,36 @@ class BUFRInterfaceECMWF:
 
         # print("extracting raw descriptor list:")
         
-        # method to implement
-        # use get_expected_msg_size from raw_bufr_file.py
-        # to get all relevant section start pointers
-        # and use this to start extracting this data.
-
         # available meta data:
         # self.section_sizes
         # self.section_start_locations
         # available data:
         # self.encoded_message
+        raw_data_bytes = self.get_encoded_message_bytes()
 
-        # assume little endian for now when converting
-        # raw bytes/characters to integers and vice-versa
-        dataformat = "<i"
-        size_words = len(self.encoded_message)
-        size_bytes = size_words*4
-
-        list_of_raw_data_bytes = []
-        for (i, word) in enumerate(self.encoded_message):
-            list_of_raw_data_bytes.append(struct.pack(dataformat, word))
-        raw_data_bytes = b''.join(rdb for rdb in list_of_raw_data_bytes)
-
-        # note: the headers seem to use big-endian encoding
-        # even on little endian machines, for the msg size.
-        dataformat = ">1i"
-        
+        # note: the headers use big-endian encoding
         start_section3 = self.section_start_locations[3]
         # print('start_section3 = ',start_section3)
         # extract the number of subsets from bytes 5 and 6
-        raw_bytes = b'\x00'*2+raw_data_bytes[start_section3+5-1:
-                                             start_section3+6]
-        self.py_num_subsets = struct.unpack(dataformat, raw_bytes)[0]
+        self.py_num_subsets = (256*int(raw_data_bytes[start_section3+5-1])+
+                               int(raw_data_bytes[start_section3+6-1]))
         # print('self.py_num_subsets = ',self.py_num_subsets)
 
         # print('length section3: ', self.section_sizes[3])
-        num_descriptors = int(0.5*(self.section_sizes[3]-7))
+        num_descriptors = (self.section_sizes[3]-7)//2
         # print('num descriptors: ',num_descriptors)
 
         # do the actual extraction of the raw/unexpanded descriptors
-        self.py_unexp_descr_list = []
-        for i in range(num_descriptors):
-            # extract the unexpanded descriptors
-            raw_bytes = raw_data_bytes[start_section3+8-1+i*2:
-                                       start_section3+8+1+i*2]
-            #print('raw_bytes = '+'.'.join(str(ord(b)) for b in raw_bytes))
-            f = (ord(raw_bytes[0:1]) & (128+64))//64
-            x = ord(raw_bytes[0:1]) & (64-1)
-            y = ord(raw_bytes[1:2])
-            #print('extracted descriptor: f,x,y = %1.1i.%2.2i.%3.3i' % (f,x,y))
-            self.py_unexp_descr_list.append('%1.1i%2.2i%3.3i' % (f,x,y))
+        # which are stored in 2 bytes each, starting at byte 8,
+        # as f (2 bits), x (6 bits) and y (8 bits)
+        descr_bytes = raw_data_bytes[start_section3+8-1:
+                                     start_section3+8-1+2*num_descriptors]
+        descr_bytes = descr_bytes.reshape((num_descriptors, 2)).astype(int)
+        f = (descr_bytes[:, 0] & (128+64))//64
+        x = descr_bytes[:, 0] & (64-1)
+        y = descr_bytes[:, 1]
+        self.py_unexp_descr_list = ['%6.6i' % descr for descr in
+                                    (100000*f+1000*x+y).tolist()]
 
         # print('self.py_unexp_descr_list = ',self.py_unexp_descr_list)
         # print('with length = ',len(self.py_unexp_descr_list))
@@ -1714,14 +2286,28 @@ class BUFRInterfaceECMWF:
                       "expanding raw descriptor lists is possible.")
             raise EcmwfBufrLibError(errtxt)
             
-        exp_descr_list, delayed_repl_present = \
-                        self.bt.expand_descriptor_list(self.py_unexp_descr_list)
-
-        if delayed_repl_present:
+        # reuse the decode plan of a previous message with
+        # the same template, if available
+        cls = BUFRInterfaceECMWF
+        key = (self.bt.table_set_key, tuple(self.py_unexp_descr_list))
+        plan = cls.decode_plan_cache.pop(key, None)
+        if plan is None:
+            exp_descr_list, delayed_repl_present = \
+                     self.bt.expand_descriptor_list(self.py_unexp_descr_list)
+            plan = {'delayed_repl_present':delayed_repl_present,
+                    'expanded_descr_list':exp_descr_list}
+            if len(cls.decode_plan_cache) >= cls.decode_plan_cache_size:
+                # remove the least recently used plan
+                cls.decode_plan_cache.popitem(last=False)
+        # (re)insert the plan as the most recently used one
+        cls.decode_plan_cache[key] = plan
+        self.decode_plan = plan
+
+        if plan['delayed_repl_present']:
             self.py_expanded_descr_list = []
             self.delayed_repl_present = True
         else:
-            self.py_expanded_descr_list = exp_descr_list
+            self.py_expanded_descr_list = list(plan['expanded_descr_list'])
             self.delayed_repl_present = False
             
         #for descr in 
@@ -1823,6 +2409,32 @@ class BUFRInterfaceECMWF:
 
         self.descriptors_list_filled = True
         #  #]
+    def call_busel2(self, subset, kelem, ktdlst, ktdexp, cnames, cunits):
+        #  #[ wrapper for busel2
+        """
+        fill the given arrays with the normal and expanded descriptor
+        lists, names and units for the given subset using busel2,
+        and return the number of used entries as a tuple (ktdlen, ktdexl)
+        """
+        self.store_fortran_stdout()
+        # note: the scalar outputs are returned by the interface
+        # (see BUSEL2_OUTPUT_SCALARS in build_interface.py)
+        (ktdlen,      # actual number of data descriptors
+         ktdexl,      # actual nr of expanded data descriptors
+         kerr) = \
+         ecmwfbufr.busel2(subset,      # subset to be inspected
+                          kelem,       # Max number of expected elements
+                          # outputs:
+                          ktdlst,      # list of data descriptors
+                          ktdexp,      # list of expanded data descriptors
+                          cnames,      # descriptor names
+                          cunits)      # descriptor units
+        lines = self.get_fortran_stdout()
+        self.display_fortran_stdout(lines)
+        if (kerr != 0):
+            raise EcmwfBufrLibError(self.explain_error(kerr, 'busel2'))
+        return (ktdlen, ktdexl)
+        #  #]
     def fill_descriptor_list_subset(self, subset):
         #  #[ fills both the normal and expanded descriptor lists
         """
@@ -1846,12 +2458,28 @@ class BUFRInterfaceECMWF:
         # or bufrex have been called previously on the same bufr message.....
 
         # kelem  = 500 #self.max_nr_expanded_descriptors
-        kerr   = 0
 
         actual_nr_of_descriptors = len(self.py_unexp_descr_list)
 
         # define space for decoding text strings
         kelem  = self.actual_kelem
+
+        # without delayed replication all subsets and all messages
+        # using the same template have the same descriptor lists,
+        # names and units, so take them from the decode plan if possible
+        plan = self.decode_plan
+        use_plan = ( (not self.delayed_repl_present) and
+                     (plan is not None) )
+        if use_plan and (plan.get('kelem') == kelem):
+            self.ktdlst = plan['ktdlst']
+            self.ktdlen = len(self.ktdlst)
+            self.ktdexp = plan['ktdexp']
+            self.ktdexl = len(self.ktdexp)
+            self.cnames = plan['cnames']
+            self.cunits = plan['cunits']
+            self.ksup[4] = self.ktdexl
+            self.descriptors_list_filled = True
+            return
         self.cnames = np.zeros((kelem, 64), dtype = '|S1')
         self.cunits = np.zeros((kelem, 24), dtype = '|S1')
 
@@ -1877,37 +2505,30 @@ class BUFRInterfaceECMWF:
             # print('self.actual_kelem = ', self.actual_kelem)
 
         # print('DEBUG: len(self.ktdexp) = ', len(self.ktdexp))
-        self.store_fortran_stdout()
-        ecmwfbufr.busel2(subset,      # subset to be inspected
-                         kelem,       # Max number of expected elements
-                         # outputs:
-                         self.ktdlen, # actual number of data descriptors
-                         self.ktdlst, # list of data descriptors
-                         self.ktdexl, # actual nr of expanded data descriptors
-                         self.ktdexp, # list of expanded data descriptors
-                         self.cnames, # descriptor names
-                         self.cunits, # descriptor units
-                         kerr)        # error code
-        lines = self.get_fortran_stdout()
-        self.display_fortran_stdout(lines)
-        if (kerr != 0):
-            raise EcmwfBufrLibError(self.explain_error(kerr, 'busel2'))
+        (ktdlen, ktdexl) = self.call_busel2(subset, kelem, self.ktdlst,
+                                            self.ktdexp, self.cnames,
+                                            self.cunits)
 
         # print('DEBUG: call to busel2 finished')
 
-        # It is not clear to me why busel seems to correctly produce
-        # the descriptor lists (both bare and expanded), but yet it does
-        # not seem to fill the ktdlen and ktdexl values.
-        # To fix this the next 4 lines have been added:
+        # keep only the used part of the descriptor lists
+        # (copies, since these may be stored in the decode plan)
+        self.ktdlst = self.ktdlst[:ktdlen].copy()
+        self.ktdlen = ktdlen
         
-        selection1 = np.where(self.ktdlst > 0)
-        self.ktdlst = self.ktdlst[selection1]
-        self.ktdlen = len(self.ktdlst)
-        
-        selection2 = np.where(self.ktdexp > 0)
-        self.ktdexp = self.ktdexp[selection2]
-        self.ktdexl = len(self.ktdexp)
+        self.ktdexp = self.ktdexp[:ktdexl].copy()
+        self.ktdexl = ktdexl
         self.ksup[4] = self.ktdexl
+
+        if use_plan:
+            # these arrays are shared by all messages using this plan
+            for array in (self.ktdlst, self.ktdexp, self.cnames, self.cunits):
+                array.flags.writeable = False
+            plan['kelem'] = kelem
+            plan['ktdlst'] = self.ktdlst
+            plan['ktdexp'] = self.ktdexp
+            plan['cnames'] = self.cnames
+            plan['cunits'] = self.cunits
         
         self.descriptors_list_filled = True
         #  #]
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+
+"""
+This file defines the BUFRStreamFramer class, that locates complete
+BUFR messages in data that arrives in chunks (from a pipe, a socket or
+a file that is still growing), and the BUFRStreamReader class, that
+decodes each message as soon as it has been received completely.
+"""
+
+#  #[ documentation
+#
+# The framer uses the same checks as RawBUFRFile.split(): a BUFR start
+# marker is only accepted if the message size given by its header is
+# consistent with the section sizes, and the 7777 end marker is present
+# at exactly that location.
+# Only the data after the last complete message is kept between chunks
+# (the carry-over buffer). Since a BUFR message can not be larger than
+# max_msg_size, the carry-over buffer never holds more than max_msg_size
+# bytes plus the size of the last chunk. Note that a false start marker
+# may hold up the messages behind it until max_msg_size bytes have been
+# received, so a smaller max_msg_size (like the 500kb GTS limit) may help
+# to reduce the latency for streams that contain junk.
+#
+# Note about the use of the "#  #[" and "#  #]" comments:
+#   these are folding marks for my favorite editor, emacs, combined with its
+#   folding mode
+#   (see http://www.emacswiki.org/emacs/FoldingMode for more details)
+# Please do not remove them.
+#
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+#
+#  #]
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function) #, unicode_literals)
+
+import time        # waiting for more data in follow mode
+import struct      # allow converting c datatypes and structs
+import numpy as np # import numerical capabilities
+
+from .raw_bufr_file import RawBUFRFile
+from .header_catalogue import (build_header_catalogue, get_header,
+                               get_unexp_descr_list, make_header_filter)
+#  #]
+#  #[ some constants
+# the largest message size that fits in the 3 bytes of section 0
+MAX_MSG_SIZE = 16777215
+
+# the newest BUFR edition. A start marker followed by a higher edition
+# number must be a false one, which is rejected before waiting for the
+# data of a message that isn't there
+MAX_EDITION_NUMBER = 4
+
+DEFAULT_CHUNK_SIZE = 65536
+#  #]
+
+def read_chunk(source, chunk_size):
+    #  #[
+    """
+    read at most chunk_size bytes from the given file object or socket,
+    without waiting for more data than is currently available if possible
+    """
+    if hasattr(source, 'read1'):
+        return source.read1(chunk_size)
+    if hasattr(source, 'recv'):
+        return source.recv(chunk_size)
+    return source.read(chunk_size)
+    #  #]
+
+def read_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE, follow=False,
+                poll_interval=1.0, timeout=None):
+    #  #[
+    """
+    iterate over the chunks of data read from the given file object or
+    socket, until the end of the data is reached. If follow is True the
+    end of the data is not the end of the iteration (like tail -f), but
+    the source is polled every poll_interval seconds for new data, until
+    no new data arrived for timeout seconds (or forever if timeout is None)
+    """
+    last_data_time = time.time()
+    while True:
+        chunk = read_chunk(source, chunk_size)
+        if chunk:
+            last_data_time = time.time()
+            yield chunk
+        elif not follow:
+            return
+        elif ( (timeout is not None) and
+               (time.time()-last_data_time >= timeout) ):
+            return
+        else:
+            time.sleep(poll_interval)
+    #  #]
+
+class BUFRStreamFramer:
+    #  #[
+    """
+    a class to locate complete BUFR messages in a stream of data that
+    is passed in using the feed() method, in chunks of arbitrary size.
+    Each message is returned as soon as its end marker has arrived,
+    in the same form as RawBUFRFile.get_raw_bufr_msg returns it.
+    """
+    def __init__(self, max_msg_size=MAX_MSG_SIZE, verbose=False,
+                 warn_about_bufr_size=True):
+        #  #[
+        self.max_msg_size = max_msg_size
+        self.verbose = verbose
+        # the data received after the last complete message
+        self.carry = bytearray()
+        # the stream position of the first byte of the carry-over buffer
+        self.carry_pos = 0
+        # the location in the carry-over buffer to search for a start marker
+        self.scan_pos = 0
+        # the size of a message that is waiting for the rest of its data
+        self.expected_msg_size = 0
+        self.at_end = False
+        self.nr_of_bufr_messages = 0
+        # the location of the last returned message in the stream
+        self.last_msg_location = None
+        # the message size extraction of RawBUFRFile is applied
+        # to the carry-over buffer
+        self._rbf = RawBUFRFile(verbose=verbose,
+                                warn_about_bufr_size=warn_about_bufr_size)
+        #  #]
+    def feed(self, chunk):
+        #  #[
+        """
+        add a chunk of data (bytes, bytearray, memoryview or numpy buffer)
+        to the stream, and return a list of the BUFR messages that have
+        been completed by it, as (words, section_sizes,
+        section_start_locations) tuples
+        """
+        self.add_data(chunk)
+        return self.get_complete_msgs()
+        #  #]
+    def add_data(self, chunk):
+        #  #[
+        """
+        add a chunk of data to the carry-over buffer
+        """
+        self.carry += chunk
+        #  #]
+    def finish(self):
+        #  #[
+        """
+        signal that the end of the stream has been reached, and return a
+        list of the BUFR messages that can still be found in the remaining
+        data (a start marker that was waiting for more data may have been
+        a false one, hiding a valid message behind it)
+        """
+        self.at_end = True
+        return self.get_complete_msgs()
+        #  #]
+    def get_complete_msgs(self):
+        #  #[
+        """
+        return a list of all complete BUFR messages in the carry-over buffer
+        """
+        messages = []
+        while True:
+            result = self.get_next_complete_msg()
+            if result is None:
+                return messages
+            messages.append(result)
+        #  #]
+    def discard(self, num_bytes):
+        #  #[
+        """
+        remove the given number of bytes from the carry-over buffer
+        """
+        if num_bytes > 0:
+            del self.carry[:num_bytes]
+            self.carry_pos = self.carry_pos + num_bytes
+            self.scan_pos = max(0, self.scan_pos-num_bytes)
+        #  #]
+    def get_next_complete_msg(self):
+        #  #[
+        """
+        locate the next complete BUFR message in the carry-over buffer,
+        and remove it (and any junk in front of it) from the buffer.
+        Returns None if more data is needed.
+        """
+        if (len(self.carry) < self.expected_msg_size) and not self.at_end:
+            # still waiting for the rest of the current message
+            return None
+
+        txt_start = b'BUFR'
+        txt_end   = b'7777'
+        self.expected_msg_size = 0
+        while True:
+            start_location = self.carry.find(txt_start, self.scan_pos)
+            if (start_location == -1):
+                # keep the last 3 bytes only,
+                # since they may be the start of a start marker
+                self.discard(len(self.carry)-len(txt_start)+1)
+                return None
+
+            # discard the junk in front of the start marker
+            self.discard(start_location)
+            if len(self.carry) < 8:
+                if self.at_end:
+                    self.scan_pos = len(txt_start)
+                    continue
+                return None
+
+            edition_number = self.carry[8-1]
+            if edition_number > MAX_EDITION_NUMBER:
+                # a false start marker
+                self.scan_pos = len(txt_start)
+                continue
+            if edition_number > 1:
+                # wait until the data of the whole message has arrived
+                raw_bytes = b'\x00'+bytes(self.carry[5-1:7])
+                msg_size = struct.unpack(">1i", raw_bytes)[0]
+                if (msg_size <= 8) or (msg_size > self.max_msg_size):
+                    # a false start marker
+                    self.scan_pos = len(txt_start)
+                    continue
+                if (len(self.carry) < msg_size) and not self.at_end:
+                    self.expected_msg_size = msg_size
+                    return None
+
+            self._rbf.data = self.carry
+            (msg_size, section_sizes, section_start_locations) = \
+                       self._rbf.get_expected_msg_size(0)
+            self._rbf.data = None
+
+            if ( (msg_size == 0) and (edition_number <= 1) and
+                 (len(self.carry) < self.max_msg_size) and
+                 not self.at_end ):
+                # editions 0 and 1 don't have the message size in section 0,
+                # so this message may just not have all its sections yet
+                return None
+            if ( (msg_size > 0) and (len(self.carry) < msg_size) and
+                 not self.at_end ):
+                self.expected_msg_size = msg_size
+                return None
+
+            if ( (msg_size > 0) and
+                 (self.carry[msg_size-4:msg_size] == txt_end) ):
+                break
+
+            # a false start marker or a corrupt BUFR message,
+            # so continue searching after this start marker
+            self.scan_pos = len(txt_start)
+
+        if (self.verbose):
+            print('found BUFR message of size: ', msg_size)
+
+        # copy the message to a zero padded array of words,
+        # so the carry-over buffer can be reused
+        size_words = (msg_size+3)//4
+        words = np.zeros(size_words, dtype='<i4')
+        words.view(np.uint8)[:msg_size] = \
+              np.frombuffer(self.carry, dtype=np.uint8, count=msg_size)
+
+        self.last_msg_location = self.carry_pos
+        self.discard(msg_size)
+        self.nr_of_bufr_messages = self.nr_of_bufr_messages + 1
+        return (words, section_sizes, section_start_locations)
+        #  #]
+    #  #]
+
+class BUFRStreamReader:
+    #  #[
+    """
+    a class that reads BUFR messages from a file object, socket or
+    file name, and decodes each message as soon as it has been received.
+    It can be used like BUFRReader, but also works for sources that
+    are not seekable, like pipes and sockets.
+    If follow is True, the end of the data is not the end of the iteration,
+    but the source is polled every poll_interval seconds for new data
+    (like tail -f), which allows reading a file that is still being
+    written, until no new data arrived for timeout seconds
+    (or forever if timeout is None).
+    """
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE, follow=False,
+                 poll_interval=1.0, timeout=None, max_msg_size=MAX_MSG_SIZE,
+                 warn_about_bufr_size=True, expand_flags=False,
+                 expand_strings=False, verbose=False, copy_on_yield=False,
+                 where=None, reuse_buffers=False):
+        #  #[
+        # note: only import the decoding part when it is needed,
+        # so the framer can be used without the ECMWF library
+        from .bufr import BUFRReaderBUFRDC
+
+        if hasattr(source, 'read') or hasattr(source, 'recv'):
+            self.source = source
+            self.close_source = False
+        else:
+            self.source = open(source, 'rb')
+            self.close_source = True
+
+        self.chunk_size = chunk_size
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.verbose = verbose
+
+        self.framer = BUFRStreamFramer(
+            max_msg_size=max_msg_size, verbose=verbose,
+            warn_about_bufr_size=warn_about_bufr_size)
+
+        # a reader without any messages of its own, that is used
+        # to decode the messages located by the framer
+        self._reader = BUFRReaderBUFRDC(
+            bytearray(), warn_about_bufr_size=warn_about_bufr_size,
+            expand_flags=expand_flags, expand_strings=expand_strings,
+            verbose=verbose, copy_on_yield=copy_on_yield,
+            reuse_buffers=reuse_buffers)
+
+        self._header_filter = None
+        if where is not None:
+            self.filter(where)
+
+        self.msg_index = 0
+        self.msg = None
+        #  #]
+    def setup_tables(self, table_b_to_use=None, table_c_to_use=None,
+                     table_d_to_use=None, tables_dir=None):
+        #  #[
+        """
+        allow manual choice of bufr tables
+        """
+        self._reader.setup_tables(table_b_to_use, table_c_to_use,
+                                  table_d_to_use, tables_dir)
+        #  #]
+    def tune_decoding_parameters(self,
+                                 nr_of_descriptors_startval=None,
+                                 nr_of_descriptors_maxval=None,
+                                 nr_of_descriptors_multiplier=None):
+        #  #[
+        """
+        set the parameters used for array allocation when decoding
+        (see BUFRReaderBUFRDC.tune_decoding_parameters)
+        """
+        self._reader.tune_decoding_parameters(nr_of_descriptors_startval,
+                                              nr_of_descriptors_maxval,
+                                              nr_of_descriptors_multiplier)
+        #  #]
+    def filter(self, where):
+        #  #[
+        """
+        only decode the messages with headers that match the given filter
+        (see BUFRReaderBUFRDC.filter). Returns the reader itself.
+        """
+        if where is None:
+            self._header_filter = None
+        else:
+            self._header_filter = make_header_filter(where)
+        return self
+        #  #]
+    def get_msg_header(self, location, words, section_sizes,
+                       section_start_locations):
+        #  #[
+        """
+        extract the header of a framed BUFR message in python
+        (the offset item holds the location of the message in the stream)
+        """
+        msg_size = sum(section_sizes)
+        bufr_pointers = (0, msg_size, section_sizes, section_start_locations)
+        catalogue_row = build_header_catalogue(words, [bufr_pointers])[0]
+        catalogue_row['offset'] = location
+        return get_header(catalogue_row,
+                          get_unexp_descr_list(words, bufr_pointers))
+        #  #]
+    def framed_messages(self):
+        #  #[
+        """
+        iterate over the complete BUFR messages currently held by the framer
+        """
+        while True:
+            raw_msg = self.framer.get_next_complete_msg()
+            if raw_msg is None:
+                return
+            yield (self.framer.last_msg_location,)+raw_msg
+        #  #]
+    def raw_messages(self):
+        #  #[
+        """
+        iterate over the raw BUFR messages as (location, words,
+        section_sizes, section_start_locations) tuples, as soon as they
+        have been received
+        """
+        for chunk in read_chunks(self.source, self.chunk_size, self.follow,
+                                 self.poll_interval, self.timeout):
+            self.framer.add_data(chunk)
+            for raw_msg in self.framed_messages():
+                yield raw_msg
+        self.framer.at_end = True
+        for raw_msg in self.framed_messages():
+            yield raw_msg
+        #  #]
+    def messages(self):
+        #  #[
+        """
+        iterate over the BUFR messages, and yield each one as a decoded
+        BUFRMessage instance as soon as it has been received
+        """
+        for (location, words, section_sizes, section_start_locations) in \
+                self.raw_messages():
+            self.msg_index = self.msg_index + 1
+            if ( (self._header_filter is not None) and
+                 (not self._header_filter(self.get_msg_header(
+                     location, words, section_sizes,
+                     section_start_locations))) ):
+                continue
+            self._reader.decode_msg(words, section_sizes,
+                                    section_start_locations, self.msg_index)
+            self.msg = self._reader.msg
+            yield self.msg
+        #  #]
+    def __iter__(self):
+        #  #[ return the above iterator
+        return self.messages()
+        #  #]
+    def __enter__(self):
+        #  #[ enters the 'with' context
+        return self
+        #  #]
+    def __exit__(self, exc, val, trace):
+        #  #[ exits the 'with' context
+        self.close()
+        #  #]
+    def close(self):
+        #  #[
+        """
+        close the source if it was opened by this reader
+        """
+        self._reader.close()
+        if self.close_source:
+            self.source.close()
+        #  #]
+    #  #]
@@ -45,6 +45,12 @@ import os, stat
 import sys
 import glob
 import csv
+import json
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import numpy as np
 
 from pybufr_ecmwf.helpers import python3
 from pybufr_ecmwf.custom_exceptions import (
@@ -52,6 +58,12 @@ from pybufr_ecmwf.custom_exceptions import (
 #  #]
 
 # some constants
+# (increment COMPILED_TABLES_FORMAT_VERSION when the classes stored
+#  in a precompiled table file change in an incompatible way)
+COMPILED_TABLES_FORMAT_VERSION = 2
+# the environment setting that may point to an additional directory
+# holding precompiled tables (see load_compiled_tables)
+COMPILED_TABLES_ENV_NAME = 'PYBUFR_ECMWF_COMPILED_TABLES'
 Short_Delayed_Descr_Repl_Factor       = int('031000', 10)
 Delayed_Descr_Repl_Factor             = int('031001', 10)
 Extended_Delayed_Descr_Repl_Factor    = int('031002', 10)
@@ -711,16 +723,92 @@ class FlagDefinition:
     '''
     a class to handle flag definitions as defined in table C
     '''
+    undefined_text = '<UNDEFINED VALUE>'
     def __init__(self, reference):
         self.reference = reference
         self.flag_dict = {}
+        self.lookup = None
     def __str__(self):
         text = []
         for k in sorted(self.flag_dict):
             text.append('flag: '+str(k)+' value: '+str(self.flag_dict[k]))
         return '\n'.join('==> '+l for l in text)
+    def get_lookup(self):
+        #  #[
+        '''
+        return a sorted array of the defined values, and an array of
+        the corresponding texts, with the text for undefined values
+        appended at the end. These are created only once.
+        '''
+        # note: tables unpickled from an older version may lack
+        # the lookup attribute
+        if getattr(self, 'lookup', None) is None:
+            keys = sorted(self.flag_dict)
+            labels = [self.flag_dict[k] for k in keys]
+            labels.append(self.undefined_text)
+            self.lookup = (np.array(keys, dtype=np.int64),
+                           np.array(labels))
+        return self.lookup
+        #  #]
+    def get_codes(self, values):
+        #  #[
+        '''
+        convert an array of (float) values to indices into the
+        labels array returned by get_lookup. Values that are not
+        defined in this table point to the last label.
+        '''
+        (keys, labels) = self.get_lookup()
+        values = np.asarray(values, dtype=np.float64)
+        # missing values and other huge numbers cannot be converted
+        valid = np.isfinite(values) & (np.abs(values) < 2.**62)
+        int_values = np.where(valid, values, 0).astype(np.int64)
+        codes = np.searchsorted(keys, int_values)
+        codes[codes == len(keys)] = 0
+        if len(keys) > 0:
+            valid &= (keys[codes] == int_values)
+        codes[~valid] = len(keys)
+        return codes
+        #  #]
+    def get_bits(self, values, data_width):
+        #  #[
+        '''
+        split an array of flag table values into boolean columns, one
+        for each bit, numbered 1 upto data_width starting at the most
+        significant bit. Missing values give False for all bits.
+        Returns the 2D array of bits, and an array with the text for
+        each bit number.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values) & (values >= 0) & (values < 2.**62)
+        int_values = np.where(valid, values, 0).astype(np.int64)
+        bit_numbers = np.arange(1, data_width+1)
+        bits = ((int_values[:, np.newaxis] >> (data_width-bit_numbers)) &
+                1).astype(bool)
+        # all bits set means a missing value
+        valid &= (int_values != 2**data_width-1)
+        bits[~valid, :] = False
+        labels = np.array([self.flag_dict.get(b, '') for b in bit_numbers])
+        return (bits, labels)
+        #  #]
     #  #]
     
+class BufrTableSet:
+    #  #[ a parsed set of tables
+    '''
+    a class to hold a parsed set of B, C and D tables, as stored in
+    the table cache of the BufrTable class. The composite descriptors
+    in table D point to this set, so they remain valid when the
+    BufrTable instance that parsed them loads other tables.
+    '''
+    def __init__(self, table_b, table_c, table_d):
+        self.table_b = table_b
+        self.table_c = table_c
+        self.table_d = table_d
+        self.verbose = False
+        for d_descr in self.table_d.values():
+            d_descr.bufr_table_set = self
+    #  #]
+
 class BufrTable:
     #  #[
     """
@@ -743,12 +831,27 @@ class BufrTable:
     saved_B_table = None
     saved_C_table = None
     saved_D_table = None
+
+    # In addition, a number of previously parsed table sets are kept
+    # in a cache, so switching between table sets (for example in
+    # a file with messages from different centres) does not require
+    # parsing the table files again. The key is built from the
+    # resolved B, C and D table filenames and their modification times
+    # (see get_table_cache_key) and the least recently used
+    # table set is removed when the cache is full.
+    currently_loaded_key = None
+    table_cache = {}
+    table_cache_keys = [] # least recently used first
+    table_cache_size = 8
+    table_cache_hits = 0
+    table_cache_misses = 0
     
     def __init__(self,
                  autolink_tablesdir="tmp_BUFR_TABLES",
                  tables_dir=None,
                  verbose=True,
-                 report_warnings=True):
+                 report_warnings=True,
+                 compiled_tables_dir=None):
         #  #[
         self.table_b   = {} # dict of desciptor-objects (f=0)
         self.specials  = {} # dict of specials  (f=1)
@@ -757,8 +860,17 @@ class BufrTable:
 
         self.table_c   = {} # dict of flag definitions
 
+        # the cache key of the loaded table set (see load)
+        self.table_set_key = None
+
         self.verbose = verbose
         self.report_warnings = report_warnings
+
+        # an additional directory to search for precompiled tables
+        # (see load_compiled_tables)
+        if compiled_tables_dir is None:
+            compiled_tables_dir = os.environ.get(COMPILED_TABLES_ENV_NAME)
+        self.compiled_tables_dir = compiled_tables_dir
         
         self.autolink_tables = True
         if (tables_dir is not None):
@@ -1084,64 +1196,310 @@ class BufrTable:
         C_tablefile = os.path.join(path, 'C'+base[1:])
         D_tablefile = os.path.join(path, 'D'+base[1:])
 
-        reload_tables = False
-        if base[0].upper() == 'B':
-            #
-            if (self.__class__.currently_loaded_B_table !=  B_tablefile):
-                reload_tables = True
-        elif base[0].upper() == 'C':
-            if (self.__class__.currently_loaded_C_table != C_tablefile):
-                reload_tables = True
-        elif base[0].upper() == 'D':
-            if (self.__class__.currently_loaded_D_table != D_tablefile):
-                reload_tables = True
-        else:
+        if base[0].upper() not in ['B', 'C', 'D']:
             print("ERROR: don't know what table this is")
             print("(path, base) = "+str((path, base)))
             raise IOError
-        
-        if reload_tables:
+
+        cls = self.__class__
+        key = self.get_table_cache_key(B_tablefile, C_tablefile, D_tablefile)
+
+        if (key == cls.currently_loaded_key):
+            # reuse the already loaded tables
+            #print('******* DEBUG: Reusing stored tables')
+            self.table_b = cls.saved_B_table
+            self.table_c = cls.saved_C_table
+            self.table_d = cls.saved_D_table
+        elif key in cls.table_cache:
+            # reuse a table set that was loaded before
+            #print('******* DEBUG: Reusing cached tables')
+            cls.table_cache_hits += 1
+            cls.table_cache_keys.remove(key)
+            cls.table_cache_keys.append(key)
+            table_set = cls.table_cache[key]
+            self.table_b = table_set.table_b
+            self.table_c = table_set.table_c
+            self.table_d = table_set.table_d
+        else:
             # first unload the previous file
             # note that unload removes all 3 files (B,C,D)
             # see just reload all 3 as well
             # next calls to this load method will detect this,
-            # set reload_tables to False and use the stored version
+            # and use the stored version
+            cls.table_cache_misses += 1
 
             #print('******* DEBUG: unloading tables')
             self.unload_tables()
 
-            # then load the new files
-            #print('******* DEBUG: reloading table B: ',  B_tablefile)
-            self.load_b_table(B_tablefile)
-            self.__class__.saved_B_table = self.table_b
+            # see if a precompiled version of these tables is available
+            # (see compile_tables below)
+            table_set = self.load_compiled_tables(B_tablefile, C_tablefile,
+                                                  D_tablefile)
+            if table_set is not None:
+                self.table_b = table_set.table_b
+                self.table_c = table_set.table_c
+                self.table_d = table_set.table_d
+            else:
+                # load the new files
+                self.load_tables_from_text_files(B_tablefile, C_tablefile,
+                                                 D_tablefile)
+                table_set = BufrTableSet(self.table_b,
+                                         self.table_c,
+                                         self.table_d)
+
+            # store the result in the cache
+            if cls.table_cache_size > 0:
+                if len(cls.table_cache_keys) >= cls.table_cache_size:
+                    oldest_key = cls.table_cache_keys.pop(0)
+                    del cls.table_cache[oldest_key]
+                cls.table_cache[key] = table_set
+                cls.table_cache_keys.append(key)
+
+        self.table_set_key = key
+        cls.saved_B_table = self.table_b
+        cls.saved_C_table = self.table_c
+        cls.saved_D_table = self.table_d
+        cls.currently_loaded_key = key
+        cls.currently_loaded_B_table = B_tablefile
+        cls.currently_loaded_C_table = C_tablefile
+        cls.currently_loaded_D_table = D_tablefile
+        #  #]
+    def load_tables_from_text_files(self, B_tablefile, C_tablefile,
+                                    D_tablefile):
+        #  #[
+        """
+        parse a set of B, C and D tables from the ECMWF text format
+        """
+        #print('******* DEBUG: reloading table B: ',  B_tablefile)
+        self.load_b_table(B_tablefile)
+
+        # allow this load to fail for now, since some BUFR tables
+        # versions provided by ECMWF consist of a B and D table only...
+        # (and the C table is not needed for basic encoding/decoding
+        #  anyway, only for interpretation of flag tables)
+        #print('******* DEBUG: reloading table C: ', C_tablefile)
+        try:
+            self.load_c_table(C_tablefile)
+        except IOError:
+            pass
+        except UnicodeDecodeError:
+            print('Text encding problem detected in file: ', C_tablefile)
+            raise
 
-            # allow this load to fail for now, since some BUFR tables
-            # versions provided by ECMWF consist of a B and D table only...
-            # (and the C table is not needed for basic encoding/decoding
-            #  anyway, only for interpretation of flag tables)
-            #print('******* DEBUG: reloading table C: ', C_tablefile)
+        #print('******* DEBUG: reloading table D: ', D_tablefile)
+        self.load_d_table(D_tablefile)
+        #  #]
+    def get_compiled_table_name(self, B_tablefile):
+        #  #[
+        """
+        construct the name of the precompiled file for the set
+        of tables to which the given B table belongs, for example
+        0000000000098015001.pickle for table B0000000000098015001.TXT
+        """
+        base = os.path.basename(B_tablefile)
+        return os.path.splitext(base[1:])[0]+'.pickle'
+        #  #]
+    def get_table_file_properties(self, B_tablefile, C_tablefile,
+                                  D_tablefile):
+        #  #[
+        """
+        return the resolved path, size and modification time of each
+        table file, used to verify a precompiled table set is still
+        up to date
+        """
+        properties = []
+        for tablefile in (B_tablefile, C_tablefile, D_tablefile):
+            realpath = os.path.realpath(tablefile)
             try:
-                self.load_c_table(C_tablefile)
-                self.__class__.saved_C_table = self.table_c
-            except IOError:
-                pass
-            except UnicodeDecodeError:
-                print('Text encding problem detected in file: ', C_tablefile)
-                raise
-
-            #print('******* DEBUG: reloading table D: ', D_tablefile)
-            self.load_d_table(D_tablefile)
-            self.__class__.saved_D_table = self.table_d
-
-        else: # reuse the already loaded tables
-            #print('******* DEBUG: Reusing stored tables')
-            self.table_b = self.__class__.saved_B_table
-            self.table_c = self.__class__.saved_C_table
-            self.table_d = self.__class__.saved_D_table
+                properties.append([realpath,
+                                   os.path.getsize(realpath),
+                                   os.path.getmtime(realpath)])
+            except OSError:
+                # the C table is optional
+                properties.append([realpath, None, None])
+        return properties
+        #  #]
+    def get_compiled_tables_dirs(self, B_tablefile):
+        #  #[
+        """
+        return the directories to search for a precompiled table set:
+        the compiled_tables_dir (if set), the directory of the B table,
+        and the directories of the files the B table links to
+        (if it is a symbolic link)
+        """
+        dirs = []
+        if self.compiled_tables_dir is not None:
+            dirs.append(self.compiled_tables_dir)
+        tablefile = B_tablefile
+        # note: limit the number of links followed, in case of a loop
+        for i in range(10):
+            dirs.append(os.path.dirname(tablefile))
+            if not os.path.islink(tablefile):
+                break
+            tablefile = os.path.join(os.path.dirname(tablefile),
+                                     os.readlink(tablefile))
+        return dirs
+        #  #]
+    def read_compiled_tables(self, compiled_file, properties):
+        #  #[
+        """
+        read a precompiled table file, and return its table set if the
+        file is valid for the table files with the given properties,
+        otherwise return None.
+        The header line of the file is checked before the table set is
+        unpickled, so only files written by compile_tables for exactly
+        these table files are unpickled. Note that unpickling a file
+        can execute arbitrary code, so precompiled tables must only be
+        placed in directories that can only be written by trusted users.
+        Files that are writable by all users are never loaded.
+        """
+        try:
+            if os.stat(compiled_file).st_mode & stat.S_IWOTH:
+                return None
+            with open(compiled_file, 'rb') as cfd:
+                header = json.loads(cfd.readline().decode('ascii'))
+                if ( (header.get('format_version') !=
+                      COMPILED_TABLES_FORMAT_VERSION) or
+                     (header.get('table_files') != properties) ):
+                    return None
+                # the tables can not have been compiled before the
+                # table files were last modified
+                compiled_mtime = os.path.getmtime(compiled_file)
+                for (realpath, size, mtime) in properties:
+                    if (mtime is not None) and (mtime > compiled_mtime):
+                        return None
+                return pickle.load(cfd)
+        except Exception:
+            # ignore unreadable files (for example files written
+            # by an older version or an incompatible python version)
+            return None
+        #  #]
+    def load_compiled_tables(self, B_tablefile, C_tablefile, D_tablefile):
+        #  #[
+        """
+        try to load a precompiled set of tables (see compile_tables and
+        read_compiled_tables). It is searched for in the compiled_tables_dir
+        given to the constructor (or in the directory given by the
+        PYBUFR_ECMWF_COMPILED_TABLES environment setting), in the directory
+        of the B table, and in the directories of the files the B table
+        links to (if it is a symbolic link).
+        Returns a BufrTableSet instance, or None if no valid precompiled
+        file is found.
+        """
+        compiled_name = self.get_compiled_table_name(B_tablefile)
+        properties = None
+        for compiled_tables_dir in self.get_compiled_tables_dirs(B_tablefile):
+            compiled_file = os.path.join(compiled_tables_dir, compiled_name)
+            if not os.path.exists(compiled_file):
+                continue
+            if properties is None:
+                properties = self.get_table_file_properties(B_tablefile,
+                                                            C_tablefile,
+                                                            D_tablefile)
+            table_set = self.read_compiled_tables(compiled_file, properties)
+            if table_set is not None:
+                if self.verbose:
+                    print("loaded precompiled tables from file: "+
+                          compiled_file)
+                return table_set
+
+        return None
+        #  #]
+    def compile_tables(self, B_tablefile, compiled_tables_dir=None):
+        #  #[
+        """
+        load the set of tables to which the given B table belongs, and
+        write them in a precompiled (pickled) format, that can be loaded
+        much faster than the original text files. By default the
+        precompiled file is written in the directory holding the B table,
+        if another directory is used it should be given as
+        compiled_tables_dir to the BufrTable instance that loads the
+        tables (or by the PYBUFR_ECMWF_COMPILED_TABLES environment setting).
+        The file starts with a header line that identifies the table
+        files it was made from, followed by the pickled table set.
+        Returns the name of the written file.
+        """
+        (path, base) = os.path.split(B_tablefile)
+        C_tablefile = os.path.join(path, 'C'+base[1:])
+        D_tablefile = os.path.join(path, 'D'+base[1:])
 
-        self.__class__.currently_loaded_B_table = B_tablefile
-        self.__class__.currently_loaded_C_table = C_tablefile
-        self.__class__.currently_loaded_D_table = D_tablefile
+        # always parse the text files here
+        self.unload_tables()
+        self.load_tables_from_text_files(B_tablefile, C_tablefile,
+                                         D_tablefile)
+        table_set = BufrTableSet(self.table_b, self.table_c, self.table_d)
+        header = {
+            'format_version':COMPILED_TABLES_FORMAT_VERSION,
+            'table_files':self.get_table_file_properties(B_tablefile,
+                                                         C_tablefile,
+                                                         D_tablefile)}
+
+        if compiled_tables_dir is None:
+            compiled_tables_dir = path
+        compiled_file = os.path.join(compiled_tables_dir,
+                                     self.get_compiled_table_name(B_tablefile))
+        with open(compiled_file, 'wb') as cfd:
+            cfd.write((json.dumps(header)+'\n').encode('ascii'))
+            # note: protocol 2 can be read by both python2 and python3
+            pickle.dump(table_set, cfd, 2)
+
+        # don't keep these tables around as if they were loaded
+        self.unload_tables()
+
+        return compiled_file
+        #  #]
+    def get_table_cache_key(self, B_tablefile, C_tablefile, D_tablefile):
+        #  #[
+        """
+        construct the key used to store a set of tables in the table cache,
+        holding the real (symlink resolved) path and modification time
+        of each table file
+        """
+        key = []
+        for tablefile in (B_tablefile, C_tablefile, D_tablefile):
+            realpath = os.path.realpath(tablefile)
+            try:
+                mtime = os.path.getmtime(realpath)
+            except OSError:
+                # the C table is optional
+                mtime = None
+            key.append((realpath, mtime))
+        return tuple(key)
+        #  #]
+    def set_table_cache_size(self, table_cache_size):
+        #  #[
+        """
+        change the maximum number of table sets that is kept
+        in the table cache (0 disables caching)
+        """
+        cls = self.__class__
+        cls.table_cache_size = table_cache_size
+        while len(cls.table_cache_keys) > max(0, table_cache_size):
+            oldest_key = cls.table_cache_keys.pop(0)
+            del cls.table_cache[oldest_key]
+        #  #]
+    def get_table_cache_info(self):
+        #  #[
+        """
+        return a dict with the number of hits and misses and
+        the current and maximum size of the table cache
+        """
+        cls = self.__class__
+        return {'hits':cls.table_cache_hits,
+                'misses':cls.table_cache_misses,
+                'size':len(cls.table_cache_keys),
+                'maxsize':cls.table_cache_size}
+        #  #]
+    def clear_table_cache(self):
+        #  #[
+        """
+        remove all table sets from the table cache and reset its counters
+        """
+        cls = self.__class__
+        cls.table_cache = {}
+        cls.table_cache_keys = []
+        cls.table_cache_hits = 0
+        cls.table_cache_misses = 0
         #  #]
     def autolinkbufrtablefile(self, t_file):
         #  #[
@@ -2017,8 +2375,11 @@ class BufrTable:
         self.table_d   = {}
         self.list_of_d_entry_lineblocks = []
         self.num_d_blocks = 0
+        self.table_set_key = None
 
         # reset class attributes
+        # (note that this does not clear the table cache)
+        self.__class__.currently_loaded_key = None
         self.__class__.currently_loaded_B_table = None
         self.__class__.currently_loaded_C_table = None
         self.__class__.currently_loaded_D_table = None
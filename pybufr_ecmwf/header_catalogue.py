@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+
+"""
+This file defines a pure python parser for the headers (sections 0, 1
+and 3) of all BUFR messages in a file, that produces a catalogue in the
+form of a numpy structured array, without using the ECMWF library.
+"""
+
+#  #[ documentation
+#
+# The catalogue holds one row per BUFR message, with the fields
+# defined in HEADER_CATALOGUE_DTYPE. It is created from the message
+# locations found by RawBUFRFile, by gathering the header bytes of all
+# messages at once with numpy indexing, so no BUFRInterfaceECMWF instance
+# or library call is needed per message.
+# Use RawBUFRFile.get_header_catalogue() or get_header_catalogue()
+# defined below to create it.
+#
+# Notes on the fields:
+# -editions 0 upto 3 only store the year of the century. These years are
+#  converted assuming years below 70 belong to the 21st century.
+# -the international data subcategory only exists for edition 4, and
+#  is set to 255 (missing) for older editions.
+# -the master table number only exists for edition 2 and newer (for
+#  editions 0 and 1 byte 4 of section 1 holds the edition number),
+#  and is set to 0 for older editions.
+# -timestamp is NaT (not a time) if the date in section 1 is invalid.
+# -template_hash is derived from the unexpanded descriptor list in
+#  section 3, so messages with the same template have the same hash.
+#
+# The header of a single message can also be tested against a filter
+# (see make_header_filter), which allows BUFRReader to skip decoding
+# of messages that are not needed.
+#
+# Note about the use of the "#  #[" and "#  #]" comments:
+#   these are folding marks for my favorite editor, emacs, combined with its
+#   folding mode
+#   (see http://www.emacswiki.org/emacs/FoldingMode for more details)
+# Please do not remove them.
+#
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+#
+#  #]
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function) #, unicode_literals)
+
+import hashlib     # hashing of the descriptor lists
+import numpy as np # import numerical capabilities
+
+from .custom_exceptions import IncorrectUsageError
+#  #]
+#  #[ some constants
+HEADER_CATALOGUE_DTYPE = np.dtype([
+    ('offset', np.int64),
+    ('length', np.int64),
+    ('edition', np.uint8),
+    ('centre', np.uint16),
+    ('subcentre', np.uint16),
+    ('update_sequence_number', np.uint8),
+    ('data_category', np.uint8),
+    ('international_subcategory', np.uint8),
+    ('data_subcategory', np.uint8),
+    ('master_table', np.uint8),
+    ('master_table_version', np.uint8),
+    ('local_table_version', np.uint8),
+    ('year', np.uint16),
+    ('month', np.uint8),
+    ('day', np.uint8),
+    ('hour', np.uint8),
+    ('minute', np.uint8),
+    ('second', np.uint8),
+    ('timestamp', 'datetime64[s]'),
+    ('num_subsets', np.uint16),
+    ('observed', np.bool_),
+    ('compressed', np.bool_),
+    ('template_hash', np.uint64),
+    ])
+
+# the number of bytes used from the start of section 1 (edition 4)
+SECTION1_BYTES = 22
+
+# the name of the header item holding the unexpanded descriptor list,
+# which is available to filters in addition to the catalogue fields
+UNEXP_DESCR_LIST = 'unexp_descr_list'
+#  #]
+
+def get_bytes(data):
+    #  #[
+    """
+    return a uint8 numpy view on the given file data
+    (a bytes object or a memory map)
+    """
+    return np.frombuffer(data, dtype=np.uint8)
+    #  #]
+
+def get_template_hash(descriptor_bytes):
+    #  #[
+    """
+    return a 64 bit hash of the given descriptor list bytes
+    """
+    digest = hashlib.md5(descriptor_bytes).digest()
+    return int(np.frombuffer(digest[:8], dtype='<u8')[0])
+    #  #]
+
+def get_timestamps(catalogue):
+    #  #[
+    """
+    combine the date and time fields of the catalogue into
+    datetime64 values, using NaT for invalid dates
+    """
+    year = catalogue['year'].astype(np.int64)
+    month = catalogue['month'].astype(np.int64)
+    day = catalogue['day'].astype(np.int64)
+    hour = catalogue['hour'].astype(np.int64)
+    minute = catalogue['minute'].astype(np.int64)
+    second = catalogue['second'].astype(np.int64)
+
+    valid = ( (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) &
+              (hour < 24) & (minute < 60) & (second < 60) )
+
+    months = ((year-1970)*12 + month-1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day-1)
+    timestamps = (days.astype('datetime64[s]') +
+                  (3600*hour + 60*minute + second))
+
+    # reject days beyond the end of the month
+    valid &= (timestamps.astype('datetime64[M]') == months)
+    timestamps[~valid] = np.datetime64('NaT')
+    return timestamps
+    #  #]
+
+def build_header_catalogue(data, list_of_bufr_pointers):
+    #  #[
+    """
+    create the header catalogue for the BUFR messages located by the
+    given list of BUFR pointers (see RawBUFRFile.list_of_bufr_pointers)
+    in the given file data. Returns a numpy structured array with dtype
+    HEADER_CATALOGUE_DTYPE.
+    """
+    nmsgs = len(list_of_bufr_pointers)
+    catalogue = np.zeros(nmsgs, dtype=HEADER_CATALOGUE_DTYPE)
+    if nmsgs == 0:
+        return catalogue
+
+    raw_bytes = get_bytes(data)
+    last_index = len(raw_bytes)-1
+
+    starts = np.array([ptr[0] for ptr in list_of_bufr_pointers],
+                      dtype=np.int64)
+    ends = np.array([ptr[1] for ptr in list_of_bufr_pointers],
+                    dtype=np.int64)
+    start_section1 = starts + np.array(
+        [ptr[3][1] for ptr in list_of_bufr_pointers], dtype=np.int64)
+    start_section3 = starts + np.array(
+        [ptr[3][3] for ptr in list_of_bufr_pointers], dtype=np.int64)
+    size_section3 = np.array([ptr[2][3] for ptr in list_of_bufr_pointers],
+                             dtype=np.int64)
+
+    # gather the header bytes of all messages in 2D arrays,
+    # in which column i holds byte i+1 of the section
+    # (clip the indices, since short messages at the end of the file
+    #  may not have all bytes available)
+    sec1 = raw_bytes[np.minimum(start_section1[:, np.newaxis] +
+                                np.arange(SECTION1_BYTES),
+                                last_index)].astype(np.int64)
+    sec3 = raw_bytes[np.minimum(start_section3[:, np.newaxis] +
+                                np.arange(7),
+                                last_index)].astype(np.int64)
+
+    # for editions 0 and 1 section 0 only holds 'BUFR', and the
+    # edition number is stored in byte 4 of section 1, so the edition
+    # can be taken from byte 8 of the message for all editions
+    edition = raw_bytes[np.minimum(starts+7, last_index)]
+
+    catalogue['offset'] = starts
+    catalogue['length'] = ends - starts
+    catalogue['edition'] = edition
+    # editions 0 and 1 have no master table number, see above
+    catalogue['master_table'] = np.where(edition >= 2, sec1[:, 4-1], 0)
+
+    ed4 = (edition >= 4)
+    ed3 = (edition == 3)
+    old = ~ed4
+
+    def set_field(name, selection, values):
+        """ fill a field for the selected messages """
+        catalogue[name][selection] = values[selection]
+
+    # editions 0 upto 3
+    set_field('centre', old, 256*sec1[:, 5-1] + sec1[:, 6-1])
+    set_field('centre', ed3, sec1[:, 6-1])
+    set_field('subcentre', ed3, sec1[:, 5-1])
+    set_field('update_sequence_number', old, sec1[:, 7-1])
+    set_field('data_category', old, sec1[:, 9-1])
+    set_field('data_subcategory', old, sec1[:, 10-1])
+    set_field('master_table_version', old, sec1[:, 11-1])
+    set_field('local_table_version', old, sec1[:, 12-1])
+    year_of_century = sec1[:, 13-1]
+    set_field('year', old, np.where(year_of_century < 70,
+                                    2000+year_of_century,
+                                    1900+year_of_century))
+    for (i, name) in enumerate(['month', 'day', 'hour', 'minute']):
+        set_field(name, old, sec1[:, 14-1+i])
+    catalogue['international_subcategory'][old] = 255
+
+    # edition 4
+    set_field('centre', ed4, 256*sec1[:, 5-1] + sec1[:, 6-1])
+    set_field('subcentre', ed4, 256*sec1[:, 7-1] + sec1[:, 8-1])
+    set_field('update_sequence_number', ed4, sec1[:, 9-1])
+    set_field('data_category', ed4, sec1[:, 11-1])
+    set_field('international_subcategory', ed4, sec1[:, 12-1])
+    set_field('data_subcategory', ed4, sec1[:, 13-1])
+    set_field('master_table_version', ed4, sec1[:, 14-1])
+    set_field('local_table_version', ed4, sec1[:, 15-1])
+    set_field('year', ed4, 256*sec1[:, 16-1] + sec1[:, 17-1])
+    for (i, name) in enumerate(['month', 'day', 'hour', 'minute', 'second']):
+        set_field(name, ed4, sec1[:, 18-1+i])
+
+    catalogue['timestamp'] = get_timestamps(catalogue)
+
+    # section 3 holds the number of subsets in bytes 5 and 6, and the
+    # observed and compressed flags in byte 7
+    catalogue['num_subsets'] = 256*sec3[:, 5-1] + sec3[:, 6-1]
+    catalogue['observed'] = (sec3[:, 7-1] & 128) > 0
+    catalogue['compressed'] = (sec3[:, 7-1] & 64) > 0
+
+    # the descriptors start at byte 8 of section 3 and take 2 bytes each
+    # (a possible padding byte at the end of the section is excluded)
+    hashes = {}
+    for (i, (start, size)) in enumerate(zip(start_section3.tolist(),
+                                            size_section3.tolist())):
+        num_descriptors = max(0, (size-7)//2)
+        descriptor_bytes = raw_bytes[start+7:
+                                     start+7+2*num_descriptors].tobytes()
+        if descriptor_bytes not in hashes:
+            hashes[descriptor_bytes] = get_template_hash(descriptor_bytes)
+        catalogue['template_hash'][i] = hashes[descriptor_bytes]
+
+    return catalogue
+    #  #]
+
+def get_header_catalogue(input_bufr_file, use_mmap=True):
+    #  #[
+    """
+    create the header catalogue for all BUFR messages
+    in the given BUFR file
+    """
+    # imported here, since raw_bufr_file uses this module
+    from .raw_bufr_file import RawBUFRFile
+
+    rbf = RawBUFRFile(warn_about_bufr_size=False)
+    rbf.open(input_bufr_file, 'rb', use_mmap=use_mmap)
+    try:
+        catalogue = rbf.get_header_catalogue()
+    finally:
+        rbf.close()
+    return catalogue
+    #  #]
+
+def get_unexp_descr_list(data, bufr_pointers):
+    #  #[
+    """
+    extract the unexpanded descriptor list of the BUFR message located by
+    the given BUFR pointers from the file data, using the same format as
+    BUFRMessage_R.get_unexp_descr_list (a list of 6 character strings)
+    """
+    (start, end, section_sizes, section_start_locations) = bufr_pointers
+    start_section3 = start + section_start_locations[3]
+    num_descriptors = max(0, (section_sizes[3]-7)//2)
+    descr_bytes = get_bytes(data)[start_section3+7:
+                                  start_section3+7+2*num_descriptors]
+    descr_bytes = descr_bytes.reshape((-1, 2)).astype(int)
+    f = (descr_bytes[:, 0] & (128+64))//64
+    x = descr_bytes[:, 0] & (64-1)
+    y = descr_bytes[:, 1]
+    return ['%6.6i' % descr for descr in (100000*f+1000*x+y).tolist()]
+    #  #]
+
+def get_header(catalogue_row, unexp_descr_list):
+    #  #[
+    """
+    combine a row of the header catalogue and the unexpanded descriptor
+    list of a message into a dict, that is passed to header filters
+    """
+    header = dict((name, catalogue_row[name])
+                  for name in HEADER_CATALOGUE_DTYPE.names)
+    header[UNEXP_DESCR_LIST] = unexp_descr_list
+    return header
+    #  #]
+
+def make_header_filter(where):
+    #  #[
+    """
+    convert a filter definition into a function that takes a header
+    (see get_header) and returns True if the message should be decoded.
+    The filter definition may be:
+    -a function taking the header dict, and returning True or False
+    -a dict mapping header item names to conditions. A message matches
+     if all conditions hold. A condition may be a function that takes the
+     value of the item, a list, tuple or set of allowed values, or a single
+     allowed value. For the unexp_descr_list item the condition may also
+     be a list of descriptors, which must equal the descriptor list.
+    For example:
+    where={'data_category':0, 'centre':[98, 99],
+           'timestamp':lambda t: t >= np.datetime64('2016-12-13T06:00')}
+    """
+    if callable(where):
+        return where
+
+    if not isinstance(where, dict):
+        errtxt = ('Sorry, a header filter should be a function or a dict, '+
+                  'not: '+repr(where))
+        raise IncorrectUsageError(errtxt)
+
+    conditions = []
+    for (name, condition) in where.items():
+        if name == UNEXP_DESCR_LIST:
+            if not callable(condition):
+                descr_list = ['%6.6i' % int(descr) for descr in condition]
+                condition = (lambda value, descr_list=descr_list:
+                             value == descr_list)
+        elif name in HEADER_CATALOGUE_DTYPE.names:
+            if isinstance(condition, (list, tuple, set, frozenset)):
+                allowed = list(condition)
+                condition = (lambda value, allowed=allowed:
+                             value in allowed)
+            elif not callable(condition):
+                condition = (lambda value, allowed=condition:
+                             value == allowed)
+        else:
+            errtxt = ('Sorry, header item '+repr(name)+' is not available '+
+                      'for filtering. Available are: '+
+                      ', '.join(HEADER_CATALOGUE_DTYPE.names+
+                                (UNEXP_DESCR_LIST,)))
+            raise IncorrectUsageError(errtxt)
+        conditions.append((name, condition))
+
+    def header_filter(header):
+        """ test all conditions """
+        for (name, condition) in conditions:
+            if not condition(header[name]):
+                return False
+        return True
+
+    return header_filter
+    #  #]
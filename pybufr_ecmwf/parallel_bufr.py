@@ -0,0 +1,588 @@
+#!/usr/bin/env python
+
+"""
+This file defines the ParallelBUFRReader class, that decodes
+the BUFR messages in a file using a pool of worker processes.
+"""
+
+#  #[ documentation
+#
+# The ECMWF BUFR library uses global variables, so decoding messages in
+# parallel is only possible using separate processes, not threads.
+# Each worker process opens the BUFR file itself and decodes the
+# messages that are located by the parent process, using its own
+# BUFRReader instance (so it keeps its own table setup) and its own
+# private directory for temporary files and links to the BUFR tables.
+#
+# If available, the decoded data is returned through shared memory
+# segments (see shared_memory_transport.py), in which case the data arrays
+# of a message are views on such a segment, that is recycled as soon as
+# the iteration proceeds to the next message.
+#
+# Note about the use of the "#  #[" and "#  #]" comments:
+#   these are folding marks for my favorite editor, emacs, combined with its
+#   folding mode
+#   (see http://www.emacswiki.org/emacs/FoldingMode for more details)
+# Please do not remove them.
+#
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+#
+#  #]
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function) #, unicode_literals)
+
+import os               # operating system functions
+import sys              # python version
+import shutil           # removing directory trees
+import tempfile         # handling temporary files
+import traceback        # formatting exceptions in the worker processes
+import multiprocessing  # process pools
+try:
+    import queue        # python3
+except ImportError:
+    import Queue as queue # python2
+
+from .raw_bufr_file import RawBUFRFile, is_data_source
+from .header_catalogue import make_header_filter
+from .bufr_interface_ecmwf import BUFRInterfaceECMWF
+from .bufr import BUFRReaderBUFRDC
+from .custom_exceptions import EcmwfBufrLibError, IncorrectUsageError
+from .shared_memory_transport import (SharedMemoryTransport,
+                                      SharedMemoryAttachments,
+                                      shared_memory_available,
+                                      pack_blocks)
+#  #]
+
+# the BUFRReader and shared memory segments used by
+# each worker process (see init_worker)
+WORKER_STATE = {}
+
+# the time in seconds to wait for a result, before checking
+# whether all worker processes are still alive
+WORKER_POLL_INTERVAL = 1.0
+
+class DecodedBUFRMessage:
+    #  #[
+    """
+    a class to hold the decoded data of a BUFR message, as returned
+    by the worker processes of ParallelBUFRReader. Iteration over it
+    yields itself with the data, names and units attributes filled,
+    just like iteration over BUFRMessage_R does.
+    If the data was passed through shared memory, the arrays are views
+    on a shared memory segment that is recycled once the message is
+    released. Use detach() to keep the data of a message after that.
+    """
+    def __init__(self, msg_index, num_subsets, unexp_descr_list, blocks):
+        #  #[
+        self.msg_index = msg_index
+        self.num_subsets = num_subsets
+        self.unexp_descr_list = unexp_descr_list
+
+        # list of (subset, data, names, units) tuples, with subset None
+        # if data holds all subsets as a 2D array
+        self.blocks = blocks
+
+        self.current_subset = None
+        self.data = None
+        self.names = None
+        self.units = None
+
+        # shared memory administration
+        self.segment_name = None
+        self.layout = None
+        self.needed_size = 0
+        self.transport = None
+        #  #]
+    def release(self):
+        #  #[
+        """
+        give the shared memory segment holding the data of this message
+        back to the reader, so it can be reused for a next message.
+        After this the data of this message is no longer available.
+        """
+        if self.transport is not None:
+            self.transport.release(self.segment_name)
+            self.transport = None
+            self.blocks = None
+            self.data = None
+            self.names = None
+            self.units = None
+        #  #]
+    def detach(self):
+        #  #[
+        """
+        copy the data of this message out of the shared memory segment,
+        and release the segment, so the data remains available
+        """
+        if self.transport is not None:
+            self.blocks = [(subset, data.copy(), names.copy(), units.copy())
+                           for (subset, data, names, units) in self.blocks]
+            self.transport.release(self.segment_name)
+            self.transport = None
+        self.data = None
+        self.names = None
+        self.units = None
+        #  #]
+    def get_num_subsets(self):
+        #  #[
+        """
+        request the number of subsets in this BUFR message
+        """
+        return self.num_subsets
+        #  #]
+    def get_unexp_descr_list(self):
+        #  #[
+        """
+        request the unexpanded descriptor list of this BUFR message
+        """
+        return self.unexp_descr_list
+        #  #]
+    def data_iterator(self):
+        #  #[ define iteration for reading
+        """
+        Iterate over the data of this BUFR message, in the same way
+        as done by BUFRMessage_R.data_iterator
+        """
+        if self.blocks is None:
+            errtxt = ('Sorry, the data of BUFR message '+str(self.msg_index)+
+                      ' has been released')
+            raise EcmwfBufrLibError(errtxt)
+        for (subset, data, names, units) in self.blocks:
+            self.current_subset = subset
+            self.data = data
+            self.names = names
+            self.units = units
+            yield self
+        #  #]
+    def __iter__(self):
+        #  #[ return the iterator
+        '''returns the above defined iterator'''
+        return self.data_iterator()
+        #  #]
+    #  #]
+
+def init_worker(worker_pids, input_bufr_file, temp_dir, reader_settings):
+    #  #[
+    """
+    initialise a worker process: report its process id to the parent
+    process, create its private directory for temporary files and
+    open the BUFR file with its own BUFRReader
+    """
+    # this is done first, so the parent process also notices
+    # worker processes that fail during their initialisation
+    worker_pids.put(os.getpid())
+
+    worker_temp_dir = os.path.join(temp_dir, 'worker_'+str(os.getpid()))
+    os.mkdir(worker_temp_dir)
+    BUFRInterfaceECMWF.private_temp_dir = worker_temp_dir
+
+    (warn_about_bufr_size, expand_flags, expand_strings, verbose,
+     tables_settings, decoding_parameters, max_attachments) = reader_settings
+
+    # open the file without locating the messages, this is
+    # done by the parent process. The decoding arrays can be reused,
+    # since the data of each message is packed before the next one
+    # is decoded
+    reader = BUFRReaderBUFRDC(input_bufr_file,
+                              warn_about_bufr_size=warn_about_bufr_size,
+                              expand_flags=expand_flags,
+                              expand_strings=expand_strings,
+                              verbose=verbose, use_mmap=True,
+                              reuse_buffers=True)
+    reader.setup_tables(*tables_settings)
+    reader.tune_decoding_parameters(*decoding_parameters)
+    WORKER_STATE['reader'] = reader
+    if max_attachments > 0:
+        WORKER_STATE['segments'] = SharedMemoryAttachments(max_attachments)
+    #  #]
+
+def decode_msg_in_worker(seq_nr, msg_index, bufr_pointers,
+                         segment_name=None):
+    #  #[
+    """
+    decode a single BUFR message in a worker process.
+    If a segment_name is given the data is stored in that shared memory
+    segment, in stead of returning it.
+    Returns a tuple (seq_nr, DecodedBUFRMessage, error_text)
+    """
+    reader = WORKER_STATE['reader']
+    try:
+        (raw_msg, section_sizes, section_start_locations) = \
+                  reader._rbf.extract_raw_bufr_msg(bufr_pointers)
+        reader.decode_msg(raw_msg, section_sizes, section_start_locations,
+                          msg_index)
+        msg = reader.msg
+        blocks = [(msg_part.current_subset, msg_part.data,
+                   msg_part.names, msg_part.units)
+                  for msg_part in msg.data_iterator()]
+        result = DecodedBUFRMessage(msg_index, msg.get_num_subsets(),
+                                    msg.get_unexp_descr_list(), blocks)
+        if segment_name is not None:
+            buf = WORKER_STATE['segments'].get_buffer(segment_name)
+            (layout, needed_size) = pack_blocks(buf, blocks)
+            result.segment_name = segment_name
+            result.needed_size = needed_size
+            if layout is not None:
+                # the data will be taken from the segment
+                result.layout = layout
+                result.blocks = None
+        return (seq_nr, result, None)
+    except (Exception, SystemExit):
+        errtxt = ('decoding BUFR message '+str(msg_index)+
+                  ' failed in worker process '+str(os.getpid())+':\n'+
+                  traceback.format_exc())
+        return (seq_nr, None, errtxt)
+    #  #]
+
+def make_error_callback(results, seq_nr):
+    #  #[
+    """
+    return a function that puts an error result for the given
+    sequence number in the results queue, for errors that are raised
+    by the pool itself (like failing to pickle the task or its result)
+    """
+    def error_callback(exc):
+        errtxt = ('decoding task '+str(seq_nr)+
+                  ' failed in the process pool: '+repr(exc))
+        results.put((seq_nr, None, errtxt))
+    return error_callback
+    #  #]
+
+class ParallelBUFRReader:
+    #  #[ parallel reader class
+    """
+    a class that reads and decodes the BUFR messages in a file using
+    a pool of worker processes. It can be used like BUFRReader, but
+    the messages it yields are DecodedBUFRMessage instances. These
+    hold the data, names and units of each message, so reading the
+    data is possible, but calling the decoding methods is not.
+    Messages are yielded in file order, unless ordered=False is given,
+    in which case they are yielded as soon as they are decoded.
+    At most max_in_flight messages are being decoded or waiting to
+    be yielded at any moment.
+    By default the decoded data is passed through shared memory if
+    this is available (python 3.8 and newer). In that case the data of
+    each message is released when the iteration proceeds to the next
+    message, unless the detach() method of the message is used.
+    """
+    def __init__(self, input_bufr_file, num_workers=None, ordered=True,
+                 max_in_flight=None, warn_about_bufr_size=True,
+                 expand_flags=False, expand_strings=False, verbose=False,
+                 use_shared_memory=None, use_index=False, where=None):
+        #  #[
+        if is_data_source(input_bufr_file):
+            # the worker processes open the file themselves
+            errtxt = ('Sorry, the ParallelBUFRReader needs the name of '+
+                      'a BUFR file, use BUFRReader to decode BUFR data '+
+                      'from memory or from a file object.')
+            raise IncorrectUsageError(errtxt)
+
+        self.input_bufr_file = input_bufr_file
+        self.warn_about_bufr_size = warn_about_bufr_size
+        self.expand_flags = expand_flags
+        self.expand_strings = expand_strings
+        self.verbose = verbose
+
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.num_workers = num_workers
+        self.ordered = ordered
+        if max_in_flight is None:
+            max_in_flight = 4*num_workers
+        self.max_in_flight = max_in_flight
+        if use_shared_memory is None:
+            use_shared_memory = shared_memory_available()
+        self.use_shared_memory = use_shared_memory
+
+        # the messages are located by the parent process (possibly using
+        # a sidecar index file), and decoded by the worker processes
+        self._rbf = RawBUFRFile(warn_about_bufr_size=warn_about_bufr_size)
+        self._rbf.open(input_bufr_file, 'rb', use_mmap=True,
+                       use_index=use_index)
+
+        # the pool and temporary directory are created when iteration
+        # starts, so the tables and decoding parameters can still be set
+        self._pool = None
+        self._worker_pids = None
+        self._worker_pids_queue = None
+        self._temp_dir = None
+        self._transport = None
+
+        # allow manual choice of tables
+        self.tables_settings = (None, None, None, None)
+
+        # Set default for tuning parameters for decoding
+        self.decoding_parameters = (None, None, None)
+
+        # an optional filter on the message headers, that is applied
+        # by the parent process before sending messages to the workers
+        self._header_filter = None
+        if where is not None:
+            self.filter(where)
+
+        self.msg_index = -1
+        self.msg = None
+        #  #]
+    def filter(self, where):
+        #  #[
+        """
+        only decode the messages with headers that match the given filter
+        (see BUFRReaderBUFRDC.filter). Should be called before iterating
+        over the messages. Returns the reader itself.
+        """
+        if where is None:
+            self._header_filter = None
+        else:
+            self._header_filter = make_header_filter(where)
+        return self
+        #  #]
+    def setup_tables(self, table_b_to_use=None, table_c_to_use=None,
+                     table_d_to_use=None, tables_dir=None):
+        #  #[
+        """
+        allow manual choice of bufr tables
+        (should be called before iterating over the messages)
+        """
+        self.tables_settings = (table_b_to_use, table_c_to_use,
+                                table_d_to_use, tables_dir)
+        #  #]
+    def tune_decoding_parameters(self,
+                                 nr_of_descriptors_startval=None,
+                                 nr_of_descriptors_maxval=None,
+                                 nr_of_descriptors_multiplier=None):
+        #  #[
+        """
+        set the parameters used for array allocation when decoding
+        (see BUFRReader.tune_decoding_parameters)
+        """
+        self.decoding_parameters = (nr_of_descriptors_startval,
+                                    nr_of_descriptors_maxval,
+                                    nr_of_descriptors_multiplier)
+        #  #]
+    def start_workers(self):
+        #  #[
+        """
+        create the temporary directory and start the worker processes
+        """
+        self._temp_dir = tempfile.mkdtemp(prefix='pybufr_ecmwf_parallel_')
+        max_attachments = 0
+        if self.use_shared_memory:
+            self._transport = SharedMemoryTransport()
+            # the number of segments in use is at most max_in_flight
+            # plus the one of the message that was yielded last
+            max_attachments = self.max_in_flight+2
+        reader_settings = (self.warn_about_bufr_size, self.expand_flags,
+                           self.expand_strings, self.verbose,
+                           self.tables_settings, self.decoding_parameters,
+                           max_attachments)
+        # each worker process reports its process id through this queue
+        # when it starts (see check_workers)
+        self._worker_pids_queue = multiprocessing.Queue()
+        self._worker_pids = set()
+        self._pool = multiprocessing.Pool(self.num_workers,
+                                          init_worker,
+                                          (self._worker_pids_queue,
+                                           self.input_bufr_file,
+                                           self._temp_dir, reader_settings))
+        #  #]
+    def check_workers(self):
+        #  #[
+        """
+        collect the process ids reported by the worker processes, and
+        raise an exception if a worker process was replaced. The pool
+        silently replaces worker processes that exit, and the
+        replacement reports its process id as well, so more process ids
+        than workers means that a worker process died.
+        """
+        while True:
+            try:
+                self._worker_pids.add(self._worker_pids_queue.get_nowait())
+            except queue.Empty:
+                break
+        if len(self._worker_pids) > self.num_workers:
+            errtxt = ('a worker process of the ParallelBUFRReader '+
+                      'exited unexpectedly (see the output of the '+
+                      'worker processes for the cause)')
+            raise EcmwfBufrLibError(errtxt)
+        #  #]
+    def get_result(self, results):
+        #  #[
+        """
+        wait for the next result of the workers, while checking that
+        no worker process died (for example because init_worker failed,
+        or because it was killed), since the message it was decoding
+        would then never be returned
+        """
+        while True:
+            try:
+                return results.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            self.check_workers()
+        #  #]
+    def stop_workers(self, wait=True):
+        #  #[
+        """
+        stop the worker processes, and remove the temporary directory
+        and the shared memory segments.
+        If wait is False, messages that are still being decoded are lost.
+        """
+        if self._pool is not None:
+            if wait:
+                self._pool.close()
+            else:
+                self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._worker_pids = None
+            self._worker_pids_queue.close()
+            self._worker_pids_queue = None
+        if self._transport is not None:
+            if self.msg is not None:
+                self.msg.release()
+            self._transport.close()
+            self._transport = None
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+        #  #]
+    def locate_messages(self):
+        #  #[
+        """
+        iterate over (msg_index, bufr_pointers) for all messages in the
+        file that match the header filter, while locating them one by one
+        """
+        msg_index = 0
+        while True:
+            msg_index += 1
+            if ( (msg_index > self._rbf.nr_of_bufr_messages) and
+                 (not self._rbf.index_next_msg()) ):
+                return
+            if ( (self._header_filter is not None) and
+                 (not self._header_filter(
+                     self._rbf.get_msg_header(msg_index))) ):
+                continue
+            yield (msg_index, self._rbf.list_of_bufr_pointers[msg_index-1])
+        #  #]
+    def messages(self):
+        #  #[ iterate over messages for reading
+        """
+        Iterate over the decoded BUFR messages.
+
+        Yields
+        ------
+        msg:
+            A DecodedBUFRMessage instance that gives access
+            to the data, names and units of each BUFR message
+        """
+        if self._pool is not None:
+            raise EcmwfBufrLibError('iteration over this ParallelBUFRReader '+
+                                    'is already in progress')
+        self.start_workers()
+
+        # the results are put in this queue by the pool
+        results = queue.Queue()
+        finished_results = {}
+        segments_in_flight = {}
+        num_submitted = 0
+        num_yielded = 0
+        all_submitted = False
+        located_messages = self.locate_messages()
+        try:
+            while True:
+                # keep the workers busy, but limit the amount of
+                # messages in flight
+                while ( (not all_submitted) and
+                        (num_submitted-num_yielded < self.max_in_flight) ):
+                    try:
+                        (msg_index, bufr_pointers) = next(located_messages)
+                    except StopIteration:
+                        all_submitted = True
+                        break
+                    segment_name = None
+                    if self._transport is not None:
+                        segment_name = self._transport.acquire()[0]
+                        segments_in_flight[num_submitted] = segment_name
+                    callbacks = {'callback':results.put}
+                    if sys.version_info[0] > 2:
+                        callbacks['error_callback'] = \
+                            make_error_callback(results, num_submitted)
+                    self._pool.apply_async(decode_msg_in_worker,
+                                           (num_submitted, msg_index,
+                                            bufr_pointers, segment_name),
+                                           **callbacks)
+                    num_submitted += 1
+
+                if all_submitted and (num_yielded == num_submitted):
+                    break
+
+                if self.ordered:
+                    while num_yielded not in finished_results:
+                        (seq_nr, msg, errtxt) = self.get_result(results)
+                        finished_results[seq_nr] = (msg, errtxt)
+                    seq_nr = num_yielded
+                    (msg, errtxt) = finished_results.pop(seq_nr)
+                else:
+                    (seq_nr, msg, errtxt) = self.get_result(results)
+                num_yielded += 1
+
+                # the previous message can no longer be used
+                if self.msg is not None:
+                    self.msg.release()
+
+                if self._transport is not None:
+                    segment_name = segments_in_flight.pop(seq_nr)
+                    if errtxt is None:
+                        self.attach_segment(msg)
+                    else:
+                        self._transport.release(segment_name)
+
+                if errtxt is not None:
+                    raise EcmwfBufrLibError(errtxt)
+
+                self.msg = msg
+                self.msg_index = msg.msg_index
+                yield msg
+
+            self.stop_workers()
+        finally:
+            # in case iteration was stopped early
+            self.stop_workers(wait=False)
+        #  #]
+    def attach_segment(self, msg):
+        #  #[
+        """
+        take the data of a decoded message from its shared memory
+        segment, or release the segment if the data did not fit
+        """
+        if msg.layout is not None:
+            msg.blocks = self._transport.unpack(msg.segment_name, msg.layout)
+            msg.transport = self._transport
+        else:
+            self._transport.report_needed_size(msg.needed_size)
+            self._transport.release(msg.segment_name)
+        #  #]
+    def __iter__(self):
+        #  #[ return the above iterator
+        return self.messages()
+        #  #]
+    def __enter__(self):
+        #  #[ enters the 'with' context
+        return self
+        #  #]
+    def __exit__(self, exc, val, trace):
+        #  #[ exits the 'with' context
+        self.close()
+        #  #]
+    def close(self):
+        #  #[ close the file
+        """
+        stop the worker processes and close the file
+        """
+        self.stop_workers(wait=False)
+        self._rbf.close()
+        #  #]
+    #  #]
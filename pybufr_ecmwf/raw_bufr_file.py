@@ -30,11 +30,86 @@ from __future__ import (absolute_import, division,
                         print_function) #, unicode_literals)
 
 import os          # operating system functions
+import mmap        # allow memory mapping of large files
 import numpy as np # import numerical capabilities
 import struct      # allow converting c datatypes and structs
-from .helpers import python3
+
+from .header_catalogue import (build_header_catalogue, get_header,
+                               get_unexp_descr_list)
+from .sidecar_index import load_index, save_index
+#  #]
+#  #[ some constants
+# the block size used when searching in memoryviews
+# (these have no find method, so each block is copied before searching it)
+SEARCH_BLOCK_SIZE = 1048576
 #  #]
 
+def is_data_source(source):
+    #  #[
+    """
+    check whether the given source is a buffer or a file object holding
+    BUFR data (see RawBUFRFile.open_data), in stead of a filename
+    """
+    if isinstance(source, str):
+        # note: for python2 this also catches the bytes type
+        return False
+    return (isinstance(source, (bytes, bytearray, memoryview, np.ndarray)) or
+            hasattr(source, 'read'))
+    #  #]
+
+def get_buffer(source):
+    #  #[
+    """
+    return a byte oriented view on the given buffer holding BUFR data,
+    that can be used as file data by RawBUFRFile. The data is only copied
+    if it is not contiguous in memory.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return source
+    if isinstance(source, np.ndarray):
+        source = np.ascontiguousarray(source)
+    view = memoryview(source)
+    try:
+        return view.cast('B')
+    except (AttributeError, TypeError):
+        # a non contiguous memoryview, or python 2 which does not
+        # provide the cast method
+        return view.tobytes()
+    #  #]
+
+def find_bytes(data, txt, start):
+    #  #[
+    """
+    return the lowest location of txt in data after the start location,
+    or -1 if it is not present (like bytes.find, but for all types of
+    file data used by RawBUFRFile)
+    """
+    if hasattr(data, 'find'):
+        return data.find(txt, start)
+
+    # search a block at a time, with an overlap between the blocks
+    # to also find a txt that crosses a block boundary
+    block_start = start
+    while block_start < len(data):
+        block = data[block_start:block_start+SEARCH_BLOCK_SIZE].tobytes()
+        location = block.find(txt)
+        if location != -1:
+            return block_start + location
+        block_start = block_start + SEARCH_BLOCK_SIZE - len(txt) + 1
+    return -1
+    #  #]
+
+def get_byte(data, location):
+    #  #[
+    """
+    return the value of a single byte from the file data
+    (indexing returns a string for python2 and an integer for python3
+    so take a slice and convert that)
+    """
+    return bytearray(data[location:location+1])[0]
+    #  #]
+
+
 class RawBUFRFile:
     #  #[
     """
@@ -47,6 +122,8 @@ class RawBUFRFile:
                  warn_about_bufr_size = True):
         #  #[
         self.bufr_fd  = None
+        # file objects passed in by the user are not closed
+        self.close_bufr_fd = True
         self.filename = None
         self.filemode = None
         self.filesize = None
@@ -56,6 +133,18 @@ class RawBUFRFile:
         self.last_used_msg = 0
         self.verbose = verbose
         self.warn_about_bufr_size = warn_about_bufr_size
+        # settings used by the lazy (memory mapped) reading mode
+        self.use_mmap = False
+        self.index_complete = True
+        self.scan_pos = 0
+        self.released_pos = 0
+        # settings used for the sidecar index file
+        self.use_index = False
+        self.header_catalogue = None
+        # settings used by the buffered writing mode
+        self.flush_size = 0
+        self.write_buffer = []
+        self.write_buffer_nbytes = 0
         #  #]
     def print_properties(self, prefix = "BUFRFile"):
         #  #[
@@ -78,10 +167,24 @@ class RawBUFRFile:
         print(prefix+": nr_of_bufr_messages = "+
               str(self.nr_of_bufr_messages))
         #  #]
-    def open(self, filename, mode, silent = False):
+    def open(self, filename, mode, silent = False, use_mmap = False,
+             flush_size = 0, use_index = False):
         #  #[
         """
-        open a BUFR file to allow reading or writing raw BUFR messages
+        open a BUFR file to allow reading or writing raw BUFR messages.
+        If use_mmap is True (only allowed for mode 'rb') the file is
+        memory mapped in stead of read into memory, and the BUFR messages
+        are located one by one, only when they are requested.
+        If use_index is True (only used for mode 'rb') the locations and
+        headers of the BUFR messages are stored in a sidecar index file
+        once the whole file has been scanned, and taken from this index
+        when the file is opened again (see sidecar_index.py).
+        If flush_size is larger than 0 (only used for modes 'wb' and 'ab')
+        the written BUFR messages are collected in memory, and only
+        written to file once they occupy at least flush_size bytes.
+        For mode 'rb' the filename may also be the BUFR data itself, or
+        a binary file object (see open_data below, use_index is ignored
+        in this case).
         """
         # note: the silent switch is only intended to suppress
         # warning and error messages during unit testing.
@@ -92,6 +195,16 @@ class RawBUFRFile:
         
         # filename should include the path specification as well
         assert(mode in ['rb', 'wb', 'ab'])
+        if (mode == 'rb') and is_data_source(filename):
+            # the BUFR data itself or a file object was passed in
+            self.open_data(filename, silent=silent, use_mmap=use_mmap)
+            return
+        if use_mmap:
+            assert(mode == 'rb')
+        if (mode != 'rb'):
+            self.flush_size = flush_size
+        else:
+            self.use_index = use_index
 
         if (mode == 'rb'):
             if (os.path.exists(filename)):
@@ -142,7 +255,15 @@ class RawBUFRFile:
 
         if (mode == 'rb'):
             try:
-                self.data = self.bufr_fd.read()
+                if (use_mmap or use_index) and (self.filesize > 0):
+                    # note: mmap refuses to map an empty file,
+                    # so that case is handled by the normal read below
+                    # (if an index is used the file is always mapped,
+                    #  so only the requested messages are read)
+                    self.data = mmap.mmap(self.bufr_fd.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                else:
+                    self.data = self.bufr_fd.read()
             except:
                 if (not silent):
                     print("ERROR in BUFRFile.open():")
@@ -150,17 +271,96 @@ class RawBUFRFile:
                           " with mode: ", self.filemode, " failed")
                 raise IOError
 
+            if use_index and self.load_index():
+                if not (use_mmap or self.index_complete):
+                    # the file was appended to, so locate the new messages
+                    self.index_all_msgs()
+                self.use_mmap = use_mmap
+            elif use_mmap:
+                # only locate the BUFR messages when they are requested
+                # (see index_next_msg() below), so decoding can start
+                # before the whole file has been scanned
+                self.use_mmap = True
+                self.index_complete = False
+                self.scan_pos = 0
+                self.released_pos = 0
+                if hasattr(self.data, 'madvise'):
+                    # python 3.8+ only
+                    self.data.madvise(mmap.MADV_SEQUENTIAL)
+            else:
+                # split in separate BUFR messages
+                self.split()
+
+        #  #]
+    def open_data(self, source, silent = False, use_mmap = False):
+        #  #[
+        """
+        open BUFR data that is already in memory (as bytes, bytearray,
+        memoryview or numpy array) or that can be read from a binary file
+        object, to allow reading raw BUFR messages from it. File objects
+        don't need to be seekable, so pipes and sockets can be used too.
+        Nothing is written to disk, and buffers are used without copying
+        them. If use_mmap is True the BUFR messages are located one by one
+        when they are requested, and a file object that refers to a
+        regular file is memory mapped in stead of read.
+        """
+        self.filename = str(getattr(source, 'name', '<in memory BUFR data>'))
+        self.filemode = 'rb'
+        # keep a reference to the source, but leave closing it to the caller
+        self.bufr_fd = source
+        self.close_bufr_fd = False
+
+        if hasattr(source, 'read'):
+            self.data = None
+            if use_mmap:
+                try:
+                    # only map the file if it is read from its start
+                    if source.tell() == 0:
+                        self.data = mmap.mmap(source.fileno(), 0,
+                                              access=mmap.ACCESS_READ)
+                except (AttributeError, IOError, OSError, ValueError):
+                    # not a regular file (or an empty one), so read it
+                    pass
+            if self.data is None:
+                try:
+                    self.data = source.read()
+                except:
+                    if (not silent):
+                        print("ERROR in BUFRFile.open_data():")
+                        print("Reading data from: ", self.filename, " failed")
+                    raise IOError
+        else:
+            self.data = get_buffer(source)
+        self.filesize = len(self.data)
+
+        if use_mmap:
+            # only locate the BUFR messages when they are requested
+            self.use_mmap = True
+            self.index_complete = False
+            self.scan_pos = 0
+            self.released_pos = 0
+        else:
             # split in separate BUFR messages
             self.split()
-
         #  #]
     def close(self):
         #  #[
         """
         close a BUFR file
         """
-        # close the file
-        self.bufr_fd.close()
+        # write any buffered BUFR messages, then close the file
+        if self.write_buffer:
+            self.flush()
+        if self.close_bufr_fd:
+            self.bufr_fd.close()
+        if isinstance(self.data, mmap.mmap):
+            try:
+                self.data.close()
+            except BufferError:
+                # word arrays returned by get_raw_bufr_msg() still
+                # point into the mapped file, so leave it to the garbage
+                # collector to unmap the file once they are released
+                pass
         # then erase all settings
         self.__init__()
         #  #]
@@ -211,8 +411,7 @@ class RawBUFRFile:
             print('getting size of BUFR message at start location: ',
                   start_location)
         try:
-            raw_edition_number = self.data[start_location+8-1:start_location+8]
-            edition_number = ord(raw_edition_number)
+            edition_number = get_byte(self.data, start_location+8-1)
             if (self.verbose):
                 print('edition_number = ', edition_number)
         except IndexError:
@@ -307,8 +506,7 @@ class RawBUFRFile:
                 byte_to_use = 10
 
             sec2_presence_flag = \
-                 ord(self.data[start_location+offset+byte_to_use-1:
-                               start_location+offset+byte_to_use])
+                 get_byte(self.data, start_location+offset+byte_to_use-1)
                                
             section2_present = False
 
@@ -459,92 +657,211 @@ class RawBUFRFile:
         # counts the nr of BUFR messages, and stores file
         # pointers to the start of each BUFR message.
 
+        self.list_of_bufr_pointers = []
+        self.nr_of_bufr_messages = 0
+        self.header_catalogue = None
+
         # safety catch
         if (self.filesize == 0):
-            self.nr_of_bufr_messages = 0
+            self.index_complete = True
             return
 
-        # note: this very simpple search algorithm might accidently
-        # find the string "7777" in the middle of the data of a BUFR message.
-        # To check on this, make sure the distance between the end of a
-        # message and the start of a message if either 0 or 2 bytes
-        # (this may happen if the file is padded with zeros to contain
-        #  a multiple of 4 bytes)
-        # Do the same check on the end of the file.
-
-        txt_start  = b'BUFR'
-        txt_end    = b'7777'
-        list_of_start_locations = []
-        list_of_end_locations   = []
-
-        # try to find the start strings
-        search_pos = 0
-        file_end_reached = False
-        while not file_end_reached:
-            start_pos = self.data.find(txt_start, search_pos)
-            if (start_pos == -1):
-                file_end_reached = True
-            else:
-                list_of_start_locations.append(start_pos)
-                search_pos = start_pos + 4
-
-        # try to find the end strings
-        search_pos = 0
-        file_end_reached = False
-        while not file_end_reached:
-            end_pos = self.data.find(txt_end, search_pos)
-            if (end_pos == -1):
-                file_end_reached = True
-            else:
-                list_of_end_locations.append(end_pos)
-                search_pos = end_pos + 4
+        # note: the string "7777" may accidently occur in the middle
+        # of the data of a BUFR message, and the string "BUFR" may occur
+        # inside junk between the messages. Therefore each candidate
+        # start location is checked by extracting the message size
+        # from its header, and testing for the end marker at exactly
+        # that location (see index_next_msg() below).
+        # A valid message is skipped as a whole, so only a single
+        # pass over the data is needed.
+        self.scan_pos = 0
+        self.index_complete = False
+        self.index_all_msgs()
 
-        self.list_of_bufr_pointers = []
+        if (self.verbose):
+            print("list_of_bufr_pointers = ", self.list_of_bufr_pointers)
+
+        #  #]
+    def index_next_msg(self):
+        #  #[
+        """
+        locate the next valid BUFR message after the current scan position
+        and add it to the list of BUFR pointers. Returns True if a message
+        was found, and False if the end of the file was reached.
+        """
+        txt_start = b'BUFR'
+        txt_end   = b'7777'
+        while not self.index_complete:
+            start_location = find_bytes(self.data, txt_start, self.scan_pos)
+            if (start_location == -1):
+                self.index_complete = True
+                self.scan_pos = len(self.data)
+                if self.use_index:
+                    self.save_index()
+                break
 
-        # try each BUFR message; extract its length and see if
-        # it matches an end location. If not we found a false start
-        # marker or a corrupt BUFR message. If it matches, assume
-        # the BUFR message is valid and add it to the list
-        for start_location in list_of_start_locations:
             expected_msg_size, section_sizes, section_start_locations = \
                                self.get_expected_msg_size(start_location)
             if (self.verbose):
                 print('expected_msg_size = ', expected_msg_size)
-            expected_msg_end_location = start_location + expected_msg_size - 4
-            if expected_msg_end_location in list_of_end_locations:
+
+            # check the end marker directly at the location
+            # where it should be for this message
+            end_location = start_location + expected_msg_size
+            if ( (expected_msg_size > 0) and
+                 (self.data[end_location-4:end_location] == txt_end) ):
                 if (self.verbose):
                     print('message seems alright, adding it to the list')
-                # point to the end of the four sevens
-                # (in slice notation, so the bufr msg data
-                # can be adressed as data[start_pos:end_pos])
-                # and store it
                 self.list_of_bufr_pointers.append((start_location,
-                                                   expected_msg_end_location+4,
+                                                   end_location,
                                                    section_sizes,
                                                    section_start_locations))
-        
+                self.nr_of_bufr_messages = len(self.list_of_bufr_pointers)
+                self.scan_pos = end_location
+                return True
 
-        # count howmany we found
-        self.nr_of_bufr_messages = len(self.list_of_bufr_pointers)
+            # a false start marker or a corrupt BUFR message,
+            # so continue searching after this start marker
+            self.scan_pos = start_location + 4
+
+        return False
+        #  #]
+    def index_all_msgs(self):
+        #  #[
+        """
+        make sure all BUFR messages in the file have been located
+        """
+        while self.index_next_msg():
+            pass
+        #  #]
+    def load_index(self):
+        #  #[
+        """
+        take the locations and headers of the BUFR messages from the
+        sidecar index file, if a valid one is available. Returns False
+        if no valid index was found.
+        """
+        if self.filesize == 0:
+            return False
 
+        loaded = load_index(self.filename, self.data)
+        if loaded is None:
+            return False
+
+        (self.list_of_bufr_pointers, self.header_catalogue,
+         self.index_complete) = loaded
+        self.nr_of_bufr_messages = len(self.list_of_bufr_pointers)
+        if self.index_complete:
+            self.scan_pos = len(self.data)
+        elif self.list_of_bufr_pointers:
+            # continue scanning after the last indexed message
+            self.scan_pos = self.list_of_bufr_pointers[-1][1]
+        else:
+            self.scan_pos = 0
+        self.released_pos = 0
         if (self.verbose):
-            print("list_of_start_locations = ", list_of_start_locations)
-            print("list_of_end_locations   = ", list_of_end_locations)
+            print('loaded index with ', self.nr_of_bufr_messages,
+                  ' BUFR messages')
+        return True
+        #  #]
+    def save_index(self):
+        #  #[
+        """
+        write the locations and headers of all BUFR messages
+        to the sidecar index file
+        """
+        if self.filesize == 0:
+            return
+        save_index(self.filename, self.data, self.list_of_bufr_pointers,
+                   self.update_header_catalogue(), verbose=self.verbose)
+        #  #]
+    def update_header_catalogue(self):
+        #  #[
+        """
+        add the headers of the BUFR messages that were located since
+        the previous call to the header catalogue, and return it
+        """
+        if self.header_catalogue is None:
+            self.header_catalogue = build_header_catalogue(
+                self.data, self.list_of_bufr_pointers)
+        elif len(self.header_catalogue) < self.nr_of_bufr_messages:
+            new_part = build_header_catalogue(
+                self.data,
+                self.list_of_bufr_pointers[len(self.header_catalogue):])
+            self.header_catalogue = np.concatenate([self.header_catalogue,
+                                                    new_part])
+        return self.header_catalogue
+        #  #]
+    def release_pages(self, end_location):
+        #  #[
+        """
+        tell the OS that the memory mapped pages before end_location
+        are no longer needed, which keeps the memory use of this
+        process flat when walking through a large file
+        """
+        if not (self.use_mmap and hasattr(self.data, 'madvise')):
+            return
 
+        # madvise requires a start location at a page boundary
+        start = self.released_pos
+        end = (end_location//mmap.PAGESIZE)*mmap.PAGESIZE
+        if end > start:
+            self.data.madvise(mmap.MADV_DONTNEED, start, end-start)
+            self.released_pos = end
         #  #]
     def get_num_bufr_msgs(self):
         #  #[
         """
         request the number of BUFR messages in the current file
         """
-        if (self.bufr_fd == None):
+        if (self.bufr_fd is None):
             print("ERROR: a bufr file first needs to be opened")
             print("using BUFRFile.open() before you can request the")
             print("number of BUFR messages in a file ..")
             raise IOError
 
+        # in lazy mode this requires a scan over the remainder of the file
+        self.index_all_msgs()
+
         return self.nr_of_bufr_messages
         #  #]
+    def get_header_catalogue(self):
+        #  #[
+        """
+        extract the headers of all BUFR messages in the current file
+        in python, without decoding them with the ECMWF library.
+        Returns a numpy structured array with one row per message
+        (see header_catalogue.py for the available fields)
+        """
+        if (self.bufr_fd is None):
+            print("ERROR: a bufr file first needs to be opened")
+            print("using BUFRFile.open() before you can request the")
+            print("headers of the BUFR messages in a file ..")
+            raise IOError
+
+        # in lazy mode this requires a scan over the remainder of the file
+        self.index_all_msgs()
+
+        return self.update_header_catalogue()
+        #  #]
+    def get_msg_header(self, msg_nr):
+        #  #[
+        """
+        extract the header of an already located BUFR message (start
+        counting at 1) in python, as a dict holding the header catalogue
+        fields and the unexpanded descriptor list
+        """
+        bufr_pointers = self.list_of_bufr_pointers[msg_nr-1]
+        if self.index_complete:
+            catalogue_row = self.update_header_catalogue()[msg_nr-1]
+        else:
+            # while the messages are located one by one, don't add them
+            # to the catalogue, which would require a copy each time
+            catalogue_row = build_header_catalogue(self.data,
+                                                   [bufr_pointers])[0]
+        return get_header(catalogue_row,
+                          get_unexp_descr_list(self.data, bufr_pointers))
+        #  #]
     def get_raw_bufr_msg(self, msg_nr):
         #  #[
         """
@@ -552,11 +869,16 @@ class RawBUFRFile:
         (start counting at 1)
         """
         
-        if (self.bufr_fd == None):
+        if (self.bufr_fd is None):
             print("ERROR: a bufr file first needs to be opened")
             print("using BUFRFile.open() before you can use the raw data ..")
             raise IOError
 
+        # in lazy mode, make sure the requested message has been located
+        while ( (msg_nr > self.nr_of_bufr_messages) and
+                self.index_next_msg() ):
+            pass
+
         # sanity test
         if (msg_nr>self.nr_of_bufr_messages):
             print("WARNING: non-existing BUFR message: ", msg_nr)
@@ -571,15 +893,24 @@ class RawBUFRFile:
             return (None, None, None)
 
         self.last_used_msg = msg_nr
+        return self.extract_raw_bufr_msg(self.list_of_bufr_pointers[msg_nr-1])
+        #  #]
+    def extract_raw_bufr_msg(self, bufr_pointers):
+        #  #[
+        """
+        get the raw data for the BUFR message located by the given
+        entry of list_of_bufr_pointers (this allows extracting a message
+        located by another RawBUFRFile instance on the same file)
+        """
         (start_index, end_index, section_sizes, section_start_locations) = \
-                      self.list_of_bufr_pointers[msg_nr-1]
+                      bufr_pointers
 
         size_bytes = (end_index-start_index)
 
         # +3 because we have to round upwards to make sure all
         # bytes fit into the array of words (otherwise the last
         # few might be truncated from the data, which will crash
-        # the struct.unpack() call below)
+        # the conversion to words below)
         size_words = (size_bytes+3)//4
         padding_bytes = size_words*4-size_bytes
 
@@ -591,39 +922,33 @@ class RawBUFRFile:
             
         # make sure we take the padding bytes along
         end_index = end_index+padding_bytes
-        
-        raw_data_bytes = self.data[start_index:end_index]
-
-        # make sure the raw datastream is padded with zero bytes
-        # to a multiple of 4 bytes. The ECMWF software may crash
-        # if this is not the case ...
-        nbytes = len(raw_data_bytes)
-        nbytes_rounded = 4*(nbytes//4)
-        if nbytes != nbytes_rounded:
-            # print('padding problem found! fixing it ...')
-            # print('nbytes = ',nbytes)
-            # print('nbytes_rounded = ',nbytes_rounded)
-            num_zeros_to_add = nbytes_rounded+4-nbytes
-            # print('num_zeros_to_add = ',num_zeros_to_add)
-            if python3:
-                str_to_add = b''.join(b'\x00' for i in range(num_zeros_to_add))
-            else:
-                str_to_add = ''.join(b'\x00' for i in range(num_zeros_to_add))
-
-            raw_data_bytes = raw_data_bytes + str_to_add
-
-        if (self.verbose):
-            print("len(raw_data_bytes) = ", len(raw_data_bytes))
 
         # assume little endian for now when converting
         # raw bytes/characters to integers and vice-versa
-        dataformat = "<"+str(size_words)+"i"
-        try:
-            words = np.array(struct.unpack(dataformat, raw_data_bytes))
-        except:
-            # 0 signals this is not a valid BUFR msg, might be a false
-            # start BUFR string, or a corrupted or truncated file
-            return (0, section_sizes, section_start_locations)
+        if end_index <= len(self.data):
+            # the usual case: just create a (read-only) view
+            # on the file data, without copying anything
+            # (the decoding routines declare the encoded message as
+            #  intent(in), see build_interface.py, so f2py passes an
+            #  aligned read-only view to the library as it is)
+            words = np.frombuffer(self.data, dtype='<i4',
+                                  count=size_words, offset=start_index)
+            if not words.flags.aligned:
+                # f2py would make an aligned temporary copy for each
+                # library call, so copy the message once here
+                words = words.copy()
+        else:
+            # the last message in the file does not have the padding
+            # bytes available. Make sure the raw datastream is padded
+            # with zero bytes to a multiple of 4 bytes. The ECMWF
+            # software may crash if this is not the case ...
+            raw_data_bytes = self.data[start_index:end_index]
+            words = np.zeros(size_words, dtype='<i4')
+            words.view(np.uint8)[:len(raw_data_bytes)] = \
+                  np.frombuffer(raw_data_bytes, dtype=np.uint8)
+
+        if (self.verbose):
+            print("len(words)*4 = ", len(words)*4)
 
         return (words, section_sizes, section_start_locations)
         #  #]
@@ -635,9 +960,22 @@ class RawBUFRFile:
         to store the index of the last read BUFR message.
         """
         if (self.last_used_msg == self.nr_of_bufr_messages):
-            raise EOFError
-        
-        return self.get_raw_bufr_msg(self.last_used_msg+1)
+            # in lazy mode, try to locate the next message first
+            if not self.index_next_msg():
+                raise EOFError
+
+        result = self.get_raw_bufr_msg(self.last_used_msg+1)
+
+        # in lazy mode the memory used by the preceding part of the file
+        # can be released. Note that word arrays returned for previous
+        # messages may still be views on these pages. This is safe since
+        # the file is mapped read-only: the kernel only drops the pages
+        # from memory, and reads them from the file again if such a view
+        # is used later on.
+        start_location = self.list_of_bufr_pointers[self.last_used_msg-1][0]
+        self.release_pages(start_location)
+
+        return result
         #  #]
     def write_raw_bufr_msg(self, words):
         #  #[
@@ -658,29 +996,37 @@ class RawBUFRFile:
         # Answer: yes this really is needed! If the words are just written
         # as such, python converts them to long integers and writes
         # 8 bytes for each word in stead of 4 !!!!!
-        # activate the next 2 lines to test this:
-        #self.bufr_fd.write(words)
-        #return
         
         # assume little endian for now when converting
         # raw bytes/characters to integers and vice-versa
-        dataformat = "<i"
-        for (i, word) in enumerate(words):
-            data = struct.pack(dataformat, word)
-            self.bufr_fd.write(data)
+        data = np.asarray(words).astype('<i4').tobytes()
 
-            if i == 0:
-                if (self.verbose):
-                    print("word = ", word)
-                    print('data = ', data)
-                    print('data[:4] = ', data[:4])
-                    print('data[:4] = ', ';'.join(str(data[j])
-                                                  for j in range(4)
-                                                  if data[j].isalnum()))
-                # safety check
-                assert(data[:4] == b'BUFR')
+        if (self.verbose):
+            print('data[:4] = ', data[:4])
+        # safety check
+        assert(data[:4] == b'BUFR')
+
+        if (self.flush_size > 0):
+            # collect the messages, and write them in large chunks
+            self.write_buffer.append(data)
+            self.write_buffer_nbytes = self.write_buffer_nbytes + size_bytes
+            if (self.write_buffer_nbytes >= self.flush_size):
+                self.flush()
+        else:
+            self.bufr_fd.write(data)
 
         self.nr_of_bufr_messages = self.nr_of_bufr_messages + 1
         self.filesize = self.filesize + size_bytes
         #  #]
+    def flush(self):
+        #  #[
+        """
+        write all BUFR messages collected in the write buffer to file
+        """
+        if self.write_buffer:
+            self.bufr_fd.write(b''.join(self.write_buffer))
+            self.write_buffer = []
+            self.write_buffer_nbytes = 0
+        self.bufr_fd.flush()
+        #  #]
     #  #]
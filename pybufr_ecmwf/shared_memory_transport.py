@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+"""
+This file defines the SharedMemoryTransport class, that is used by
+ParallelBUFRReader to pass the decoded data from the worker processes
+to the parent process through shared memory segments, in stead of
+pickling the data arrays.
+"""
+
+#  #[ documentation
+#
+# The parent process owns all shared memory segments. For each message
+# that is handed to a worker process a free segment is selected, and its
+# name and size are passed along with the task. The worker process packs
+# the decoded data arrays, names and units into this segment, and only
+# returns a small layout description. The parent process then creates
+# numpy arrays that are views on the segment, so no copy is made.
+#
+# This is not the case for the object arrays holding strings, that are
+# produced by the expand_strings and expand_flags options. Object arrays
+# cannot be stored in shared memory, so these are split in a float array
+# and the strings, and the parent process builds a new object array from
+# these, which is a copy.
+#
+# A segment remains in use until the message that holds it is released,
+# after which it is recycled for a next message. If the data of a message
+# does not fit in the segment, the worker returns the data in the normal
+# (pickled) way, and the parent replaces the segment by a larger one.
+#
+# The multiprocessing.shared_memory module is only available for
+# python 3.8 and newer. For older python versions the data is always
+# returned in the pickled way.
+#
+# Note about the use of the "#  #[" and "#  #]" comments:
+#   these are folding marks for my favorite editor, emacs, combined with its
+#   folding mode
+#   (see http://www.emacswiki.org/emacs/FoldingMode for more details)
+# Please do not remove them.
+#
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+#
+#  #]
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function) #, unicode_literals)
+
+import threading        # serialising the attaching of segments
+import numpy as np      # array handling
+try:
+    from multiprocessing import shared_memory # python 3.8 and newer
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None
+
+from .helpers import python3
+from .custom_exceptions import EcmwfBufrLibError
+#  #]
+#  #[ some constants
+# arrays are placed in a segment at offsets that are a multiple of this
+ALIGNMENT = 16
+
+# initial size of a shared memory segment (bytes), and
+# the factor used to grow it if a message does not fit
+SEGMENT_STARTSIZE = 1024*1024
+SEGMENT_GROWTH_FACTOR = 1.5
+
+# held while attach_segment replaces the registration function
+# of the resource tracker
+ATTACH_LOCK = threading.Lock()
+#  #]
+
+def shared_memory_available():
+    #  #[
+    """
+    check whether shared memory segments can be used
+    """
+    return shared_memory is not None
+    #  #]
+
+def is_text(value):
+    #  #[
+    """
+    check whether a value in a decoded object array is a string
+    """
+    if python3:
+        return isinstance(value, str)
+    return isinstance(value, basestring) # pylint: disable=E0602
+    #  #]
+
+def split_block(block):
+    #  #[
+    """
+    convert a decoded block (subset, data, names, units) into a list of
+    plain numpy arrays that can be stored in a shared memory segment.
+    Object arrays holding strings (see the expand_strings and expand_flags
+    options) are split in a float array, the positions of the strings,
+    and the strings themselves.
+    Returns (subset, kind, arrays), or None if the data cannot be split.
+    """
+    (subset, data, names, units) = block
+    names_array = np.array(names, dtype='U')
+    units_array = np.array(units, dtype='U')
+
+    if data.dtype != object:
+        return (subset, 'numeric',
+                [np.ascontiguousarray(data), names_array, units_array])
+
+    flat_data = data.ravel()
+    text_mask = np.frompyfunc(is_text, 1, 1)(flat_data).astype(bool)
+    values = np.full(flat_data.shape, np.nan, dtype=np.float64)
+    try:
+        values[~text_mask] = flat_data[~text_mask].astype(np.float64)
+    except (TypeError, ValueError):
+        return None
+
+    return (subset, 'object',
+            [values.reshape(data.shape), names_array, units_array,
+             np.nonzero(text_mask)[0].astype(np.int64),
+             np.array(flat_data[text_mask].tolist(), dtype='U')])
+    #  #]
+
+def join_block(subset, kind, arrays):
+    #  #[
+    """
+    the inverse of split_block, returns (subset, data, names, units)
+    with the names and units as lists, like BUFRReader returns them
+    """
+    values = arrays[0]
+    names = arrays[1].tolist()
+    units = arrays[2].tolist()
+    if kind == 'numeric':
+        return (subset, values, names, units)
+
+    # object arrays cannot live in shared memory, so this one is a copy
+    data = values.astype(object)
+    data.flat[arrays[3]] = arrays[4].tolist()
+    return (subset, data, names, units)
+    #  #]
+
+def pack_blocks(buf, blocks):
+    #  #[
+    """
+    store the arrays of the decoded blocks in the given buffer.
+    Returns (layout, needed_size). If the buffer is too small, or
+    the blocks cannot be converted to plain arrays, layout is None.
+    """
+    split_blocks = []
+    for block in blocks:
+        split = split_block(block)
+        if split is None:
+            return (None, 0)
+        split_blocks.append(split)
+
+    # first determine the location of each array
+    layout = []
+    offset = 0
+    for (subset, kind, arrays) in split_blocks:
+        array_layout = []
+        for array in arrays:
+            array_layout.append((array.dtype.str, array.shape, offset))
+            offset += -(-array.nbytes//ALIGNMENT)*ALIGNMENT
+        layout.append((subset, kind, array_layout))
+
+    if offset > len(buf):
+        return (None, offset)
+
+    for (split, block_layout) in zip(split_blocks, layout):
+        arrays = split[2]
+        array_layout = block_layout[2]
+        for (array, (dtype, shape, array_offset)) in zip(arrays,
+                                                         array_layout):
+            view = np.ndarray(shape, dtype=dtype, buffer=buf,
+                              offset=array_offset)
+            view[...] = array
+            # don't keep an export of the buffer alive
+            del view
+
+    return (layout, offset)
+    #  #]
+
+def unpack_blocks(buf, layout):
+    #  #[
+    """
+    create the decoded blocks from the given buffer and layout
+    (the numeric arrays are views on the buffer, not copies)
+    """
+    blocks = []
+    for (subset, kind, array_layout) in layout:
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+                  for (dtype, shape, offset) in array_layout]
+        blocks.append(join_block(subset, kind, arrays))
+    return blocks
+    #  #]
+
+class SharedMemoryTransport:
+    #  #[ parent side administration of the segments
+    """
+    a class that owns the shared memory segments used to pass
+    decoded data from the worker processes to the parent process,
+    and keeps track of which segments are in use
+    """
+    def __init__(self, segment_startsize=SEGMENT_STARTSIZE):
+        #  #[
+        if shared_memory is None:
+            errtxt = ('Sorry, shared memory segments are not available '+
+                      'for this python version')
+            raise EcmwfBufrLibError(errtxt)
+
+        # start the resource tracker before the worker processes are
+        # started, so they share it with the parent process. Otherwise
+        # each worker would get its own tracker, that would remove
+        # the segments it used as soon as the worker exits.
+        resource_tracker.ensure_running()
+
+        self.segment_startsize = segment_startsize
+
+        # all segments, stored by name
+        self.segments = {}
+        # names of the segments that are not in use
+        self.free_segments = []
+        # the largest size needed by any message so far
+        self.needed_size = 0
+        #  #]
+    def acquire(self):
+        #  #[
+        """
+        select a free segment, or create a new one if none is free.
+        Returns the (name, size) of the segment
+        """
+        if self.free_segments:
+            name = self.free_segments.pop()
+        else:
+            size = max(self.segment_startsize, self.needed_size)
+            segment = shared_memory.SharedMemory(create=True, size=size)
+            name = segment.name
+            self.segments[name] = segment
+        return (name, self.segments[name].size)
+        #  #]
+    def release(self, name):
+        #  #[
+        """
+        mark a segment as free again, so it can be reused.
+        Segments that are too small for the largest message seen so far
+        are replaced by a new one.
+        """
+        if self.segments[name].size < self.needed_size:
+            self.remove_segment(name)
+            return
+        self.free_segments.append(name)
+        #  #]
+    def report_needed_size(self, needed_size):
+        #  #[
+        """
+        remember that a message needed a larger segment than available
+        """
+        if needed_size > self.needed_size:
+            self.needed_size = int(needed_size*SEGMENT_GROWTH_FACTOR)
+        #  #]
+    def unpack(self, name, layout):
+        #  #[
+        """
+        create the decoded blocks that a worker stored in a segment
+        """
+        return unpack_blocks(self.segments[name].buf, layout)
+        #  #]
+    def remove_segment(self, name):
+        #  #[
+        """
+        remove a segment. If there still are numpy views on it, the
+        memory remains available until these views are deleted.
+        """
+        segment = self.segments.pop(name)
+        segment.unlink()
+        try:
+            segment.close()
+        except BufferError:
+            # views on this segment are still in use
+            pass
+        #  #]
+    def close(self):
+        #  #[
+        """
+        remove all segments
+        """
+        for name in list(self.segments.keys()):
+            self.remove_segment(name)
+        self.free_segments = []
+        #  #]
+    #  #]
+
+def attach_segment(name):
+    #  #[
+    """
+    attach to an existing segment, owned by the parent process.
+    Note that this function is not thread-safe for python versions
+    before 3.13: while attaching, resource_tracker.register is replaced
+    for the whole process, so resources registered by other threads in
+    the mean time are not tracked. Calls to this function itself
+    are serialised using ATTACH_LOCK.
+    """
+    try:
+        # python 3.13 and newer
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    # older versions register the segment with the resource tracker when
+    # attaching, which would make a resource tracker of this process
+    # remove the segment when this process exits. Unregistering it after
+    # attaching is not possible, since the resource tracker is shared
+    # with the parent (see SharedMemoryTransport) and keeps only one
+    # registration per segment, so that would undo the registration of
+    # the parent. Therefore skip the registration while attaching.
+    with ATTACH_LOCK:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    #  #]
+
+class SharedMemoryAttachments:
+    #  #[ worker side administration of the segments
+    """
+    a class that keeps the segments used by a worker process attached,
+    so they don't need to be mapped again for each message
+    """
+    def __init__(self, max_attachments):
+        #  #[
+        self.max_attachments = max_attachments
+        self.attached = {}
+        # names in order of last use
+        self.last_used = []
+        #  #]
+    def get_buffer(self, name):
+        #  #[
+        """
+        return the buffer of the segment with the given name
+        """
+        if name in self.attached:
+            self.last_used.remove(name)
+        else:
+            if len(self.attached) >= self.max_attachments:
+                oldest = self.last_used.pop(0)
+                self.attached.pop(oldest).close()
+            self.attached[name] = attach_segment(name)
+        self.last_used.append(name)
+        return self.attached[name].buf
+        #  #]
+    #  #]
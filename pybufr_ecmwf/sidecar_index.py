@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""
+This file defines some functions to store the locations and header
+catalogue of the BUFR messages in a file in a sidecar index file,
+which allows RawBUFRFile to reopen a file without scanning it again.
+"""
+
+#  #[ documentation
+#
+# The index file is stored next to the BUFR file, with the extension
+# .bufridx appended to its name. It is a numpy .npz file holding:
+# -pointers: an integer array with one row per BUFR message, holding
+#  the start and end location, the 6 section sizes and the 6 section
+#  start locations (see RawBUFRFile.list_of_bufr_pointers)
+# -catalogue: the header catalogue (see header_catalogue.py)
+# -properties: the index format version, and the size and modification
+#  time of the BUFR file at the time the index was written
+# -head_hash: a hash of the first bytes of the BUFR file
+#
+# An index is used as is if the size and modification time of the BUFR
+# file did not change. If the file only grew and its first bytes and the
+# last indexed message are unchanged, the file is assumed to have been
+# appended to, and only the new part needs to be scanned.
+# In all other cases the index is ignored, and replaced once the file
+# has been scanned again.
+#
+# Note about the use of the "#  #[" and "#  #]" comments:
+#   these are folding marks for my favorite editor, emacs, combined with its
+#   folding mode
+#   (see http://www.emacswiki.org/emacs/FoldingMode for more details)
+# Please do not remove them.
+#
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+#
+#  #]
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function) #, unicode_literals)
+
+import os          # operating system functions
+import hashlib     # hashing of the start of the file
+import tempfile    # creating temporary files
+import numpy as np # import numerical capabilities
+
+from .header_catalogue import HEADER_CATALOGUE_DTYPE
+#  #]
+#  #[ some constants
+INDEX_EXTENSION = '.bufridx'
+INDEX_FORMAT_VERSION = 1
+
+# the number of bytes at the start of the BUFR file used to verify
+# that an appended file still has the same content
+HEAD_HASH_SIZE = 65536
+#  #]
+
+def get_index_filename(filename):
+    #  #[
+    """
+    return the name of the index file for the given BUFR file
+    """
+    return filename + INDEX_EXTENSION
+    #  #]
+
+def get_head_hash(data, filesize):
+    #  #[
+    """
+    return a hash of the first bytes of the given file data,
+    that was filesize bytes long when the index was written
+    """
+    head = data[:min(filesize, HEAD_HASH_SIZE)]
+    return np.frombuffer(hashlib.md5(head).digest(), dtype=np.uint8)
+    #  #]
+
+def get_file_properties(filename):
+    #  #[
+    """
+    return the size and modification time (in ns) of the given file
+    """
+    stat_result = os.stat(filename)
+    mtime_ns = getattr(stat_result, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # python 2
+        mtime_ns = int(stat_result.st_mtime*1e9)
+    return (stat_result.st_size, mtime_ns)
+    #  #]
+
+def pointers_to_array(list_of_bufr_pointers):
+    #  #[
+    """
+    convert a list of BUFR pointers to a 2D integer array
+    """
+    pointers = np.zeros((len(list_of_bufr_pointers), 14), dtype=np.int64)
+    for (i, (start, end, section_sizes, section_start_locations)) in \
+            enumerate(list_of_bufr_pointers):
+        pointers[i, 0] = start
+        pointers[i, 1] = end
+        pointers[i, 2:8] = section_sizes
+        pointers[i, 8:14] = section_start_locations
+    return pointers
+    #  #]
+
+def array_to_pointers(pointers):
+    #  #[
+    """
+    the inverse of pointers_to_array
+    """
+    return [(row[0], row[1], row[2:8], row[8:14])
+            for row in pointers.tolist()]
+    #  #]
+
+def load_index(filename, data):
+    #  #[
+    """
+    load the index for the given BUFR file and its data.
+    Returns a tuple (list_of_bufr_pointers, catalogue, complete).
+    If complete is False the file has been appended to after the index
+    was written, and the remainder of the file still needs to be scanned.
+    Returns None if no valid index is available.
+    """
+    index_filename = get_index_filename(filename)
+    if not os.path.exists(index_filename):
+        return None
+
+    try:
+        with np.load(index_filename, allow_pickle=False) as npz:
+            properties = npz['properties']
+            pointers = npz['pointers']
+            catalogue = npz['catalogue']
+            head_hash = npz['head_hash']
+    except (IOError, OSError, KeyError, ValueError):
+        # the index file is damaged, or written by an incompatible version
+        return None
+
+    (version, filesize, mtime_ns) = properties.tolist()
+    if ( (version != INDEX_FORMAT_VERSION) or
+         (catalogue.dtype != HEADER_CATALOGUE_DTYPE) or
+         (len(catalogue) != len(pointers)) ):
+        return None
+
+    (current_filesize, current_mtime_ns) = get_file_properties(filename)
+    if (current_filesize == filesize) and (current_mtime_ns == mtime_ns):
+        return (array_to_pointers(pointers), catalogue, True)
+
+    if current_filesize <= filesize:
+        return None
+
+    # the file has grown, so check it has only been appended to
+    if len(data) < filesize:
+        return None
+    if not np.array_equal(get_head_hash(data, filesize), head_hash):
+        return None
+    if len(pointers) > 0:
+        (start, end) = pointers[-1, :2].tolist()
+        if ( (data[start:start+4] != b'BUFR') or
+             (data[end-4:end] != b'7777') ):
+            return None
+
+    return (array_to_pointers(pointers), catalogue, False)
+    #  #]
+
+def save_index(filename, data, list_of_bufr_pointers, catalogue,
+               verbose=False):
+    #  #[
+    """
+    write the index for the given BUFR file. Failing to write it
+    (for example in a read-only directory) is not considered an error.
+    """
+    index_filename = get_index_filename(filename)
+    # note: use the size of the data that was actually scanned, so an
+    # append while scanning is detected when the index is loaded
+    filesize = len(data)
+    mtime_ns = get_file_properties(filename)[1]
+    properties = np.array([INDEX_FORMAT_VERSION, filesize, mtime_ns],
+                          dtype=np.int64)
+    temp_filename = None
+    try:
+        # write to a temporary file first, so other processes
+        # never see a partially written index
+        (fd, temp_filename) = tempfile.mkstemp(
+            prefix=os.path.basename(index_filename)+'.',
+            dir=os.path.dirname(os.path.abspath(index_filename)))
+        with os.fdopen(fd, 'wb') as fileobj:
+            np.savez(fileobj, properties=properties,
+                     pointers=pointers_to_array(list_of_bufr_pointers),
+                     catalogue=catalogue,
+                     head_hash=get_head_hash(data, filesize))
+        # mkstemp only allows the owner to read the file
+        os.chmod(temp_filename, 0o644)
+        try:
+            os.replace(temp_filename, index_filename)
+        except AttributeError:
+            # python 2
+            if os.path.exists(index_filename):
+                os.remove(index_filename)
+            os.rename(temp_filename, index_filename)
+    except (IOError, OSError) as err:
+        if (temp_filename is not None) and os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        if verbose:
+            print('WARNING: could not write index file: ', index_filename)
+            print(err)
+        return False
+    return True
+    #  #]
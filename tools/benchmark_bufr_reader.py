@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+a small tool to benchmark decoding BUFR messages with BUFRReader.
+It compares the original decoding sequence (bus012, bufrex, bus0123
+and busel2) with the current one (header extraction in python, bufrex
+and busel2) on a scaled up version of a BUFR file, and times the
+ParallelBUFRReader for a growing number of worker processes.
+Usage: tools/benchmark_bufr_reader.py [scale_factor [bufr_file]]
+"""
+
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function)
+import os, sys, time, tempfile, multiprocessing
+import numpy as np
+
+# allow running this tool from the software root without installing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from pybufr_ecmwf.raw_bufr_file import RawBUFRFile
+from pybufr_ecmwf.bufr_interface_ecmwf import BUFRInterfaceECMWF
+from pybufr_ecmwf.bufr import BUFRReader
+from pybufr_ecmwf.parallel_bufr import ParallelBUFRReader
+#  #]
+#  #[ settings
+TESTDATADIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'test', 'testdata')
+ASCAT_TESTFILE = os.path.join(TESTDATADIR, 'ascat_l2_example.bufr')
+#  #]
+
+def create_scaled_file(input_file, scale):
+    #  #[
+    """ concatenate input_file scale times into a temporary file.
+    Returns the filename """
+    with open(input_file, 'rb') as fd:
+        data = fd.read()
+    (handle, filename) = tempfile.mkstemp(suffix='.BUFR')
+    with os.fdopen(handle, 'wb') as fd:
+        for i in range(scale):
+            fd.write(data)
+    return filename
+    #  #]
+
+def decode_reference(raw_msg, section_sizes, section_start_locations):
+    #  #[
+    """ the original decoding sequence done by BUFRMessage_R,
+    kept here for comparison only """
+    bufr_obj = BUFRInterfaceECMWF(raw_msg, section_sizes,
+                                  section_start_locations)
+    bufr_obj.decode_sections_012()
+    bufr_obj.setup_tables()
+    bufr_obj.decode_data()
+    bufr_obj.decode_sections_0123()
+    bufr_obj.fill_descriptor_list_subset(subset=1)
+    return bufr_obj
+    #  #]
+
+def decode_current(raw_msg, section_sizes, section_start_locations):
+    #  #[
+    """ the current decoding sequence done by BUFRMessage_R """
+    bufr_obj = BUFRInterfaceECMWF(raw_msg, section_sizes,
+                                  section_start_locations)
+    bufr_obj.extract_sections_012()
+    bufr_obj.setup_tables()
+    bufr_obj.decode_data()
+    bufr_obj.fill_descriptor_list_subset(subset=1)
+    return bufr_obj
+    #  #]
+
+def check_headers(raw_msg, section_sizes, section_start_locations):
+    #  #[
+    """ verify the header items extracted in python match
+    the ones decoded by bus012 """
+    ref = BUFRInterfaceECMWF(raw_msg, section_sizes, section_start_locations)
+    ref.decode_sections_012()
+    new = BUFRInterfaceECMWF(raw_msg, section_sizes, section_start_locations)
+    new.extract_sections_012()
+    assert np.array_equal(ref.ksec0[:3], new.ksec0[:3])
+    assert np.array_equal(ref.ksec1[:18], new.ksec1[:18])
+    assert ref.get_num_subsets() == new.get_num_subsets()
+    #  #]
+
+def benchmark_decoding(input_file, scale):
+    #  #[
+    """ compare the original and current decoding sequence """
+    filename = create_scaled_file(input_file, scale)
+    try:
+        rbf = RawBUFRFile(warn_about_bufr_size=False)
+        rbf.open(filename, 'rb')
+        nmsgs = rbf.get_num_bufr_msgs()
+        msgs = [rbf.get_raw_bufr_msg(i) for i in range(1, nmsgs+1)]
+
+        check_headers(*msgs[0])
+
+        print('decoding {0} messages from {1}:'.
+              format(nmsgs, os.path.basename(input_file)))
+        for (txt, decode_function) in (('original:', decode_reference),
+                                       ('current: ', decode_current)):
+            # decode one message first, to exclude loading the tables
+            decode_function(*msgs[0])
+            start = time.time()
+            for msg in msgs:
+                decode_function(*msg)
+            t_decode = time.time() - start
+            print('  {0} {1:8.3f} s, {2:8.1f} msgs/s'.
+                  format(txt, t_decode, nmsgs/t_decode))
+        rbf.close()
+    finally:
+        os.remove(filename)
+    #  #]
+
+def count_values(reader):
+    #  #[
+    """ decode all messages using the given reader and
+    return the number of messages and data values """
+    nmsgs = 0
+    nvalues = 0
+    for msg in reader:
+        nmsgs += 1
+        for msg_part in msg:
+            nvalues += msg_part.data.size
+    return (nmsgs, nvalues)
+    #  #]
+
+def benchmark_parallel_decoding(input_file, scale):
+    #  #[
+    """ compare BUFRReader with ParallelBUFRReader """
+    filename = create_scaled_file(input_file, scale)
+    try:
+        print('decoding all data from {0}:'.
+              format(os.path.basename(input_file)))
+        start = time.time()
+        reader = BUFRReader(filename, warn_about_bufr_size=False)
+        (nmsgs, nvalues_ref) = count_values(reader)
+        reader.close()
+        t_decode = time.time() - start
+        print('  {0:33s} {1:8.3f} s, {2:8.1f} msgs/s'.
+              format('BUFRReader:', t_decode, nmsgs/t_decode))
+
+        num_workers = 1
+        while num_workers <= multiprocessing.cpu_count():
+            start = time.time()
+            with ParallelBUFRReader(filename, num_workers=num_workers,
+                                    warn_about_bufr_size=False) as reader:
+                (nmsgs, nvalues) = count_values(reader)
+            t_decode = time.time() - start
+            assert nvalues == nvalues_ref
+            txt = 'ParallelBUFRReader ({0} workers):'.format(num_workers)
+            print('  {0:33s} {1:8.3f} s, {2:8.1f} msgs/s'.
+                  format(txt, t_decode, nmsgs/t_decode))
+            num_workers *= 2
+    finally:
+        os.remove(filename)
+    #  #]
+
+#  #[ run the tool
+SCALE = 100
+INPUT_FILE = ASCAT_TESTFILE
+if len(sys.argv) > 1:
+    SCALE = int(sys.argv[1])
+if len(sys.argv) > 2:
+    INPUT_FILE = sys.argv[2]
+
+benchmark_decoding(INPUT_FILE, SCALE)
+benchmark_parallel_decoding(INPUT_FILE, SCALE)
+#  #]
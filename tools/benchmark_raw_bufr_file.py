@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""
+a small tool to benchmark the pure python parts of the RawBUFRFile class
+on scaled up versions of the BUFR files in the test/testdata directory.
+Usage: tools/benchmark_raw_bufr_file.py [scale_factor]
+"""
+
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function)
+import os, sys, time, tempfile, struct
+import numpy as np
+
+# allow running this tool from the software root without installing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from pybufr_ecmwf.raw_bufr_file import RawBUFRFile
+#  #]
+#  #[ settings
+TESTDATADIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'test', 'testdata')
+CORRUPTED_TESTFILE = os.path.join(TESTDATADIR, 'Testfile3CorruptedMsgs.BUFR')
+# note: use an edition 4 file here, since editions 0 and 1
+# do not store the total message length in section 0
+ASCAT_TESTFILE = os.path.join(TESTDATADIR, 'ascat_l2_example.bufr')
+#  #]
+
+def create_scaled_file(input_file, scale, junk=b''):
+    #  #[
+    """ concatenate input_file scale times into a temporary file,
+    optionally separated by some junk data. Returns the filename """
+    with open(input_file, 'rb') as fd:
+        data = fd.read()
+    (handle, filename) = tempfile.mkstemp(suffix='.BUFR')
+    with os.fdopen(handle, 'wb') as fd:
+        for i in range(scale):
+            fd.write(junk)
+            fd.write(data)
+    return filename
+    #  #]
+
+def create_large_msg_file(input_file, msg_size, num_msgs):
+    #  #[
+    """ create a file holding num_msgs copies of the first message
+    in input_file, inflated to (about) msg_size bytes by extending
+    section 4 with zeros. Returns the filename """
+    rbf = RawBUFRFile(warn_about_bufr_size=False)
+    rbf.open(input_file, 'rb')
+    (start, end, section_sizes, section_start_locations) = \
+            rbf.list_of_bufr_pointers[0]
+    data = bytearray(rbf.data[start:end])
+    rbf.close()
+
+    # keep the total size a multiple of 4 plus 2 bytes, to include
+    # the message at the end of the file that needs zero padding
+    extra = msg_size - len(data)
+    extra = extra - (len(data) + extra) % 4 + 2
+    start4 = section_start_locations[4]
+    end4 = start4 + section_sizes[4]
+    data = (data[:end4] + bytearray(extra) + data[end4:])
+
+    # fix the total length and the length of section 4
+    data[4:7] = struct.pack('>i', len(data))[1:]
+    data[start4:start4+3] = struct.pack('>i', section_sizes[4]+extra)[1:]
+
+    (handle, filename) = tempfile.mkstemp(suffix='.BUFR')
+    with os.fdopen(handle, 'wb') as fd:
+        for i in range(num_msgs):
+            fd.write(data)
+    return filename
+    #  #]
+
+def get_raw_bufr_msg_reference(rbf, msg_nr):
+    #  #[
+    """ the original conversion to words done by
+    RawBUFRFile.get_raw_bufr_msg(), kept here for comparison only """
+    (start_index, end_index, section_sizes, section_start_locations) = \
+                  rbf.list_of_bufr_pointers[msg_nr-1]
+    size_bytes = (end_index-start_index)
+    size_words = (size_bytes+3)//4
+    padding_bytes = size_words*4-size_bytes
+    end_index = end_index+padding_bytes
+    raw_data_bytes = rbf.data[start_index:end_index]
+    nbytes = len(raw_data_bytes)
+    nbytes_rounded = 4*(nbytes//4)
+    if nbytes != nbytes_rounded:
+        num_zeros_to_add = nbytes_rounded+4-nbytes
+        str_to_add = b''.join(b'\x00' for i in range(num_zeros_to_add))
+        raw_data_bytes = raw_data_bytes + str_to_add
+    dataformat = "<"+str(size_words)+"i"
+    words = np.array(struct.unpack(dataformat, raw_data_bytes))
+    return (words, section_sizes, section_start_locations)
+    #  #]
+
+def split_reference(rbf):
+    #  #[
+    """ the original implementation of RawBUFRFile.split(), that
+    collects all start and end markers and matches them afterwards,
+    kept here for comparison only """
+    list_of_start_locations = []
+    list_of_end_locations = []
+    for (txt, locations) in ((b'BUFR', list_of_start_locations),
+                             (b'7777', list_of_end_locations)):
+        search_pos = 0
+        while True:
+            pos = rbf.data.find(txt, search_pos)
+            if pos == -1:
+                break
+            locations.append(pos)
+            search_pos = pos + 4
+
+    list_of_bufr_pointers = []
+    for start_location in list_of_start_locations:
+        expected_msg_size, section_sizes, section_start_locations = \
+                           rbf.get_expected_msg_size(start_location)
+        expected_msg_end_location = start_location + expected_msg_size - 4
+        if expected_msg_end_location in list_of_end_locations:
+            list_of_bufr_pointers.append((start_location,
+                                          expected_msg_end_location+4,
+                                          section_sizes,
+                                          section_start_locations))
+    return list_of_bufr_pointers
+    #  #]
+
+def time_it(function, *args):
+    #  #[
+    """ return the result and runtime in seconds of function(*args) """
+    start = time.time()
+    result = function(*args)
+    return (result, time.time() - start)
+    #  #]
+
+def benchmark_split(scale):
+    #  #[
+    """ compare the original and current message splitting
+    on a scaled up corrupted test file, with some junk in between
+    the messages that contains a lot of false end markers """
+    junk = b'7777'*64
+    filename = create_scaled_file(CORRUPTED_TESTFILE, scale, junk)
+    try:
+        rbf = RawBUFRFile(warn_about_bufr_size=False)
+        rbf.open(filename, 'rb')
+        # suppress the error messages printed for the corrupted messages
+        stdout_saved = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            (ref_pointers, t_ref) = time_it(split_reference, rbf)
+            (dummy, t_new) = time_it(rbf.split)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout_saved
+        assert ref_pointers == rbf.list_of_bufr_pointers
+        print('split() on {0} bytes, {1} messages:'.
+              format(rbf.filesize, rbf.nr_of_bufr_messages))
+        print('  original: {0:8.3f} s'.format(t_ref))
+        print('  current:  {0:8.3f} s'.format(t_new))
+        rbf.close()
+    finally:
+        os.remove(filename)
+    #  #]
+
+def benchmark_get_raw_bufr_msg(num_msgs, msg_size=500000):
+    #  #[
+    """ compare the original and current conversion of a BUFR message
+    to an array of words, for large messages """
+    filename = create_large_msg_file(ASCAT_TESTFILE, msg_size, num_msgs)
+    try:
+        for use_mmap in (False, True):
+            rbf = RawBUFRFile(warn_about_bufr_size=False)
+            rbf.open(filename, 'rb', use_mmap=use_mmap)
+            nmsgs = rbf.get_num_bufr_msgs()
+
+            def run_reference():
+                """ convert all messages the old way """
+                return [get_raw_bufr_msg_reference(rbf, i)[0]
+                        for i in range(1, nmsgs+1)]
+            def run_current():
+                """ convert all messages the current way """
+                return [rbf.get_raw_bufr_msg(i)[0]
+                        for i in range(1, nmsgs+1)]
+
+            (ref_words, t_ref) = time_it(run_reference)
+            (words, t_new) = time_it(run_current)
+            for (ref, new) in zip(ref_words, words):
+                assert np.array_equal(ref, new)
+            del ref_words, words
+            print('get_raw_bufr_msg() on {0} messages of {1} bytes, '.
+                  format(nmsgs, msg_size)+'use_mmap={0}:'.format(use_mmap))
+            print('  original: {0:8.3f} ms/msg'.format(1000.*t_ref/nmsgs))
+            print('  current:  {0:8.3f} ms/msg'.format(1000.*t_new/nmsgs))
+            rbf.close()
+    finally:
+        os.remove(filename)
+    #  #]
+
+def write_raw_bufr_msg_reference(rbf, words):
+    #  #[
+    """ the original word by word writing done by
+    RawBUFRFile.write_raw_bufr_msg(), kept here for comparison only """
+    for word in words:
+        rbf.bufr_fd.write(struct.pack("<i", word))
+    #  #]
+
+def benchmark_write_raw_bufr_msg(num_msgs, flush_size=10000000):
+    #  #[
+    """ compare the original and current writing of BUFR messages,
+    with and without collecting the messages in a write buffer """
+    rbf = RawBUFRFile()
+    rbf.open(os.path.join(TESTDATADIR, 'synop2.bin'), 'rb')
+    msgs = [rbf.get_raw_bufr_msg(i)[0]
+            for i in range(1, rbf.get_num_bufr_msgs()+1)]
+    msgs = (msgs*(1+num_msgs//len(msgs)))[:num_msgs]
+    rbf.close()
+
+    (handle, filename) = tempfile.mkstemp(suffix='.BUFR')
+    os.close(handle)
+    try:
+        def run(write_function, flush_size):
+            """ write all messages """
+            rbf = RawBUFRFile()
+            rbf.open(filename, 'wb', flush_size=flush_size)
+            for words in msgs:
+                write_function(rbf, words)
+            rbf.close()
+        print('write_raw_bufr_msg() on {0} synop messages:'.format(num_msgs))
+        for (txt, write_function, fls) in \
+                (('original:', write_raw_bufr_msg_reference, 0),
+                 ('current: ', RawBUFRFile.write_raw_bufr_msg, 0),
+                 ('buffered:', RawBUFRFile.write_raw_bufr_msg, flush_size)):
+            (dummy, t_write) = time_it(run, write_function, fls)
+            print('  {0} {1:8.3f} s'.format(txt, t_write))
+    finally:
+        os.remove(filename)
+    #  #]
+
+#  #[ run the tool
+if len(sys.argv) > 1:
+    SCALE = int(sys.argv[1])
+else:
+    SCALE = 1000
+
+benchmark_split(SCALE)
+benchmark_get_raw_bufr_msg(max(1, SCALE//10))
+benchmark_write_raw_bufr_msg(10*SCALE)
+#  #]
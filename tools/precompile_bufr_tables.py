@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+a small tool to precompile all sets of BUFR tables (B, C and D tables
+in the ECMWF text format) found in a given directory, so BufrTable can
+load them much faster. For every B-table BXXXX.TXT a file XXXX.pickle
+is written, by default in the same directory. If an output_dir is given,
+point the PYBUFR_ECMWF_COMPILED_TABLES environment setting to it (or
+pass it as compiled_tables_dir to BufrTable) to use the written files.
+Only write these files to directories that can only be written by
+trusted users, since loading them unpickles their contents.
+Usage: tools/precompile_bufr_tables.py tables_dir [output_dir]
+"""
+
+# Copyright J. de Kloe
+# This software is licensed under the terms of the LGPLv3 Licence
+# which can be obtained from https://www.gnu.org/licenses/lgpl.html
+
+#  #[ imported modules
+from __future__ import (absolute_import, division,
+                        print_function)
+import os, sys, glob
+
+# allow running this tool from the software root without installing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from pybufr_ecmwf.bufr_table import BufrTable
+#  #]
+
+def precompile_tables(tables_dir, output_dir=None):
+    #  #[
+    """ precompile all table sets in tables_dir and
+    return the number of failed table sets """
+    bt = BufrTable(tables_dir=tables_dir, verbose=False,
+                   report_warnings=False)
+    num_failed = 0
+    for b_tablefile in sorted(glob.glob(os.path.join(tables_dir, 'B*.TXT'))):
+        (path, base) = os.path.split(b_tablefile)
+        if not os.path.exists(os.path.join(path, 'D'+base[1:])):
+            # some table sets provided by ECMWF only have a B table
+            print('skipping '+base+' (no matching D table)')
+            continue
+        try:
+            compiled_file = bt.compile_tables(b_tablefile, output_dir)
+            print('written: '+compiled_file)
+        except Exception as err:
+            print('ERROR: precompiling '+base+' failed: '+str(err))
+            bt.unload_tables()
+            num_failed += 1
+    return num_failed
+    #  #]
+
+#  #[ run the tool
+if len(sys.argv) < 2:
+    print('please give a BUFR tables directory as argument')
+    sys.exit(1)
+
+TABLES_DIR = sys.argv[1]
+OUTPUT_DIR = None
+if len(sys.argv) > 2:
+    OUTPUT_DIR = sys.argv[2]
+
+if precompile_tables(TABLES_DIR, OUTPUT_DIR) > 0:
+    sys.exit(1)
+#  #]
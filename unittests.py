@@ -46,16 +46,19 @@ from __future__ import (absolute_import, division,
                         print_function) # , unicode_literals)
 
 import os         # operating system functions
+import io         # in memory file objects
 import sys        # operating system functions
 import shutil     # operating system functions
 import unittest   # import the unittest functionality
 import subprocess # support running additional executables
 import stat       # to retrieve a file modification timestamp
 import time       # to handle date/time formatting
+import signal     # to kill a worker process
 
 from pybufr_ecmwf.helpers import (get_and_set_the_module_path, python3,
                                   python_major_minor)
-from pybufr_ecmwf.custom_exceptions import IncorrectUsageError
+from pybufr_ecmwf.custom_exceptions import (IncorrectUsageError,
+                                            EcmwfBufrLibError)
 
 DUMMY_SYS_PATH = sys.path[:] # provide a copy
 (DUMMY_SYS_PATH, MY_MODULE_PATH) = get_and_set_the_module_path(DUMMY_SYS_PATH)
@@ -79,6 +82,13 @@ if 'build/lib' in MY_MODULE_PATH:
 try:
     from pybufr_ecmwf.bufr_interface_ecmwf import BUFRInterfaceECMWF
     from pybufr_ecmwf.raw_bufr_file import RawBUFRFile
+    from pybufr_ecmwf.header_catalogue import make_header_filter
+    from pybufr_ecmwf.bufr_stream import (BUFRStreamFramer, BUFRStreamReader,
+                                          read_chunks)
+    from pybufr_ecmwf.bufr_table import BufrTable
+    from pybufr_ecmwf.bufr import BUFRReader
+    from pybufr_ecmwf.parallel_bufr import ParallelBUFRReader
+    from pybufr_ecmwf import parallel_bufr
     # from pybufr_ecmwf import bufr
     # from pybufr_ecmwf import bufr_table
     from pybufr_ecmwf import ecmwfbufr
@@ -124,10 +134,13 @@ def call_cmd(cmd, rundir=''):
     # print('DEBUG: cmd = ',cmd)
 
     # remove the env setting to
-    # /tmp/pybufr_ecmwf_temporary_files_*/tmp_BUFR_TABLES/
+    # /tmp/pybufr_ecmwf_*/tmp_BUFR_TABLES/
     # that may have been left by a previous test
+    # (and the copy of the original user setting)
     if 'BUFR_TABLES' in env:
         del env['BUFR_TABLES']
+    if 'PYBUFR_ECMWF_USER_BUFR_TABLES' in env:
+        del env['PYBUFR_ECMWF_USER_BUFR_TABLES']
 
     # change dir if needed
     if rundir:
@@ -630,8 +643,17 @@ class CheckBUFRInterfaceECMWF(unittest.TestCase):
 
     #  #]
 
+def kill_current_process(*args):
+    #  #[ simulate a crashing worker process
+    '''
+    kill the process calling this function, used to replace the decoding
+    task of the worker processes of the ParallelBUFRReader
+    '''
+    os.kill(os.getpid(), signal.SIGKILL)
+    #  #]
+
 class CheckBUFRReader(unittest.TestCase):
-    #  #[ 3 tests
+    #  #[ 9 tests
     """
     a class to check the BUFRReader class
     """
@@ -691,6 +713,132 @@ class CheckBUFRReader(unittest.TestCase):
         success = call_cmd_and_verify_output(cmd)
         self.assertEqual(success, True)
         #  #]
+    def test_parallel_reader(self):
+        #  #[
+        """
+        test decoding with the ParallelBUFRReader, which should give
+        the same result as the BUFRReader
+        """
+        reader1 = BUFRReader(self.testinputfileERS, warn_about_bufr_size=False)
+        data1 = [(msg.msg_index, msg_part.names, msg_part.units,
+                  msg_part.data.tolist())
+                 for msg in reader1 for msg_part in msg]
+        reader1.close()
+
+        # try both passing the data through shared memory and pickling
+        for use_shared_memory in [None, False]:
+            with ParallelBUFRReader(self.testinputfileERS, num_workers=2,
+                                    max_in_flight=3,
+                                    warn_about_bufr_size=False,
+                                    use_shared_memory=use_shared_memory) \
+                                    as reader2:
+                data2 = [(msg.msg_index, msg_part.names, msg_part.units,
+                          msg_part.data.tolist())
+                         for msg in reader2 for msg_part in msg]
+            self.assertEqual(data1, data2)
+        #  #]
+
+    def test_parallel_reader_killed_worker(self):
+        #  #[
+        """
+        test that the ParallelBUFRReader raises an exception in stead of
+        waiting forever if a worker process dies
+        """
+        # the forked worker processes inherit this replacement
+        decode_msg_in_worker = parallel_bufr.decode_msg_in_worker
+        parallel_bufr.decode_msg_in_worker = kill_current_process
+        try:
+            with ParallelBUFRReader(self.testinputfileERS, num_workers=1,
+                                    warn_about_bufr_size=False) as reader:
+                self.assertRaises(EcmwfBufrLibError, list, reader)
+        finally:
+            parallel_bufr.decode_msg_in_worker = decode_msg_in_worker
+        #  #]
+
+    def test_ragged_values(self):
+        #  #[
+        """
+        test retrieving all subsets of a message using delayed
+        replication at once, which should give the same result as
+        retrieving the subsets one by one
+        """
+        reader = BUFRReader(self.testinputfileGRAS, warn_about_bufr_size=False)
+        for msg in reader:
+            (values, offsets, codes) = msg.get_ragged_values()
+            self.assertEqual(len(offsets), msg.get_num_subsets()+1)
+            self.assertEqual(len(values), len(codes))
+            for subset in range(msg.get_num_subsets()):
+                subset_values = msg.get_subset_values(subset+1)
+                self.assertEqual(
+                    values[offsets[subset]:offsets[subset+1]].tolist(),
+                    subset_values.tolist())
+        reader.close()
+        #  #]
+
+    def test_copy_on_yield(self):
+        #  #[
+        """
+        test that the data of a message can be kept after decoding
+        the next messages when the decode buffers are reused,
+        if copy_on_yield is used
+        """
+        reader1 = BUFRReader(self.testinputfileERS, warn_about_bufr_size=False)
+        data1 = [msg.get_values_as_2d_array().tolist() for msg in reader1]
+        reader1.close()
+
+        reader2 = BUFRReader(self.testinputfileERS, warn_about_bufr_size=False,
+                             reuse_buffers=True, copy_on_yield=True)
+        kept_results = None
+        for msg in reader2:
+            if kept_results is None:
+                # keep the results of the first message, and a snapshot
+                kept_results = [msg.get_values_as_2d_array(),
+                                msg.get_values(0),
+                                msg.get_subset_values(1)]
+                snapshots = [result.tolist() for result in kept_results]
+        reader2.close()
+
+        self.assertTrue(len(data1) > 1)
+        self.assertEqual(kept_results[0].tolist(), data1[0])
+        self.assertEqual([result.tolist() for result in kept_results],
+                         snapshots)
+        #  #]
+
+    def test_read_from_memory(self):
+        #  #[
+        """
+        test decoding BUFR data that is already in memory, or that is
+        read from a file object
+        """
+        reader1 = BUFRReader(self.testinputfileERS, warn_about_bufr_size=False)
+        data1 = [msg.get_values_as_2d_array().tolist() for msg in reader1]
+        reader1.close()
+
+        with open(self.testinputfileERS, 'rb') as fileobj:
+            raw_data = fileobj.read()
+        for source in [raw_data, io.BytesIO(raw_data)]:
+            reader2 = BUFRReader(source, warn_about_bufr_size=False)
+            data2 = [msg.get_values_as_2d_array().tolist() for msg in reader2]
+            reader2.close()
+            self.assertEqual(data1, data2)
+        #  #]
+
+    def test_stream_reader(self):
+        #  #[
+        """
+        test decoding BUFR messages while reading them in small chunks
+        """
+        reader1 = BUFRReader(self.testinputfileERS, warn_about_bufr_size=False)
+        data1 = [msg.get_values_as_2d_array().tolist() for msg in reader1]
+        reader1.close()
+
+        with open(self.testinputfileERS, 'rb') as fileobj:
+            raw_data = fileobj.read()
+        with BUFRStreamReader(io.BytesIO(raw_data), chunk_size=1000,
+                              warn_about_bufr_size=False) as reader2:
+            data2 = [msg.get_values_as_2d_array().tolist() for msg in reader2]
+        self.assertEqual(data1, data2)
+        #  #]
 
     #  #]
 
@@ -1091,7 +1239,7 @@ class CheckBUFRMessage_W(unittest.TestCase):
     #  #]
 
 class CheckRawBUFRFile(unittest.TestCase):
-    #  #[ 5 tests
+    #  #[ 12 tests
     """
     a class to check the raw_bufr_file class
     """
@@ -1100,6 +1248,7 @@ class CheckRawBUFRFile(unittest.TestCase):
     corruptedtestinputfile = os.path.join(TESTDATADIR,
                                           'Testfile3CorruptedMsgs.BUFR')
     testoutputfile3u = os.path.join(TESTDATADIR, 'Testoutputfile3u.BUFR')
+    testinputfile_ed4 = os.path.join(TESTDATADIR, 'ascat_l2_example.bufr')
 
     def test_init(self):
         #  #[
@@ -1220,6 +1369,63 @@ class CheckRawBUFRFile(unittest.TestCase):
         # check that a second close fails
         self.assertRaises(AttributeError, bufrfile.close)
         #  #]
+    def test_open_mmap(self):
+        #  #[
+        """
+        test reading a BUFR file in the lazy, memory mapped mode
+        """
+        bufrfile1 = RawBUFRFile(verbose=False)
+        bufrfile1.open(self.corruptedtestinputfile, 'rb')
+        bufrfile2 = RawBUFRFile(verbose=False)
+        bufrfile2.open(self.corruptedtestinputfile, 'rb', use_mmap=True)
+
+        # nothing should be located yet
+        self.assertEqual(bufrfile2.nr_of_bufr_messages, 0)
+
+        # step through the messages, this should give the same
+        # result as the normal reading mode
+        for msg_nr in range(1, bufrfile1.get_num_bufr_msgs()+1):
+            (words1, sizes1, locations1) = \
+                     bufrfile1.get_raw_bufr_msg(msg_nr)
+            (words2, sizes2, locations2) = bufrfile2.get_next_raw_bufr_msg()
+            self.assertEqual(list(words1), list(words2))
+            self.assertEqual(sizes1, sizes2)
+            self.assertEqual(locations1, locations2)
+            self.assertEqual(bufrfile2.nr_of_bufr_messages, msg_nr)
+
+        self.assertRaises(EOFError, bufrfile2.get_next_raw_bufr_msg)
+        self.assertEqual(bufrfile2.get_num_bufr_msgs(),
+                         bufrfile1.get_num_bufr_msgs())
+        bufrfile1.close()
+        bufrfile2.close()
+        #  #]
+    def test_write_buffered(self):
+        #  #[
+        """
+        test writing BUFR messages using a write buffer
+        """
+        bufrfile1 = RawBUFRFile(verbose=False)
+        bufrfile1.open(self.corruptedtestinputfile, 'rb')
+        num_msgs = bufrfile1.get_num_bufr_msgs()
+
+        # use a flush size that needs flushing halfway
+        bufrfile2 = RawBUFRFile(verbose=False)
+        bufrfile2.open(self.testoutputfile3u, 'wb', flush_size=10000)
+        for msg_nr in range(1, num_msgs+1):
+            words = bufrfile1.get_raw_bufr_msg(msg_nr)[0]
+            bufrfile2.write_raw_bufr_msg(words)
+        bufrfile2.close()
+
+        bufrfile3 = RawBUFRFile(verbose=False)
+        bufrfile3.open(self.testoutputfile3u, 'rb')
+        self.assertEqual(bufrfile3.get_num_bufr_msgs(), num_msgs)
+        for msg_nr in range(1, num_msgs+1):
+            self.assertEqual(list(bufrfile1.get_raw_bufr_msg(msg_nr)[0]),
+                             list(bufrfile3.get_raw_bufr_msg(msg_nr)[0]))
+        bufrfile1.close()
+        bufrfile3.close()
+        os.remove(self.testoutputfile3u)
+        #  #]
     def test_run_example(self):
         #  #[
         """
@@ -1243,10 +1449,217 @@ class CheckRawBUFRFile(unittest.TestCase):
         success = call_cmd_and_verify_output(cmd)
         self.assertEqual(success, True)
         #  #]
+    def test_header_catalogue(self):
+        #  #[
+        """
+        test extracting the headers of all BUFR messages in python
+        """
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open(self.corruptedtestinputfile, 'rb', silent=True)
+        catalogue = bufrfile.get_header_catalogue()
+        self.assertEqual(len(catalogue), bufrfile.get_num_bufr_msgs())
+        first = catalogue[0]
+        self.assertEqual(first['offset'], 0)
+        self.assertEqual(first['length'], 6598)
+        self.assertEqual(first['edition'], 0)
+        self.assertEqual(first['centre'], 210)
+        self.assertEqual(first['data_category'], 12)
+        self.assertEqual(first['data_subcategory'], 8)
+        self.assertEqual(str(first['timestamp']), '1998-12-16T22:25:00')
+        self.assertEqual(first['num_subsets'], 361)
+        self.assertEqual(first['compressed'], True)
+        # all messages in this file use the same template
+        self.assertEqual(len(set(catalogue['template_hash'])), 1)
+        bufrfile.close()
+
+        # an edition 1 message, which stores the edition number in byte 4
+        # of section 1 where later editions store the master table
+        with open(self.corruptedtestinputfile, 'rb') as fileobj:
+            data = bytearray(fileobj.read(6598))
+        data[8-1] = 1
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open_data(bytes(data), silent=True)
+        catalogue = bufrfile.get_header_catalogue()
+        bufrfile.close()
+        self.assertEqual(len(catalogue), 1)
+        self.assertEqual(catalogue[0]['edition'], 1)
+        self.assertEqual(catalogue[0]['master_table'], 0)
+        self.assertEqual(catalogue[0]['centre'], 210)
+        self.assertEqual(catalogue[0]['data_category'], 12)
+        #  #]
+    def test_sidecar_index(self):
+        #  #[
+        """
+        test storing the message locations in a sidecar index file,
+        and using it after the file has been appended to
+        """
+        shutil.copyfile(self.corruptedtestinputfile, self.testoutputfile3u)
+        index_file = self.testoutputfile3u+'.bufridx'
+
+        bufrfile1 = RawBUFRFile(verbose=False)
+        bufrfile1.open(self.testoutputfile3u, 'rb', use_index=True)
+        num_msgs = bufrfile1.get_num_bufr_msgs()
+        pointers = bufrfile1.list_of_bufr_pointers
+        words = bufrfile1.get_raw_bufr_msg(1)[0].copy()
+        bufrfile1.close()
+        self.assertEqual(os.path.exists(index_file), True)
+
+        # the locations should now be taken from the index
+        bufrfile2 = RawBUFRFile(verbose=False)
+        bufrfile2.open(self.testoutputfile3u, 'rb', use_mmap=True,
+                       use_index=True)
+        self.assertEqual(bufrfile2.index_complete, True)
+        self.assertEqual(bufrfile2.get_num_bufr_msgs(), num_msgs)
+        self.assertEqual([(p[0], p[1], list(p[2]), list(p[3]))
+                          for p in bufrfile2.list_of_bufr_pointers],
+                         [(p[0], p[1], list(p[2]), list(p[3]))
+                          for p in pointers])
+        bufrfile2.close()
+
+        # append a message, which should be added to the index
+        bufrfile3 = RawBUFRFile(verbose=False)
+        bufrfile3.open(self.testoutputfile3u, 'ab')
+        bufrfile3.write_raw_bufr_msg(words)
+        bufrfile3.close()
+
+        bufrfile4 = RawBUFRFile(verbose=False)
+        bufrfile4.open(self.testoutputfile3u, 'rb', use_index=True)
+        self.assertEqual(bufrfile4.get_num_bufr_msgs(), num_msgs+1)
+        self.assertEqual(len(bufrfile4.get_header_catalogue()), num_msgs+1)
+        self.assertEqual(list(bufrfile4.get_raw_bufr_msg(num_msgs+1)[0]),
+                         list(words))
+        bufrfile4.close()
+
+        os.remove(self.testoutputfile3u)
+        os.remove(index_file)
+        #  #]
+    def test_header_filter(self):
+        #  #[
+        """
+        test selecting BUFR messages using a filter on their headers
+        """
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open(self.corruptedtestinputfile, 'rb', silent=True)
+        num_msgs = bufrfile.get_num_bufr_msgs()
+        headers = [bufrfile.get_msg_header(msg_nr)
+                   for msg_nr in range(1, num_msgs+1)]
+        bufrfile.close()
+        self.assertEqual(headers[1]['offset'], 6600)
+        self.assertEqual(headers[1]['unexp_descr_list'], ['312021'])
+
+        header_filter = make_header_filter({'data_category':12,
+                                            'offset':[0, 6600]})
+        self.assertEqual([header_filter(h) for h in headers],
+                         [True, True, False])
+        header_filter = make_header_filter(
+            {'unexp_descr_list':[312021],
+             'hour':lambda hour: hour > 22})
+        self.assertEqual([header_filter(h) for h in headers],
+                         [False, False, False])
+        self.assertRaises(IncorrectUsageError, make_header_filter,
+                          {'no_such_item':1})
+
+        # select messages from data holding 3 edition 0 messages
+        # followed by an edition 4 message with the same data category
+        data = b''
+        for bufr_file in [self.corruptedtestinputfile, self.testinputfile_ed4]:
+            with open(bufr_file, 'rb') as fileobj:
+                data += fileobj.read()
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open_data(data, silent=True)
+        num_msgs = bufrfile.get_num_bufr_msgs()
+        headers = [bufrfile.get_msg_header(msg_nr)
+                   for msg_nr in range(1, num_msgs+1)]
+        bufrfile.close()
+        self.assertEqual([int(h['edition']) for h in headers], [0, 0, 0, 4])
+
+        def selected_msgs(where):
+            """ return the numbers of the messages matching the filter """
+            header_filter = make_header_filter(where)
+            return [msg_nr for (msg_nr, header) in enumerate(headers, 1)
+                    if header_filter(header)]
+
+        self.assertEqual(selected_msgs({'data_category':12}), [1, 2, 3, 4])
+        self.assertEqual(selected_msgs({'data_category':12, 'edition':0,
+                                        'offset':lambda offset:
+                                        offset != 6600}), [1, 3])
+        self.assertEqual(selected_msgs({'edition':[3, 4]}), [4])
+        self.assertEqual(selected_msgs(lambda h: h['edition'] == 4), [4])
+        self.assertEqual(selected_msgs({'edition':2}), [])
+        #  #]
+    def test_open_data(self):
+        #  #[
+        """
+        test reading BUFR messages from data in memory and from file
+        objects, which should give the same messages as reading the file
+        """
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open(self.corruptedtestinputfile, 'rb', silent=True)
+        num_msgs = bufrfile.get_num_bufr_msgs()
+        words = [list(bufrfile.get_raw_bufr_msg(msg_nr)[0])
+                 for msg_nr in range(1, num_msgs+1)]
+        bufrfile.close()
+
+        with open(self.corruptedtestinputfile, 'rb') as fileobj:
+            raw_data = fileobj.read()
+        for use_mmap in [False, True]:
+            # note: the junk bytes in front cause misaligned messages
+            sources = [raw_data, bytearray(raw_data),
+                       memoryview(b'junk!'+raw_data),
+                       io.BytesIO(raw_data)]
+            for source in sources:
+                bufrfile = RawBUFRFile(verbose=False)
+                bufrfile.open(source, 'rb', use_mmap=use_mmap)
+                self.assertEqual(bufrfile.get_num_bufr_msgs(), num_msgs)
+                self.assertEqual([list(bufrfile.get_raw_bufr_msg(msg_nr)[0])
+                                  for msg_nr in range(1, num_msgs+1)],
+                                 words)
+                bufrfile.close()
+
+        # a file object passed in should not be closed
+        fileobj = open(self.corruptedtestinputfile, 'rb')
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open(fileobj, 'rb', use_mmap=True)
+        self.assertEqual(bufrfile.get_num_bufr_msgs(), num_msgs)
+        bufrfile.close()
+        self.assertEqual(fileobj.closed, False)
+        fileobj.close()
+        #  #]
+    def test_stream_framer(self):
+        #  #[
+        """
+        test locating BUFR messages in data that arrives in small chunks,
+        which should give the same messages as reading the file
+        """
+        bufrfile = RawBUFRFile(verbose=False)
+        bufrfile.open(self.corruptedtestinputfile, 'rb', silent=True)
+        num_msgs = bufrfile.get_num_bufr_msgs()
+        msgs = [bufrfile.get_raw_bufr_msg(msg_nr)
+                for msg_nr in range(1, num_msgs+1)]
+        bufrfile.close()
+
+        with open(self.corruptedtestinputfile, 'rb') as fileobj:
+            raw_data = b'junk BUFR junk'+fileobj.read()
+        for chunk_size in [1, 100, len(raw_data)]:
+            framer = BUFRStreamFramer()
+            framed_msgs = []
+            for chunk in read_chunks(io.BytesIO(raw_data), chunk_size):
+                framed_msgs.extend(framer.feed(chunk))
+                # only the start of a message should be kept
+                self.assertEqual(len(framer.carry) < 6598+chunk_size, True)
+            framed_msgs.extend(framer.finish())
+
+            self.assertEqual(len(framed_msgs), num_msgs)
+            for (msg, framed_msg) in zip(msgs, framed_msgs):
+                # note: the padding bytes of the last word may differ
+                self.assertEqual(list(msg[0][:-1]), list(framed_msg[0][:-1]))
+                self.assertEqual(list(msg[1]), list(framed_msg[1]))
+                self.assertEqual(list(msg[2]), list(framed_msg[2]))
+        #  #]
     #  #]
 
 class CheckBufrTable(unittest.TestCase):
-    #  #[ 4 tests
+    #  #[ 7 tests
     """
     a class to check the bufr_table.py file
     """
@@ -1306,6 +1719,156 @@ class CheckBufrTable(unittest.TestCase):
         success = call_cmd_and_verify_output(cmd)#, rundir='pybufr_ecmwf')
         self.assertEqual(success, True)
         #  #]
+    def test_table_cache(self):
+         #  #[
+        """
+        test reusing a set of tables from the table cache
+        """
+        tables_dir = os.path.join('pybufr_ecmwf', 'alt_bufr_tables')
+        table_code = '0000000000098015001.TXT'
+
+        btable = BufrTable(tables_dir=tables_dir,
+                           verbose=False, report_warnings=False)
+        btable.clear_table_cache()
+        for table_type in ['B', 'C', 'D']:
+            btable.load(os.path.join(tables_dir, table_type+table_code))
+        table_d = btable.table_d
+        self.assertEqual(btable.get_table_cache_info()['misses'], 1)
+
+        # loading the same tables again, after unloading them,
+        # should not parse the table files again
+        btable.unload_tables()
+        for table_type in ['B', 'C', 'D']:
+            btable.load(os.path.join(tables_dir, table_type+table_code))
+        self.assertTrue(btable.table_d is table_d)
+        self.assertEqual(btable.get_table_cache_info()['hits'], 1)
+        self.assertEqual(btable.get_table_cache_info()['misses'], 1)
+
+        btable.unload_tables()
+        btable.clear_table_cache()
+        #  #]
+    def test_compiled_tables(self):
+         #  #[
+        """
+        test precompiling a set of tables and loading the result
+        """
+        tables_dir = os.path.abspath(os.path.join('pybufr_ecmwf',
+                                                  'alt_bufr_tables'))
+        table_code = '0000000000098015001.TXT'
+        tmp_tables_dir = 'tmp_compiled_tables'
+        if os.path.exists(tmp_tables_dir):
+            shutil.rmtree(tmp_tables_dir)
+        os.mkdir(tmp_tables_dir)
+        tablefiles = []
+        for table_type in ['B', 'C', 'D']:
+            tablefile = os.path.join(tmp_tables_dir, table_type+table_code)
+            os.symlink(os.path.join(tables_dir, table_type+table_code),
+                       tablefile)
+            tablefiles.append(tablefile)
+
+        btable = BufrTable(tables_dir=tmp_tables_dir,
+                           verbose=False, report_warnings=False)
+        btable.clear_table_cache()
+        for tablefile in tablefiles:
+            btable.load(tablefile)
+        table_b = btable.table_b
+        table_d = btable.table_d
+        btable.unload_tables()
+        btable.clear_table_cache()
+
+        # tables compiled to another directory are only found
+        # if that directory is given as compiled_tables_dir
+        tmp_output_dir = os.path.join(tmp_tables_dir, 'compiled')
+        os.mkdir(tmp_output_dir)
+        compiled_file = btable.compile_tables(tablefiles[0], tmp_output_dir)
+        self.assertTrue(os.path.exists(compiled_file))
+        self.assertEqual(btable.load_compiled_tables(*tablefiles), None)
+        btable2 = BufrTable(tables_dir=tmp_tables_dir, verbose=False,
+                            report_warnings=False,
+                            compiled_tables_dir=tmp_output_dir)
+        self.assertNotEqual(btable2.load_compiled_tables(*tablefiles), None)
+
+        # a compiled file that is older than the table files,
+        # or that was made for other table files, is not unpickled
+        mtime = os.path.getmtime(os.path.realpath(tablefiles[0]))
+        os.utime(compiled_file, (mtime-10., mtime-10.))
+        self.assertEqual(btable2.load_compiled_tables(*tablefiles), None)
+        os.remove(compiled_file)
+        compiled_file = btable.compile_tables(tablefiles[0], tmp_tables_dir)
+        tablefiles2 = []
+        for tablefile in tablefiles:
+            tablefiles2.append(os.path.join(tmp_output_dir,
+                                            os.path.basename(tablefile)))
+            shutil.copy2(tablefile, tablefiles2[-1])
+        shutil.copy2(compiled_file, tmp_output_dir)
+        self.assertEqual(btable.load_compiled_tables(*tablefiles2), None)
+
+        table_set = btable.load_compiled_tables(*tablefiles)
+        self.assertNotEqual(table_set, None)
+
+        for tablefile in tablefiles:
+            btable.load(tablefile)
+        self.assertEqual(sorted(btable.table_b), sorted(table_b))
+        self.assertEqual(sorted(btable.table_d), sorted(table_d))
+        for ref in table_d:
+            self.assertEqual(btable.table_d[ref].expand(),
+                             table_d[ref].expand())
+
+        btable.unload_tables()
+        btable.clear_table_cache()
+        shutil.rmtree(tmp_tables_dir)
+        #  #]
+    def test_flag_definition(self):
+        #  #[
+        """
+        test converting code and flag table values to label indices
+        and bits, by comparing with a lookup in the flag dictionary
+        """
+        import numpy
+        tables_dir = os.path.join('pybufr_ecmwf', 'alt_bufr_tables')
+        table_code = '0000000000098015001.TXT'
+        btable = BufrTable(tables_dir=tables_dir,
+                           verbose=False, report_warnings=False)
+        btable.clear_table_cache()
+        btable.load(os.path.join(tables_dir, 'B'+table_code))
+        self.assertTrue(len(btable.table_c) > 0)
+
+        for ref in sorted(btable.table_c):
+            flag_table = btable.table_c[ref]
+            flag_dict = flag_table.flag_dict
+            keys = sorted(flag_dict)
+            values = keys + [max(keys+[0])+1, -1, 1.7e38, numpy.nan]
+            codes = flag_table.get_codes(values)
+            labels = flag_table.get_lookup()[1]
+            expected = []
+            for value in values:
+                if numpy.isfinite(value) and (int(value) in flag_dict):
+                    expected.append(flag_dict[int(value)])
+                else:
+                    expected.append(flag_table.undefined_text)
+            self.assertEqual(labels[codes].tolist(), expected)
+
+            if ref not in btable.table_b:
+                continue
+            data_width = btable.table_b[ref].data_width
+            int_values = list(range(min(2**data_width, 64)))+[2**data_width-1]
+            (bits, bit_labels) = flag_table.get_bits(int_values, data_width)
+            self.assertEqual(bits.shape, (len(int_values), data_width))
+            self.assertEqual(bit_labels.tolist(),
+                             [flag_dict.get(bit_nr, '')
+                              for bit_nr in range(1, data_width+1)])
+            for (row, value) in zip(bits.tolist(), int_values):
+                if value == 2**data_width-1:
+                    # all bits set means a missing value
+                    expected = [False]*data_width
+                else:
+                    expected = [bool((value >> (data_width-bit_nr)) & 1)
+                                for bit_nr in range(1, data_width+1)]
+                self.assertEqual(row, expected)
+
+        btable.unload_tables()
+        btable.clear_table_cache()
+        #  #]
     #  #]
 
 class CheckCustomTables(unittest.TestCase):
@@ -1410,7 +1973,7 @@ class CheckCustomTables(unittest.TestCase):
     #  #]
 
 class CheckBufr(unittest.TestCase):
-    #  #[ 11 tests
+    #  #[ 16 tests
     """
     a class to check the bufr.py file
     """
@@ -1579,6 +2142,253 @@ class CheckBufr(unittest.TestCase):
         success = call_cmd_and_verify_output(cmd)
         self.assertEqual(success, True)
         #  #]
+    def get_testfiles(self):
+        #  #[
+        """ return the list of test files used below """
+        return [self.testinputfile, self.testinputfile_unpadded,
+                self.testinputfile_gras, self.testinputfile_o3m]
+        #  #]
+    def decode_testfile(self, bufr_file):
+        #  #[
+        """
+        decode all messages in the given file with BUFRInterfaceECMWF,
+        using the library to decode the headers and setting up the tables
+        for each message, and return the list of decoded instances
+        """
+        bufr_objs = []
+        rbf = RawBUFRFile()
+        rbf.open(bufr_file, 'rb')
+        for msg_nr in range(1, rbf.get_num_bufr_msgs()+1):
+            (raw_msg, section_sizes, section_start_locations) = \
+                      rbf.get_raw_bufr_msg(msg_nr)
+            bufr_obj = BUFRInterfaceECMWF(raw_msg, section_sizes,
+                                          section_start_locations)
+            bufr_obj.decode_sections_012()
+            bufr_obj.setup_tables()
+            bufr_obj.decode_data()
+            bufr_obj.fill_descriptor_list_subset(subset=1)
+            bufr_objs.append(bufr_obj)
+        rbf.close()
+        return bufr_objs
+        #  #]
+    def test_extract_sections_012(self):
+        #  #[
+        """
+        test that the python header decoding fills ksec0, ksec1 and
+        the number of subsets in the same way as bus012 does
+        """
+        for bufr_file in self.get_testfiles():
+            rbf = RawBUFRFile()
+            rbf.open(bufr_file, 'rb')
+            for msg_nr in range(1, rbf.get_num_bufr_msgs()+1):
+                (raw_msg, section_sizes, section_start_locations) = \
+                          rbf.get_raw_bufr_msg(msg_nr)
+                bufr_obj = BUFRInterfaceECMWF(raw_msg, section_sizes,
+                                              section_start_locations)
+                bufr_obj.decode_sections_012()
+                ksup = bufr_obj.ksup.tolist()
+                ksec0 = bufr_obj.ksec0.tolist()
+                ksec1 = bufr_obj.ksec1.tolist()
+
+                bufr_obj.extract_sections_012()
+                self.assertEqual(bufr_obj.ksec0[:3].tolist(), ksec0[:3])
+                self.assertEqual(bufr_obj.ksec1[:18].tolist(), ksec1[:18])
+                self.assertEqual(bufr_obj.ksup[6-1], ksup[6-1])
+            rbf.close()
+        #  #]
+    def test_reader_headers_and_table_setup(self):
+        #  #[
+        """
+        test that BUFRReader, which decodes the headers in python and
+        reuses the tables setup for consecutive messages, gives the same
+        headers and data as decoding each message with bus012 and
+        setup_tables
+        """
+        for bufr_file in self.get_testfiles():
+            bufr_objs = self.decode_testfile(bufr_file)
+            reader = BUFRReader(bufr_file, warn_about_bufr_size=False)
+            table_setups = {}
+            for (msg, bufr_obj) in zip(reader, bufr_objs):
+                reader_obj = msg._bufr_obj
+                # the sections are decoded again by bufrex
+                self.assertEqual(reader_obj.ksec0[:3].tolist(),
+                                 bufr_obj.ksec0[:3].tolist())
+                self.assertEqual(reader_obj.ksec1[:18].tolist(),
+                                 bufr_obj.ksec1[:18].tolist())
+                self.assertEqual(reader_obj.ksup.tolist(),
+                                 bufr_obj.ksup.tolist())
+                self.assertEqual(reader_obj.table_b_file_to_use,
+                                 bufr_obj.table_b_file_to_use)
+
+                # messages with the same table setup key share the setup
+                key = reader_obj.get_table_setup_key()
+                if key in table_setups:
+                    self.assertTrue(reader_obj.bt is table_setups[key])
+                else:
+                    table_setups[key] = reader_obj.bt
+
+                for subset in range(1, bufr_obj.get_num_subsets()+1):
+                    values = []
+                    for obj in [reader_obj, bufr_obj]:
+                        obj.fill_descriptor_list_subset(subset)
+                        values.append(obj.get_subset_values(subset).tolist())
+                    self.assertEqual(values[0], values[1])
+            self.assertEqual(reader.msg_index, len(bufr_objs))
+            reader.close()
+        #  #]
+    def test_decode_caches(self):
+        #  #[
+        """
+        test that messages with the same template and table set share
+        their decode plan, names and units, and that these are not
+        reused for another table set
+        """
+        cls = BUFRInterfaceECMWF
+        for bufr_file in self.get_testfiles():
+            cls.decode_plan_cache.clear()
+            cls.names_and_units_cache.clear()
+
+            # insert cache entries for another table set, that should
+            # never be used
+            rbf = RawBUFRFile()
+            rbf.open(bufr_file, 'rb')
+            (raw_msg, section_sizes, section_start_locations) = \
+                      rbf.get_raw_bufr_msg(1)
+            rbf.close()
+            bufr_obj = BUFRInterfaceECMWF(raw_msg, section_sizes,
+                                          section_start_locations)
+            bufr_obj.decode_sections_012()
+            bufr_obj.setup_tables()
+            bufr_obj.extract_raw_descriptor_list()
+            bufr_obj.expand_raw_descriptor_list()
+            wrong_plan = {'delayed_repl_present':False,
+                          'expanded_descr_list':[]}
+            other_key = ('other table set',
+                         tuple(bufr_obj.py_unexp_descr_list))
+            cls.decode_plan_cache[other_key] = wrong_plan
+
+            bufr_objs = self.decode_testfile(bufr_file)
+            bufr_objs_2nd_pass = self.decode_testfile(bufr_file)
+            self.assertTrue(cls.decode_plan_cache[other_key] is wrong_plan)
+            # the unused entry is the least recently used one
+            self.assertEqual(next(iter(cls.decode_plan_cache)), other_key)
+
+            for (bufr_obj, bufr_obj2) in zip(bufr_objs, bufr_objs_2nd_pass):
+                # the plan is taken from the cache
+                key = (bufr_obj.bt.table_set_key,
+                       tuple(bufr_obj.py_unexp_descr_list))
+                self.assertTrue(bufr_obj.decode_plan is
+                                cls.decode_plan_cache[key])
+                self.assertTrue(bufr_obj2.decode_plan is
+                                bufr_obj.decode_plan)
+                self.assertTrue(bufr_obj.decode_plan is not wrong_plan)
+
+                # the cached names and units match the decoded ones
+                ktdexl = bufr_obj.ktdexl
+                expected_names = [b''.join(row).decode('ascii').strip()
+                                  for row in bufr_obj.cnames[:ktdexl].tolist()]
+                expected_units = [b''.join(row).decode('ascii').strip()
+                                  for row in bufr_obj.cunits[:ktdexl].tolist()]
+                for obj in [bufr_obj, bufr_obj2]:
+                    (names, units) = obj.get_names_and_units()
+                    self.assertEqual(names, expected_names)
+                    self.assertEqual(units, expected_units)
+
+                # the number of descriptors needed for a template with
+                # delayed replication is remembered
+                if bufr_obj.delayed_repl_present:
+                    template_key = (bufr_obj.table_b_file_to_use,
+                                    tuple(bufr_obj.py_unexp_descr_list))
+                    self.assertTrue(cls.nr_of_descriptors_cache[template_key]
+                                    >= bufr_obj.ksup[5-1])
+
+        cls.decode_plan_cache.clear()
+        cls.names_and_units_cache.clear()
+        #  #]
+    def test_decode_strings(self):
+        #  #[
+        """
+        test the conversion of character arrays and cvals entries
+        to strings, by comparing with a conversion per row
+        """
+        def row_to_string(row):
+            """ join the characters of a row """
+            return b''.join(row).decode('ascii', 'replace').strip()
+
+        for bufr_file in self.get_testfiles():
+            for bufr_obj in self.decode_testfile(bufr_file):
+                for char_array in [bufr_obj.cnames, bufr_obj.cunits]:
+                    self.assertEqual(
+                        bufr_obj.decode_strings(char_array),
+                        [row_to_string(row) for row in char_array.tolist()])
+                self.assertEqual(bufr_obj.decode_strings(
+                    bufr_obj.cnames[:0]), [])
+
+                if bufr_obj.delayed_repl_present:
+                    continue
+                num_strings = bufr_obj.cvals.shape[0]
+                for i in bufr_obj.get_ccittia5_indices():
+                    if i >= bufr_obj.get_num_elements():
+                        continue
+                    values = bufr_obj.get_raw_values(i).tolist()
+                    values.extend([0., -1000., (num_strings+1)*1000.])
+                    expected = []
+                    for value in values:
+                        if 1000. <= value < (num_strings+1)*1000.:
+                            row = bufr_obj.cvals[int(value/1000)-1].tolist()
+                            expected.append(row_to_string(row))
+                        else:
+                            expected.append('')
+                    strings = bufr_obj.get_cvals_strings(values)
+                    if python3:
+                        self.assertEqual(strings.tolist(), expected)
+                    else:
+                        self.assertEqual([string.decode('ascii', 'replace')
+                                          for string in strings.tolist()],
+                                         expected)
+        #  #]
+    def test_categorical_values(self):
+        #  #[
+        """
+        test the conversion of code and flag table values to codes,
+        labels and bits, by comparing with a lookup per value
+        """
+        for bufr_file in self.get_testfiles():
+            reader = BUFRReader(bufr_file, warn_about_bufr_size=False)
+            for msg in reader:
+                bufr_obj = msg._bufr_obj
+                if bufr_obj.delayed_repl_present:
+                    continue
+                for i in bufr_obj.get_flag_table_indices():
+                    flag_table = bufr_obj.get_flag_table(i)
+                    flag_dict = flag_table.flag_dict
+                    values = bufr_obj.get_raw_values(i).tolist()
+
+                    (codes, labels) = msg.get_categorical_values(i)
+                    expected = []
+                    for value in values:
+                        if (abs(value) < 2.**62) and (int(value) in flag_dict):
+                            expected.append(flag_dict[int(value)])
+                        else:
+                            expected.append(flag_table.undefined_text)
+                    self.assertEqual(labels[codes].tolist(), expected)
+
+                    result = bufr_obj.get_flag_bits(i)
+                    if result is None:
+                        continue
+                    (bits, bit_labels) = result
+                    descr = int(bufr_obj.ktdexp[i])
+                    data_width = bufr_obj.bt.table_b[descr].data_width
+                    for (row, value) in zip(bits.tolist(), values):
+                        if 0 <= value < 2**data_width-1:
+                            expected = [bool((int(value) >>
+                                              (data_width-bit_nr)) & 1)
+                                        for bit_nr in range(1, data_width+1)]
+                        else:
+                            expected = [False]*data_width
+                        self.assertEqual(row, expected)
+            reader.close()
+        #  #]
     #  #]
 
 class CheckAddedFortranCode(unittest.TestCase):